@@ -1,30 +1,177 @@
 import os
+import json
 import pickle
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
-import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 SCOPES = ["https://www.googleapis.com/auth/youtube.upload"]
 CREDENTIALS_FILE = "resources/client_secrets.json"
+TOKEN_FILE = "token.json"
+# Token format used before JSON storage; migrated on first use.
+LEGACY_TOKEN_FILE = "token.pickle"
+# Credentials are refreshed this long before they expire.
+REFRESH_MARGIN_SECONDS = 5 * 60
+MIN_REFRESH_DELAY_SECONDS = 30
 
-def get_authenticated_service():
-    """Authenticate with YouTube Data API."""
-    try:
-        credentials = None
-        if os.path.exists("token.pickle"):
-            with open("token.pickle", "rb") as token:
-                credentials = pickle.load(token)
-        if not credentials or not credentials.valid:
-            if credentials and credentials.expired and credentials.refresh_token:
-                credentials.refresh(Request())
+# The default channel keeps using TOKEN_FILE; other channels get token_<name>.json next to it.
+DEFAULT_CHANNEL = "default"
+
+_services = {}
+_refresh_timers = {}
+_service_lock = threading.RLock()
+
+def token_file_for(channel=DEFAULT_CHANNEL):
+    """Returns the path of the token file that holds a channel's credentials."""
+    if not channel or channel == DEFAULT_CHANNEL:
+        return TOKEN_FILE
+    return os.path.join(os.path.dirname(TOKEN_FILE), f"token_{channel}.json")
+
+@contextmanager
+def _token_file_lock(exclusive, token_file=None):
+    """Holds an inter-process lock on the token file so several workers can share it."""
+    lock_path = f"{token_file or TOKEN_FILE}.lock"
+    with open(lock_path, "a+") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        else:
+            # msvcrt only has exclusive locks; LK_LOCK gives up after ten one-second attempts.
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
             else:
-                flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-                credentials = flow.run_local_server(port=0)
-            with open("token.pickle", "wb") as token:
-                pickle.dump(credentials, token)
-        logging.info("Successfully authenticated with YouTube API.")
-        return build("youtube", "v3", credentials=credentials)
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _read_token_file(token_file=None):
+    """Reads credentials from the JSON token file, or returns None if there is none."""
+    token_file = token_file or TOKEN_FILE
+    if not os.path.exists(token_file):
+        return None
+    with open(token_file, "r", encoding="utf-8") as f:
+        return Credentials.from_authorized_user_info(json.load(f), SCOPES)
+
+def _write_token_file(credentials, token_file=None):
+    """Atomically replaces the JSON token file. The caller must hold the exclusive lock."""
+    token_file = token_file or TOKEN_FILE
+    temp_path = f"{token_file}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(credentials.to_json())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, token_file)
+
+def _load_credentials(token_file=None):
+    """Loads stored credentials, migrating a legacy token.pickle to JSON if needed."""
+    token_file = token_file or TOKEN_FILE
+    with _token_file_lock(exclusive=False, token_file=token_file):
+        credentials = _read_token_file(token_file)
+    if credentials is None and token_file == TOKEN_FILE and os.path.exists(LEGACY_TOKEN_FILE):
+        with open(LEGACY_TOKEN_FILE, "rb") as token:
+            credentials = pickle.load(token)
+        with _token_file_lock(exclusive=True, token_file=token_file):
+            _write_token_file(credentials, token_file)
+        logging.info(f"Migrated {LEGACY_TOKEN_FILE} to {token_file}.")
+    return credentials
+
+def _refresh_credentials(credentials, token_file=None):
+    """Refreshes credentials in place, reusing a newer token another process may have stored."""
+    token_file = token_file or TOKEN_FILE
+    with _token_file_lock(exclusive=True, token_file=token_file):
+        stored = _read_token_file(token_file)
+        if stored is not None and stored.valid and (credentials.expiry is None or
+                                                    (stored.expiry and stored.expiry > credentials.expiry)):
+            credentials.token = stored.token
+            credentials.expiry = stored.expiry
+            logging.debug("Picked up credentials refreshed by another process.")
+            return
+        credentials.refresh(Request())
+        _write_token_file(credentials, token_file)
+        logging.debug(f"Refreshed YouTube API credentials ({token_file}).")
+
+def _schedule_refresh(credentials, channel=DEFAULT_CHANNEL):
+    """Arms a background timer that refreshes a channel's credentials shortly before they expire."""
+    timer = _refresh_timers.pop(channel, None)
+    if timer is not None:
+        timer.cancel()
+    if credentials.expiry is None or not credentials.refresh_token:
+        return
+    seconds_left = (credentials.expiry - datetime.utcnow()).total_seconds()
+    delay = max(seconds_left - REFRESH_MARGIN_SECONDS, MIN_REFRESH_DELAY_SECONDS)
+    timer = threading.Timer(delay, _background_refresh, args=(credentials, channel))
+    timer.daemon = True
+    timer.start()
+    _refresh_timers[channel] = timer
+
+def _background_refresh(credentials, channel=DEFAULT_CHANNEL):
+    """Timer callback: refreshes the shared credentials and re-arms the timer."""
+    try:
+        with _service_lock:
+            _refresh_credentials(credentials, token_file_for(channel))
     except Exception as e:
-        logging.error(f"Error during authentication: {e}")
-        raise
+        logging.error(f"Background credential refresh failed for channel '{channel}': {e}")
+    _schedule_refresh(credentials, channel)
+
+def get_authenticated_service(channel=DEFAULT_CHANNEL):
+    """
+    Authenticate with YouTube Data API.
+
+    Each channel has its own token file (see token_file_for). A channel's
+    service object is built once per process from the discovery document
+    bundled with google-api-python-client, so no network fetch is needed, and
+    is reused by later calls. Its credentials are kept fresh by a background
+    timer.
+    """
+    channel = channel or DEFAULT_CHANNEL
+    with _service_lock:
+        service = _services.get(channel)
+        if service is not None:
+            return service
+        token_file = token_file_for(channel)
+        try:
+            credentials = _load_credentials(token_file)
+            if not credentials or not credentials.valid:
+                if credentials and credentials.expired and credentials.refresh_token:
+                    _refresh_credentials(credentials, token_file)
+                else:
+                    logging.info(f"Authorize the YouTube channel '{channel}' in the browser window.")
+                    flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+                    credentials = flow.run_local_server(port=0)
+                    with _token_file_lock(exclusive=True, token_file=token_file):
+                        _write_token_file(credentials, token_file)
+            logging.info(f"Successfully authenticated with YouTube API (channel '{channel}').")
+            service = build("youtube", "v3", credentials=credentials, static_discovery=True, cache_discovery=False)
+            _services[channel] = service
+            _schedule_refresh(credentials, channel)
+            return service
+        except Exception as e:
+            logging.error(f"Error during authentication for channel '{channel}': {e}")
+            raise
+
+def clear_cached_service(channel=None):
+    """Drops the cached service of one channel, or of every channel, e.g. after a stored token was revoked."""
+    with _service_lock:
+        for name in [channel] if channel else list(_services) + list(_refresh_timers):
+            timer = _refresh_timers.pop(name, None)
+            if timer is not None:
+                timer.cancel()
+            _services.pop(name, None)
@@ -0,0 +1,124 @@
+import json
+import time
+import random
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import build_http
+
+class FakeYouTubeServer:
+    """
+    Local stand-in for the YouTube resumable upload endpoint.
+
+    Implements just enough of the protocol for videos.insert: the session
+    POST, chunked PUTs answered with 308 + Range, the empty status-query PUT,
+    and a final 200 with the new video ID. `latency` (seconds) is added to
+    every request and `error_rate` of chunk PUTs fail with a 503.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._ids = itertools.count(1)
+        self.stats = {"sessions": 0, "chunks": 0, "errors": 0, "bytes": 0, "videos": 0}
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-youtube", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def build_service(self):
+        """Builds a real googleapiclient YouTube service whose requests go to this server."""
+        document = json.loads(get_static_doc("youtube", "v3"))
+        document["rootUrl"] = self.url
+        return build_from_document(document, http=build_http())
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, status, headers=None, body=b""):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def do_POST(self):
+                self._read_body()
+                if fake.latency:
+                    time.sleep(fake.latency)
+                with fake._lock:
+                    session_id = str(next(fake._ids))
+                    fake._sessions[session_id] = {
+                        "received": 0,
+                        "size": int(self.headers.get("X-Upload-Content-Length") or 0),
+                    }
+                    fake.stats["sessions"] += 1
+                self._reply(200, {"Location": f"{fake.url}upload/session/{session_id}"})
+
+            def do_PUT(self):
+                body = self._read_body()
+                if fake.latency:
+                    time.sleep(fake.latency)
+                session_id = self.path.rsplit("/", 1)[-1]
+                with fake._lock:
+                    session = fake._sessions.get(session_id)
+                    if session is None:
+                        self._reply(404)
+                        return
+                    content_range = self.headers.get("Content-Range", "")
+                    if content_range.startswith("bytes */"):
+                        self._reply_progress(session, session_id)
+                        return
+                    if fake.error_rate and fake._random.random() < fake.error_rate:
+                        fake.stats["errors"] += 1
+                        self._reply(503)
+                        return
+                    start = int(content_range.split(" ")[1].split("-")[0]) if content_range else 0
+                    total = content_range.rsplit("/", 1)[-1] if content_range else "*"
+                    if total != "*":
+                        session["size"] = int(total)
+                    if start == session["received"]:
+                        session["received"] += len(body)
+                        fake.stats["bytes"] += len(body)
+                    fake.stats["chunks"] += 1
+                    self._reply_progress(session, session_id)
+
+            def _reply_progress(self, session, session_id):
+                if session["size"] and session["received"] >= session["size"]:
+                    fake.stats["videos"] += 1
+                    body = json.dumps({"id": f"fake{session_id}", "kind": "youtube#video"}).encode()
+                    self._reply(200, {"Content-Type": "application/json"}, body)
+                elif session["received"]:
+                    self._reply(308, {"Range": f"bytes=0-{session['received'] - 1}"})
+                else:
+                    self._reply(308)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
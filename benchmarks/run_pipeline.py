@@ -0,0 +1,202 @@
+"""
+End-to-end benchmark of the download and upload stages.
+
+Runs the real download_and_combine_clips and process_and_upload_clips
+against local stand-ins: a synthetic pyktok (benchmarks/stubs/pyktok.py)
+and a local YouTube resumable-upload server (benchmarks/fake_youtube.py).
+
+    python -m benchmarks.run_pipeline --scales 10,1000,10000 --output bench.json
+    python -m benchmarks.run_pipeline --scales 10,1000 --compare bench.json
+
+Results are JSON with wall time, peak RSS and a per-stage breakdown for each
+scale, tagged with the current git commit so runs can be compared.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from unittest import mock
+
+STUBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+# Must happen before anything imports pyktok. Spawned download workers inherit
+# sys.path, so they pick up the stub too.
+if STUBS_DIR not in sys.path:
+    sys.path.insert(0, STUBS_DIR)
+
+import metrics
+import youtube_uploader
+from state_store import StateStore
+from tiktok_downloader import download_and_combine_clips, DEFAULT_DOWNLOAD_CONCURRENCY
+from youtube_uploader import process_and_upload_clips, DEFAULT_UPLOAD_CHUNK_SIZE
+from benchmarks.fake_youtube import FakeYouTubeServer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def _peak_rss_mb():
+    """Returns the peak RSS of this process and of its finished children, in MB."""
+    if resource is None:
+        return {"self": None, "children": None}
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(STUBS_DIR)
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_scenario(creators, videos_per_creator, video_bytes=64 * 1024, concurrency=DEFAULT_DOWNLOAD_CONCURRENCY,
+                 scrape_latency=0.0, upload_latency=0.0, error_rate=0.0, max_uploads=None,
+                 chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE, channels=1, workdir=None):
+    """
+    Runs one download+upload pass over synthetic creators and returns its
+    measurements. Reusing a `workdir` runs against the state of the previous
+    pass, which measures a steady-state (incremental) run. Uploads are spread
+    over `channels` upload lanes with effectively unlimited quota.
+    """
+    os.environ["BENCH_VIDEO_BYTES"] = str(video_bytes)
+    os.environ["BENCH_SCRAPE_LATENCY"] = str(scrape_latency)
+    total_videos = creators * videos_per_creator
+    max_uploads = total_videos if max_uploads is None else max_uploads
+
+    own_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="tt2yt-bench-")
+    server = FakeYouTubeServer(latency=upload_latency, error_rate=error_rate).start()
+    original_cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        state = StateStore(os.path.join(workdir, "state.db"))
+        run_id, _ = state.begin_run()
+        download_dir = os.path.join(workdir, "tiktok_downloads")
+        metadata_path = os.path.join(download_dir, "metadata.csv")
+        creator_names = [f"creator{index:05d}" for index in range(creators)]
+
+        started = time.perf_counter()
+        download_and_combine_clips(creator_names, download_dir, state, run_id, metadata_path, videos_per_creator,
+                                   concurrency=concurrency)
+        download_seconds = time.perf_counter() - started
+        rss_after_download = _peak_rss_mb()
+
+        upload_started = time.perf_counter()
+        # Every lane gets its own client: httplib2 connections are not thread-safe.
+        with mock.patch.object(youtube_uploader, "get_authenticated_service",
+                               side_effect=lambda channel=None: server.build_service()):
+            process_and_upload_clips(download_dir, max_uploads, threading.Event(), state=state, run_id=run_id,
+                                     scheduled_publishing=True, chunk_size=chunk_size,
+                                     channels=[f"bench{index}" for index in range(channels)],
+                                     routing="round_robin", daily_quota_units=sys.maxsize)
+        upload_seconds = time.perf_counter() - upload_started
+        wall_seconds = time.perf_counter() - started
+        state.complete_run(run_id)
+
+        return {
+            "name": f"{creators}x{videos_per_creator}",
+            "creators": creators,
+            "videos_per_creator": videos_per_creator,
+            "video_bytes": video_bytes,
+            "concurrency": concurrency,
+            "channels": channels,
+            "wall_seconds": round(wall_seconds, 3),
+            "stages": {
+                "download_seconds": round(download_seconds, 3),
+                "upload_seconds": round(upload_seconds, 3),
+            },
+            "throughput": {
+                "creators_per_second": round(creators / download_seconds, 2) if download_seconds else None,
+                "uploads_per_second": round(server.stats["videos"] / upload_seconds, 2) if upload_seconds else None,
+                "upload_mb_per_second": round(server.stats["bytes"] / 1048576 / upload_seconds, 2) if upload_seconds else None,
+            },
+            "peak_rss_mb": {"after_download": rss_after_download, "after_upload": _peak_rss_mb()},
+            "videos_collected": state.run_video_count(run_id),
+            "videos_uploaded": state.uploaded_count(),
+            "server": dict(server.stats),
+        }
+    finally:
+        os.chdir(original_cwd)
+        server.stop()
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def _compare(results, baseline_path):
+    """Prints the change of each scenario's timings relative to an earlier results file."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {scenario["name"]: scenario for scenario in json.load(f)["scenarios"]}
+    print(f"Compared with {baseline_path}:")
+    for scenario in results["scenarios"]:
+        before = baseline.get(scenario["name"])
+        if not before:
+            print(f"  {scenario['name']}: no baseline")
+            continue
+        for label, now, then in [
+            ("wall", scenario["wall_seconds"], before["wall_seconds"]),
+            ("download", scenario["stages"]["download_seconds"], before["stages"]["download_seconds"]),
+            ("upload", scenario["stages"]["upload_seconds"], before["stages"]["upload_seconds"]),
+        ]:
+            change = (now - then) / then * 100 if then else 0
+            print(f"  {scenario['name']} {label}: {then:.3f}s -> {now:.3f}s ({change:+.1f}%)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="10", help="Comma-separated creator counts, e.g. 10,1000,10000.")
+    parser.add_argument("--videos", type=int, default=3, help="Videos per creator.")
+    parser.add_argument("--video-bytes", type=int, default=64 * 1024, help="Size of each synthetic mp4.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_DOWNLOAD_CONCURRENCY)
+    parser.add_argument("--scrape-latency", type=float, default=0.0, help="Seconds each fake creator scrape takes.")
+    parser.add_argument("--upload-latency", type=float, default=0.0, help="Seconds added to each upload request.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of upload chunks answered with 503.")
+    parser.add_argument("--max-uploads", type=int, default=None, help="Upload cap; defaults to every video.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_UPLOAD_CHUNK_SIZE)
+    parser.add_argument("--channels", type=int, default=1, help="Number of upload lanes (channels).")
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    parser.add_argument("--compare", help="Earlier results file to compare against.")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s - %(levelname)s - %(module)s - %(message)s")
+    results = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scenarios": [],
+    }
+    for scale in (int(value) for value in args.scales.split(",")):
+        scenario = run_scenario(
+            scale, args.videos, video_bytes=args.video_bytes, concurrency=args.concurrency,
+            scrape_latency=args.scrape_latency, upload_latency=args.upload_latency, error_rate=args.error_rate,
+            max_uploads=args.max_uploads, chunk_size=args.chunk_size, channels=args.channels
+        )
+        results["scenarios"].append(scenario)
+        print(f"{scenario['name']}: wall {scenario['wall_seconds']}s "
+              f"(download {scenario['stages']['download_seconds']}s, upload {scenario['stages']['upload_seconds']}s), "
+              f"peak RSS {scenario['peak_rss_mb']['after_upload']['self']} MB", file=sys.stderr)
+    results["metrics"] = metrics.REGISTRY.render()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.compare:
+        _compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
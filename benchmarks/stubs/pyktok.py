@@ -0,0 +1,74 @@
+"""
+Synthetic stand-in for pyktok used by the benchmark harness.
+
+benchmarks/run_pipeline.py puts this directory first on sys.path, so both the
+harness and the spawned download workers import it instead of the real
+package. Listing a creator's feed sleeps BENCH_SCRAPE_LATENCY
+seconds and returns `video_ct` stable video URLs; saving them writes mp4s
+of BENCH_VIDEO_BYTES bytes and matching metadata rows into the current
+directory, the way pyktok does.
+"""
+import os
+import csv
+import asyncio
+import time
+import zlib
+
+METADATA_HEADER = [
+    'video_id', 'video_timestamp', 'video_duration', 'video_locationcreated', 'video_diggcount',
+    'video_sharecount', 'video_commentcount', 'video_playcount', 'video_description', 'video_is_ad',
+    'video_stickers', 'author_username', 'author_name', 'author_followercount', 'author_followingcount',
+    'author_heartcount', 'author_videocount', 'author_diggcount', 'author_verified', 'poi_name',
+    'poi_address', 'poi_city'
+]
+
+def specify_browser(browser):
+    pass
+
+def _video_ids(username, video_ct):
+    """Stable, unique, newest-first IDs for a creator."""
+    base = (zlib.crc32(username.encode()) % 10**6) * 10**6
+    return [str(7 * 10**18 + base + video_ct - index) for index in range(video_ct)]
+
+def _metadata_row(username, video_id):
+    seed = int(video_id) % 1000
+    return {
+        'video_id': video_id,
+        'video_timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'video_duration': 15 + seed % 45,
+        'video_diggcount': seed * 10,
+        'video_sharecount': seed,
+        'video_commentcount': seed // 2,
+        'video_playcount': seed * 100,
+        'video_description': f"Synthetic clip {video_id} from {username} #bench #clip{seed % 7} #fyp",
+        'video_is_ad': False,
+        'author_username': username,
+        'author_name': username.title(),
+        'author_verified': False,
+    }
+
+async def get_video_urls(tt_ent, ent_type="user", video_ct=30, headless=True):
+    time.sleep(float(os.environ.get("BENCH_SCRAPE_LATENCY", "0")))
+    return [f"https://www.tiktok.com/@{tt_ent}/video/{video_id}" for video_id in _video_ids(tt_ent, video_ct)]
+
+def save_tiktok_multi_urls(video_urls, save_video=False, metadata_fn='', sleep=4, browser_name=None):
+    video_bytes = int(os.environ.get("BENCH_VIDEO_BYTES", str(64 * 1024)))
+    rows = []
+    for video_url in video_urls:
+        username, video_id = video_url.split("/@", 1)[1].split("/video/")
+        if save_video:
+            with open(f"@{username}_video_{video_id}.mp4", "wb") as f:
+                f.write(os.urandom(video_bytes))
+        rows.append(_metadata_row(username, video_id))
+    if metadata_fn:
+        write_header = not os.path.exists(metadata_fn)
+        with open(metadata_fn, "a", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=METADATA_HEADER)
+            if write_header:
+                writer.writeheader()
+            writer.writerows(rows)
+
+def save_tiktok_multi_page(tt_ent, ent_type="user", video_ct=30, headless=True, save_video=False,
+                           metadata_fn='', sleep=4, browser_name=None):
+    video_urls = asyncio.run(get_video_urls(tt_ent, ent_type, video_ct, headless))
+    save_tiktok_multi_urls(video_urls, save_video, metadata_fn, sleep, browser_name)
@@ -1,36 +1,35 @@
 import discord
 from discord.ext import commands
 import os
-import json
-import threading
+import time
 import logging
 from dotenv import load_dotenv
-import worker
+import io
+import metrics
+import profiler
+import ranking
 from logger import setup_logger
+from supervisor import WorkerSupervisor
+from config_store import get_config_store, ConfigError
+from state_store import get_state_store
+import creator_health
 import asyncio
 import signal
 
 # --- Setup ---
 load_dotenv()
-setup_logger()
+# Shared with the worker through config.json, which it re-reads when it changes.
+config_store = get_config_store()
+try:
+    setup_logger(config_store.get())
+except ConfigError as e:
+    setup_logger()
+    logging.warning(f"Using the default log settings: {e}")
 intents = discord.Intents.default()
 bot = commands.Bot(command_prefix="!", intents=intents)
 
-# --- Global state management for the worker thread ---
-worker_thread = None
-stop_event = None
-CONFIG_PATH = "config.json"
-CONFIG_LOCK = threading.Lock()
-
-def load_config():
-    with CONFIG_LOCK:
-        with open(CONFIG_PATH, 'r') as f:
-            return json.load(f)
-
-def save_config(data):
-    with CONFIG_LOCK:
-        with open(CONFIG_PATH, 'w') as f:
-            json.dump(data, f, indent=2)
+# --- The worker runs in a supervised child process ---
+supervisor = WorkerSupervisor()
 
 # --- Control Panel UI View ---
 class ControlPanelView(discord.ui.View):
@@ -39,8 +38,7 @@ class ControlPanelView(discord.ui.View):
         self.update_button_states()
 
     def update_button_states(self):
-        global worker_thread
-        is_running = worker_thread is not None and worker_thread.is_alive()
+        is_running = supervisor.is_running()
         
         self.start_button.disabled = is_running
         self.stop_button.disabled = not is_running
@@ -48,11 +46,7 @@ class ControlPanelView(discord.ui.View):
 
     @discord.ui.button(label="Start", style=discord.ButtonStyle.green, custom_id="persistent_start")
     async def start_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        global worker_thread, stop_event
-        if worker_thread is None or not worker_thread.is_alive():
-            stop_event = threading.Event()
-            worker_thread = threading.Thread(target=worker.run_bot_cycle, args=(stop_event,), daemon=True)
-            worker_thread.start()
+        if supervisor.start():
             await interaction.response.send_message("✅ Bot process started in the background.", ephemeral=True)
             logging.info("Bot process started via Discord.")
         else:
@@ -62,11 +56,12 @@ class ControlPanelView(discord.ui.View):
 
     @discord.ui.button(label="Stop", style=discord.ButtonStyle.red, custom_id="persistent_stop")
     async def stop_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        global worker_thread, stop_event
-        if worker_thread and worker_thread.is_alive() and stop_event:
-            stop_event.set()
-            await interaction.response.send_message("⏳ Sending stop signal... The worker will stop shortly.", ephemeral=True)
-            logging.info("Stop signal sent to worker thread.")
+        if supervisor.stop():
+            await interaction.response.send_message(
+                f"⏳ Sending stop signal... The worker will stop shortly and is killed after "
+                f"{supervisor.stop_timeout + supervisor.kill_timeout}s at the latest.", ephemeral=True
+            )
+            logging.info("Stop signal sent to the worker process.")
         else:
             await interaction.response.send_message("❌ Bot is not currently running.", ephemeral=True)
         self.update_button_states()
@@ -74,9 +69,8 @@ class ControlPanelView(discord.ui.View):
         
     @discord.ui.button(label="Restart", style=discord.ButtonStyle.blurple, custom_id="persistent_restart")
     async def restart_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        global worker_thread, stop_event
         # This button is now only usable when the bot is stopped.
-        if worker_thread and worker_thread.is_alive():
+        if supervisor.is_running():
              await interaction.response.send_message("❌ Please stop the bot before restarting.", ephemeral=True)
              return
         
@@ -96,74 +90,260 @@ async def panel(interaction: discord.Interaction):
         description="Use the buttons below to manage the TikTok downloader and uploader.",
         color=discord.Color.blue()
     )
-    is_running = worker_thread is not None and worker_thread.is_alive()
-    status = "Running" if is_running else "Stopped"
+    status = supervisor.status()["state"].capitalize()
     embed.add_field(name="Current Status", value=f"**{status}**", inline=False)
     
     view = ControlPanelView()
     await interaction.response.send_message(embed=embed, view=view)
 
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m" if hours else f"{minutes}m {seconds:02d}s"
+
+def _format_status(status):
+    """Renders the supervisor's status and the worker's per-stage progress as a Discord message."""
+    icons = {"running": "✅ Running", "stopping": "⏳ Stopping", "stopped": "❌ Stopped"}
+    lines = [f"The bot process is currently: **{icons.get(status['state'], status['state'])}**"]
+    if status["state"] != "stopped" and status.get("started_at"):
+        lines[0] += f" (pid `{status.get('pid')}`, up {_format_duration(time.time() - status['started_at'])})"
+
+    stages = status.get("stages", {})
+    worker_stage = stages.get("worker", {})
+    if worker_stage.get("run_id"):
+        lines.append(f"- Run `{worker_stage['run_id']}` · cycle `{worker_stage.get('status', '?')}`")
+    download = stages.get("download")
+    if download:
+        lines.append(
+            f"- **Download** `{download.get('status')}`: creators `{download.get('creators_done', 0)}/"
+            f"{download.get('creators_total', 0)}` (failed `{download.get('creators_failed', 0)}`, "
+            f"in flight `{download.get('in_flight', 0)}`) · videos `{download.get('videos', 0)}`"
+        )
+    upload = stages.get("upload")
+    if upload:
+        lines.append(
+            f"- **Upload** `{upload.get('status')}`: uploaded `{upload.get('uploaded', 0)}/{upload.get('limit', 0)}` · "
+            f"in flight `{upload.get('in_flight', 0)}` · channels `{', '.join(upload.get('channels', []))}`"
+        )
+    jobs = stages.get("jobs")
+    if jobs:
+        lines.append(
+            f"- **Jobs**: worker `{jobs.get('worker_id')}` · creators claimed `{jobs.get('creators_claimed', 0)}` · "
+            f"uploads held `{jobs.get('uploads_held', 0)}`"
+        )
+    retention = stages.get("retention")
+    if retention:
+        lines.append(
+            f"- **Retention**: reclaimed `{retention.get('reclaimed_bytes', 0) / 1048576:.1f} MB` · "
+            f"directory `{retention.get('directory_bytes', 0) / 1048576:.1f} MB`"
+        )
+    updated = max((stage.get("updated_at", 0) for stage in stages.values()), default=0)
+    if updated:
+        lines.append(f"_Last update {_format_duration(time.time() - updated)} ago._")
+    return "\n".join(lines)
+
 @bot.tree.command(name="status", description="Checks the current status of the bot.")
 async def status(interaction: discord.Interaction):
-    is_running = worker_thread is not None and worker_thread.is_alive()
-    status = "✅ Running" if is_running else "❌ Stopped"
-    await interaction.response.send_message(f"The bot process is currently: **{status}**", ephemeral=True)
+    await interaction.response.send_message(_format_status(supervisor.status()), ephemeral=True)
+
+def _format_metrics_summary(samples):
+    """Condenses the worker's Prometheus metrics into a short Discord message."""
+    total = lambda name, **labels: metrics.sample_total(samples, name, **labels)
+    average = lambda name: total(f"{name}_sum") / total(f"{name}_count") if total(f"{name}_count") else 0
+
+    api_requests = total("youtube_api_requests_total")
+    error_rate = total("youtube_api_errors_total") / api_requests * 100 if api_requests else 0
+    return (
+        f"**Worker**\n"
+        f"- Running: `{'yes' if total('worker_running') else 'no'}` · "
+        f"cycles completed `{total('worker_cycles_total', outcome='completed'):.0f}`, "
+        f"stopped `{total('worker_cycles_total', outcome='stopped'):.0f}`, "
+        f"errored `{total('worker_cycles_total', outcome='error'):.0f}`\n"
+        f"**Downloads**\n"
+        f"- Creators ok `{total('tiktok_creator_downloads_total', outcome='ok'):.0f}`, "
+        f"failed `{total('tiktok_creator_downloads_total') - total('tiktok_creator_downloads_total', outcome='ok'):.0f}`, "
+        f"in flight `{total('tiktok_downloads_in_flight'):.0f}`\n"
+        f"- Avg latency `{average('tiktok_creator_download_seconds'):.1f}s` · "
+        f"avg videos/creator `{average('tiktok_videos_per_creator'):.1f}`\n"
+        f"- Metadata merge avg `{average('metadata_merge_seconds') * 1000:.1f}ms` · "
+        f"rows merged `{total('metadata_rows_merged_total'):.0f}`\n"
+        f"**Uploads**\n"
+        f"- Uploaded `{total('youtube_uploads_total', outcome='ok'):.0f}`, "
+        f"failed `{total('youtube_uploads_total') - total('youtube_uploads_total', outcome='ok'):.0f}` · "
+        f"queue depth `{total('upload_queue_depth'):.0f}`\n"
+        f"- Sent `{total('youtube_upload_bytes_total') / 1048576:.1f} MB` · "
+        f"last chunk `{total('youtube_upload_bytes_per_second') / 1048576:.2f} MB/s` · "
+        f"avg upload `{average('youtube_upload_seconds'):.1f}s`\n"
+        f"- API error rate `{error_rate:.1f}%` of {api_requests:.0f} requests"
+    )
+
+@bot.tree.command(name="metrics", description="Shows a summary of the pipeline's performance metrics.")
+async def metrics_command(interaction: discord.Interaction):
+    if supervisor.is_running():
+        # Ask the worker process to refresh the file from its live registry first.
+        try:
+            await asyncio.to_thread(supervisor.call, "write_metrics")
+        except RuntimeError as e:
+            logging.warning(f"Could not refresh metrics from the worker: {e}")
+    samples = metrics.read_prometheus_file()
+    if not samples:
+        await interaction.response.send_message("No metrics have been recorded yet.", ephemeral=True)
+        return
+    await interaction.response.send_message(_format_metrics_summary(samples), ephemeral=True)
+
+@bot.tree.command(name="profile", description="Profiles the running worker and attaches the result.")
+@discord.app_commands.describe(seconds=f"How long to sample, 1 to {profiler.MAX_PROFILE_SECONDS} seconds")
+async def profile_command(interaction: discord.Interaction, seconds: int = 30):
+    if not supervisor.is_running():
+        await interaction.response.send_message("❌ Bot is not currently running.", ephemeral=True)
+        return
+    seconds = min(max(1, seconds), profiler.MAX_PROFILE_SECONDS)
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        result = await asyncio.to_thread(supervisor.call, "profile", timeout=seconds + 30, seconds=seconds)
+    except RuntimeError as e:
+        await interaction.followup.send(f"❌ Could not profile the worker: {e}", ephemeral=True)
+        return
+    summary = result["summary"]
+    files = [
+        discord.File(result["path"], filename=os.path.basename(result["path"])),
+        discord.File(io.BytesIO(summary.encode("utf-8")), filename="profile_summary.txt"),
+    ]
+    # The top of the summary inline, the rest in the attachment.
+    preview = summary[:1600].rsplit("\n", 1)[0] if len(summary) > 1600 else summary
+    await interaction.followup.send(f"🔬 **Profile of {seconds}s**\n*{profiler.SCOPE_NOTE}*\n```\n{preview}\n```",
+                                    files=files, ephemeral=True)
 
 # --- Config Management Commands ---
 creators_group = discord.app_commands.Group(name="creators", description="Manage the list of TikTok creators.")
 
 @creators_group.command(name="list", description="Lists all current TikTok creators.")
 async def list_creators(interaction: discord.Interaction):
-    config = load_config()
-    creator_list = "\n".join([f"- `{creator}`" for creator in config["tiktok_creators"]])
+    config = config_store.get()
+    creator_list = "\n".join([f"- `{creator}`" for creator in config.get("tiktok_creators", [])])
     await interaction.response.send_message(f"**Current Creators:**\n{creator_list}", ephemeral=True)
 
 @creators_group.command(name="add", description="Adds a new TikTok creator to the list.")
 async def add_creator(interaction: discord.Interaction, username: str):
-    config = load_config()
-    if username.lower() not in config["tiktok_creators"]:
-        config["tiktok_creators"].append(username.lower())
-        save_config(config)
+    username = username.lower()
+    added = []
+
+    def add(config):
+        creators = config.setdefault("tiktok_creators", [])
+        if username not in creators:
+            creators.append(username)
+            added.append(username)
+
+    try:
+        # The update fsyncs and replaces config.json, so it runs off the event loop.
+        await asyncio.to_thread(config_store.update, add)
+    except ConfigError as e:
+        await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+        return
+    if added:
         await interaction.response.send_message(f"✅ Added `{username}` to the creator list.", ephemeral=True)
     else:
         await interaction.response.send_message(f"❌ `{username}` is already in the list.", ephemeral=True)
 
 @creators_group.command(name="remove", description="Removes a TikTok creator from the list.")
 async def remove_creator(interaction: discord.Interaction, username: str):
-    config = load_config()
-    if username.lower() in config["tiktok_creators"]:
-        config["tiktok_creators"].remove(username.lower())
-        save_config(config)
+    username = username.lower()
+    removed = []
+
+    def remove(config):
+        creators = config.setdefault("tiktok_creators", [])
+        if username in creators:
+            creators.remove(username)
+            removed.append(username)
+
+    try:
+        await asyncio.to_thread(config_store.update, remove)
+    except ConfigError as e:
+        await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+        return
+    if removed:
         await interaction.response.send_message(f"✅ Removed `{username}` from the creator list.", ephemeral=True)
     else:
         await interaction.response.send_message(f"❌ `{username}` was not found in the list.", ephemeral=True)
 
+def _format_creator_health(creators, records, now=None):
+    """Renders each configured creator's download health as a Discord message."""
+    now = now or time.time()
+    icons = {"healthy": "💚", "backing_off": "🟡", "retry_due": "🟡", "half_open": "🟠", "open": "⛔"}
+    lines = ["**Creator Health:**"]
+    for creator in creators:
+        record = records.get(creator)
+        state = creator_health.health_state(record, now)
+        line = f"- `{creator}` {icons[state]} {state.replace('_', ' ')}"
+        if state != "healthy":
+            line += f" · failures `{record['consecutive_failures']}`"
+            if record["next_attempt_at"] and record["next_attempt_at"] > now:
+                line += f" · retry in `{_format_duration(record['next_attempt_at'] - now)}`"
+            if record["last_error"]:
+                line += f" · _{record['last_error'][:80]}_"
+        lines.append(line)
+    message = "\n".join(lines)
+    # Discord messages are limited to 2000 characters.
+    return message if len(message) <= 2000 else message[:1990].rsplit("\n", 1)[0] + "\n…"
+
+@creators_group.command(name="health", description="Shows each creator's download health and backoff state.")
+async def creators_health(interaction: discord.Interaction):
+    creators = config_store.get().get("tiktok_creators", [])
+    records = await asyncio.to_thread(lambda: get_state_store().all_creator_health())
+    await interaction.response.send_message(_format_creator_health(creators, records), ephemeral=True)
+
 bot.tree.add_command(creators_group)
 
 @bot.tree.command(name="config", description="Set bot configuration values.")
-async def config(interaction: discord.Interaction, uploads_per_day: int, downloads_per_creator: int):
-    config = load_config()
-    config["max_uploads_per_day"] = uploads_per_day
-    config["videos_to_check_per_creator"] = downloads_per_creator
-    save_config(config)
+@discord.app_commands.describe(
+    weight_plays="Ranking weight of play count",
+    weight_likes="Ranking weight of like count",
+    weight_shares="Ranking weight of share count",
+    weight_comments="Ranking weight of comment count",
+    weight_recency="Ranking weight of how new a clip is",
+    weight_fairness="Ranking penalty for several clips from the same creator"
+)
+async def config(interaction: discord.Interaction, uploads_per_day: int = None, downloads_per_creator: int = None,
+                 weight_plays: float = None, weight_likes: float = None, weight_shares: float = None,
+                 weight_comments: float = None, weight_recency: float = None, weight_fairness: float = None):
+    weight_updates = {
+        "plays": weight_plays, "likes": weight_likes, "shares": weight_shares,
+        "comments": weight_comments, "recency": weight_recency, "fairness": weight_fairness,
+    }
+
+    def apply(config):
+        if uploads_per_day is not None:
+            config["max_uploads_per_day"] = uploads_per_day
+        if downloads_per_creator is not None:
+            config["videos_to_check_per_creator"] = downloads_per_creator
+        ranking_weights = config.get("ranking_weights", {})
+        ranking_weights.update({name: value for name, value in weight_updates.items() if value is not None})
+        if ranking_weights:
+            config["ranking_weights"] = ranking_weights
+
+    try:
+        config = await asyncio.to_thread(config_store.update, apply)
+    except ConfigError as e:
+        await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+        return
+
+    ranking_weights = config.get("ranking_weights", {})
+    weights = ranking.resolve_weights(ranking_weights)
     await interaction.response.send_message(
         f"✅ Config updated:\n"
-        f"- Uploads per day: `{uploads_per_day}`\n"
-        f"- Downloads per creator: `{downloads_per_creator}`",
+        f"- Uploads per day: `{config.get('max_uploads_per_day', 5)}`\n"
+        f"- Downloads per creator: `{config.get('videos_to_check_per_creator', 10)}`\n"
+        f"- Ranking weights: " + ", ".join(f"{name} `{value:g}`" for name, value in weights.items()),
         ephemeral=True
     )
 
 async def shutdown(signal, loop):
     """Handles the graceful shutdown of the bot and worker thread."""
     logging.warning(f"Received exit signal {signal.name}... shutting down.")
-    global worker_thread, stop_event
-    if worker_thread and worker_thread.is_alive() and stop_event:
-        logging.info("Signaling worker thread to stop...")
-        stop_event.set()
-        # Give the thread a moment to stop
-        worker_thread.join(timeout=10)
-        if worker_thread.is_alive():
-            logging.warning("Worker thread did not stop in time.")
+    if supervisor.is_running():
+        logging.info("Signaling worker process to stop...")
+        # Waits for a clean exit, then terminates or kills the worker.
+        await asyncio.to_thread(supervisor.stop, True)
 
     tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
     [task.cancel() for task in tasks]
@@ -0,0 +1,174 @@
+import os
+import copy
+import json
+import logging
+import tempfile
+import threading
+from quota import ROUTING_STRATEGIES
+from jobqueue import JOB_QUEUE_BACKENDS
+
+CONFIG_PATH = "config.json"
+# Rotation intervals TimedRotatingFileHandler accepts.
+LOG_ROTATE_WHEN = ("S", "M", "H", "D", "midnight", "W0", "W1", "W2", "W3", "W4", "W5", "W6")
+
+class ConfigError(ValueError):
+    """Raised when config.json is missing, cannot be parsed or does not match the schema."""
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _is_str_list(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+# Known keys and what their values must look like. Other keys are kept as they are.
+CONFIG_SCHEMA = {
+    "tiktok_creators": (_is_str_list, "a list of usernames"),
+    "videos_to_check_per_creator": (lambda v: _is_int(v) and v >= 1, "an integer of at least 1"),
+    "max_uploads_per_day": (lambda v: _is_int(v) and v >= 0, "an integer of at least 0"),
+    "download_concurrency": (lambda v: _is_int(v) and v >= 1, "an integer of at least 1"),
+    "upload_queue_size": (lambda v: _is_int(v) and v >= 1, "an integer of at least 1"),
+    "ranking_pool_size": (lambda v: _is_int(v) and v >= 1, "an integer of at least 1"),
+    "scheduled_publishing": (lambda v: isinstance(v, bool), "true or false"),
+    "perceptual_hashing": (lambda v: isinstance(v, bool), "true or false"),
+    "upload_chunk_size_mb": (lambda v: _is_number(v) and v > 0, "a positive number"),
+    "download_dir_budget_mb": (lambda v: v is None or (_is_number(v) and v >= 0), "a number of at least 0 or null"),
+    "ranking_weights": (lambda v: isinstance(v, dict) and all(_is_number(w) for w in v.values()),
+                        "an object of numeric weights"),
+    "youtube_channels": (_is_str_list, "a list of channel names"),
+    "channel_routing": (lambda v: v in ROUTING_STRATEGIES, f"one of {', '.join(ROUTING_STRATEGIES)}"),
+    "channel_affinity": (lambda v: isinstance(v, dict) and all(isinstance(c, str) for c in v.values()),
+                         "an object mapping usernames to channel names"),
+    "daily_quota_units": (lambda v: _is_int(v) and v > 0, "a positive integer"),
+    "shorts_check": (lambda v: isinstance(v, bool), "true or false"),
+    "shorts_max_duration_seconds": (lambda v: _is_number(v) and v > 0, "a positive number"),
+    "shorts_aspect_tolerance": (lambda v: _is_number(v) and v >= 0, "a number of at least 0"),
+    "transcode_max_bitrate_kbps": (lambda v: v is None or (_is_int(v) and v > 0), "a positive integer or null"),
+    "media_check_concurrency": (lambda v: _is_int(v) and v >= 1, "an integer of at least 1"),
+    "backlog_max_age_days": (lambda v: _is_number(v) and v >= 0, "a number of at least 0"),
+    "backlog_skip_downloads": (lambda v: isinstance(v, bool), "true or false"),
+    "creator_failure_threshold": (lambda v: _is_int(v) and v >= 1, "an integer of at least 1"),
+    "creator_cooldown_hours": (lambda v: _is_number(v) and v > 0, "a positive number"),
+    "distributed": (lambda v: v is None or (isinstance(v, dict) and v.get("backend", "sqlite") in JOB_QUEUE_BACKENDS
+                                            and (v.get("backend") != "redis" or isinstance(v.get("url"), str))),
+                    f"null or an object with a backend of {', '.join(JOB_QUEUE_BACKENDS)} (redis needs a url)"),
+    "log_file": (lambda v: isinstance(v, str) and v != "", "a file path"),
+    "log_max_mb": (lambda v: _is_number(v) and v > 0, "a positive number"),
+    "log_backup_count": (lambda v: _is_int(v) and v >= 0, "an integer of at least 0"),
+    "log_rotate_when": (lambda v: v is None or v in LOG_ROTATE_WHEN, f"null or one of {', '.join(LOG_ROTATE_WHEN)}"),
+    "log_debug_rate_limits": (lambda v: isinstance(v, dict) and all(_is_number(r) and r > 0 for r in v.values()),
+                              "an object mapping modules (or \"*\") to records per second"),
+    "log_debug_sampling": (lambda v: isinstance(v, dict) and all(_is_number(r) and 0 <= r <= 1 for r in v.values()),
+                           "an object mapping modules (or \"*\") to the fraction of records kept"),
+    "metrics_port": (lambda v: v is None or (_is_int(v) and 0 < v < 65536), "a port number or null"),
+}
+
+def validate_config(config):
+    """Checks config against CONFIG_SCHEMA. Raises ConfigError listing every invalid key."""
+    if not isinstance(config, dict):
+        raise ConfigError("The config must be a JSON object.")
+    problems = [f"'{key}' must be {description}" for key, (is_valid, description) in CONFIG_SCHEMA.items()
+                if key in config and not is_valid(config[key])]
+    if problems:
+        raise ConfigError("Invalid config: " + "; ".join(problems) + ".")
+    return config
+
+class ConfigStore:
+    """
+    In-memory copy of config.json shared by everything in one process.
+
+    get() costs a stat() call: the file is parsed again only when its mtime,
+    size or inode changed, so edits made by another process (the bot while
+    the worker runs) show up on the next read. A file that fails validation
+    is logged and ignored, and the last valid config stays in effect.
+
+    update() rewrites the file through a temp file and os.replace, so readers
+    and crashes only ever see the old or the new config, never a partial one.
+    """
+
+    def __init__(self, path=CONFIG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._config = None
+        self._signature = None
+
+    def _file_signature(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _reload_if_changed(self):
+        try:
+            signature = self._file_signature()
+        except OSError as e:
+            if self._config is None:
+                raise ConfigError(f"Could not load {self.path}: {e}") from e
+            if self._signature is not None:
+                logging.error(f"Cannot read {self.path}, keeping the previous config: {e}")
+                self._signature = None
+            return
+        if signature == self._signature:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = validate_config(json.load(f))
+        except (ValueError, OSError) as e:
+            if self._config is None:
+                raise ConfigError(f"Could not load {self.path}: {e}") from e
+            logging.error(f"Ignoring changed {self.path}, keeping the previous config: {e}")
+            self._signature = signature
+            return
+        if self._config is not None:
+            logging.info(f"🔄 Reloaded {self.path}.")
+        self._config = config
+        self._signature = signature
+
+    def get(self):
+        """Returns a copy of the current config, reloading the file if it changed."""
+        with self._lock:
+            self._reload_if_changed()
+            return copy.deepcopy(self._config)
+
+    def update(self, mutate):
+        """
+        Applies `mutate(config)` to a copy of the current config, validates the
+        result and writes it atomically. Returns the new config.
+        """
+        with self._lock:
+            self._reload_if_changed()
+            config = copy.deepcopy(self._config)
+            mutate(config)
+            validate_config(config)
+            self._write(config)
+            self._config = config
+            self._signature = self._file_signature()
+            return copy.deepcopy(config)
+
+    def _write(self, config):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix=".config-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(config, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_config_store(path=CONFIG_PATH):
+    """Returns the process-wide ConfigStore for the given path."""
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = ConfigStore(path)
+            _stores[path] = store
+        return store
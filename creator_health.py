@@ -0,0 +1,134 @@
+import re
+import time
+import random
+import logging
+import metrics
+
+DEFAULT_HEALTH_POLICY = {
+    # Consecutive failed runs after which the circuit opens and the creator is skipped.
+    "failure_threshold": 3,
+    # Until then, a failing creator waits this long before its next run, doubling per failure.
+    "backoff_base_seconds": 3600,
+    # How long an open circuit skips a creator. Doubles each time it reopens, up to the maximum.
+    "cooldown_seconds": 86400,
+    "max_cooldown_seconds": 7 * 86400,
+    # Transient errors (network, rate limits) are first retried within the download itself.
+    "retry_attempts": 3,
+    "retry_base_seconds": 2,
+}
+
+# Matched against "ExceptionType: message"; pyktok and TikTok do not raise typed errors.
+PERMANENT_ERRORS = re.compile(
+    r"private|not found|\b404\b|does(?:n't| not) exist|couldn'?t find|no such user|banned|suspended", re.IGNORECASE
+)
+TRANSIENT_ERRORS = re.compile(
+    r"time[d ]?out|temporar|rate.?limit|too many requests|\b429\b|\b5\d\d\b|connection|reset by peer|"
+    r"network|unavailable|try again", re.IGNORECASE
+)
+
+CREATOR_FAILURES = metrics.counter("creator_download_failures_total", "Failed creator downloads, by error class.")
+CREATOR_RETRIES = metrics.counter("creator_download_retries_total", "Retries of transient creator download errors.")
+CIRCUITS_OPENED = metrics.counter("creator_circuits_opened_total", "Times a creator's circuit breaker opened.")
+
+def classify_error(error):
+    """Returns "transient", "permanent" or "unknown" for a download error."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return "transient"
+    text = f"{type(error).__name__}: {error}"
+    if PERMANENT_ERRORS.search(text):
+        return "permanent"
+    if TRANSIENT_ERRORS.search(text):
+        return "transient"
+    return "unknown"
+
+def jittered_delay(base_seconds, attempt):
+    """Exponential backoff with full jitter: a random delay up to base_seconds * 2**attempt."""
+    return random.uniform(0, base_seconds * 2 ** attempt)
+
+def retry_transient(action, description, policy=None, sleep=time.sleep, on_retry=None):
+    """
+    Runs action(), retrying transient errors with jittered backoff. Other
+    errors are raised at once. Each retry calls `on_retry()`, or counts it in
+    the retries metric if there is none.
+    """
+    policy = dict(DEFAULT_HEALTH_POLICY, **(policy or {}))
+    for attempt in range(policy["retry_attempts"]):
+        try:
+            return action()
+        except Exception as e:
+            if attempt + 1 >= policy["retry_attempts"] or classify_error(e) != "transient":
+                raise
+            delay = jittered_delay(policy["retry_base_seconds"], attempt)
+            (on_retry or CREATOR_RETRIES.inc)()
+            logging.warning(f"{description} failed ({e}). Retrying in {delay:.1f}s.")
+            sleep(delay)
+
+def health_state(record, now=None):
+    """
+    Returns a creator's state: "healthy", "backing_off" (failed recently,
+    waiting), "retry_due", "open" (circuit open, skipped) or "half_open"
+    (cooldown over, the next run is a trial).
+    """
+    if not record or not record["consecutive_failures"]:
+        return "healthy"
+    due = is_due(record, now)
+    if record["circuit_open"]:
+        return "half_open" if due else "open"
+    return "retry_due" if due else "backing_off"
+
+def is_due(record, now=None):
+    """Returns True if a creator may be downloaded now."""
+    return not record or (record["next_attempt_at"] or 0) <= (now or time.time())
+
+def schedule_key(record):
+    """Sort key putting healthy creators first, then the ones that failed least (and longest ago)."""
+    if not record:
+        return (0, 0)
+    return (record["consecutive_failures"], record["last_failure_at"] or 0)
+
+def record_retries(count):
+    """Counts retries a download worker process reported (its own metrics are not exported)."""
+    if count:
+        CREATOR_RETRIES.inc(count)
+
+def record_success(state, username):
+    """Closes a creator's circuit and clears their failures."""
+    record = state.get_creator_health(username)
+    if record and record["consecutive_failures"]:
+        logging.info(f"💚 {username} recovered after {record['consecutive_failures']} failed attempts.")
+    state.save_creator_health(username, 0, False, 0, last_failure_at=record["last_failure_at"] if record else None,
+                              last_success_at=time.time())
+
+def record_failure(state, username, error, policy=None, kind=None):
+    """
+    Counts a failed download and schedules the creator's next attempt:
+    exponential backoff below the failure threshold, then an open circuit
+    for the (doubling) cooldown. Permanent errors such as a private or
+    deleted account open the circuit right away. Delays are jittered so
+    creators that failed together do not all come back together. `kind`
+    is the error's class if it was already classified, e.g. in the worker
+    process that raised it.
+    """
+    policy = dict(DEFAULT_HEALTH_POLICY, **(policy or {}))
+    record = state.get_creator_health(username) or {"consecutive_failures": 0, "circuit_opens": 0,
+                                                     "circuit_open": 0, "last_success_at": None}
+    kind = kind or classify_error(error)
+    CREATOR_FAILURES.inc(kind=kind)
+    now = time.time()
+    failures = record["consecutive_failures"] + 1
+    circuit_opens = record["circuit_opens"]
+    circuit_open = kind == "permanent" or failures >= policy["failure_threshold"]
+    if circuit_open:
+        circuit_opens += 1
+        delay = min(policy["max_cooldown_seconds"], policy["cooldown_seconds"] * 2 ** (circuit_opens - 1))
+        delay *= random.uniform(0.8, 1.0)
+        CIRCUITS_OPENED.inc()
+        logging.warning(f"⛔ Skipping {username} for {delay / 3600:.1f}h after {failures} failed attempts "
+                        f"({kind} error: {error}).")
+    else:
+        delay = min(policy["cooldown_seconds"], policy["backoff_base_seconds"] * 2 ** (failures - 1))
+        delay *= random.uniform(0.5, 1.0)
+        logging.info(f"{username} failed ({kind} error). Next attempt in {delay / 60:.0f} minutes.")
+    state.save_creator_health(username, failures, circuit_open, circuit_opens, last_error=f"{error}"[:500],
+                              last_failure_at=now, last_success_at=record["last_success_at"],
+                              next_attempt_at=now + delay)
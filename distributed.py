@@ -0,0 +1,308 @@
+import os
+import time
+import socket
+import logging
+import threading
+import metrics
+import progress
+import creator_health
+from jobqueue import DEFAULT_LEASE_SECONDS
+
+DEFAULT_POLL_SECONDS = 5
+# Every creator is downloaded once per period, by whichever worker claims it first.
+DEFAULT_DOWNLOAD_PERIOD_HOURS = 24
+DOWNLOAD_JOB = "download"
+UPLOAD_JOB = "upload"
+
+JOBS = metrics.counter("distributed_jobs_total", "Leased queue jobs handled by this worker, by kind and outcome.")
+
+def worker_identity(settings):
+    """Returns (host, worker_id) for the `distributed` config section."""
+    host = settings.get("host") or socket.gethostname()
+    return host, f"{host}:{os.getpid()}"
+
+def upload_job_kind(settings, host):
+    """
+    Upload jobs can only run where the clip is. Without shared storage they
+    are queued per host, so they survive a crashed worker and are picked up
+    by the next worker on that host.
+    """
+    return UPLOAD_JOB if settings.get("shared_storage", False) else f"{UPLOAD_JOB}:{host}"
+
+def uploaded_marker(video_id):
+    """Name of the queue marker that tells every worker a video is on YouTube."""
+    return f"uploaded:{video_id}"
+
+class SharedState:
+    """
+    Wraps a worker's local state store for distributed mode. Which videos are
+    uploaded and how much YouTube quota each channel has booked today are
+    kept in the shared job queue, so workers on different hosts never upload
+    the same video twice or book a channel past its daily quota. Everything
+    else (duplicate-content fingerprints, download high-water marks, the
+    backlog) stays in the local store and is per host.
+    """
+
+    def __init__(self, job_queue, state):
+        self.job_queue = job_queue
+        self.state = state
+
+    def __getattr__(self, name):
+        return getattr(self.state, name)
+
+    def is_uploaded(self, video_id):
+        return self.state.is_uploaded(video_id) or self.job_queue.is_marked(uploaded_marker(video_id))
+
+    def record_upload_attempt(self, video_id, success, *args, **kwargs):
+        self.state.record_upload_attempt(video_id, success, *args, **kwargs)
+        if success:
+            self.job_queue.mark(uploaded_marker(video_id))
+
+    @staticmethod
+    def _quota_counter(channel, quota_day):
+        return f"quota:{channel}:{quota_day}"
+
+    def quota_units_used(self, channel, quota_day):
+        return self.job_queue.counter_value(self._quota_counter(channel, quota_day))
+
+    def reserve_quota_units(self, channel, quota_day, units, limit):
+        return self.job_queue.add_to_counter(self._quota_counter(channel, quota_day), units, limit)
+
+    def release_quota_units(self, channel, quota_day, units):
+        self.job_queue.take_from_counter(self._quota_counter(channel, quota_day), units)
+
+    def exhaust_quota(self, channel, quota_day, limit):
+        self.job_queue.raise_counter(self._quota_counter(channel, quota_day), limit)
+
+class LeaseKeeper:
+    """Holds leased jobs and renews their leases from a background thread until they are settled."""
+
+    def __init__(self, job_queue, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.job_queue = job_queue
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._renew, name="lease-keeper", daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def hold(self, job):
+        with self._lock:
+            self._jobs[job["key"]] = job
+
+    def held(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def settle(self, job, outcome, error=None, retry_delay=60):
+        """Completes, fails or releases a held job and stops renewing it."""
+        with self._lock:
+            self._jobs.pop(job["key"], None)
+        if outcome == "completed":
+            kept = self.job_queue.complete(job)
+        elif outcome == "failed":
+            kept = self.job_queue.fail(job, error, retry_delay)
+        else:
+            kept = self.job_queue.release(job)
+        JOBS.inc(kind=job["kind"], outcome=outcome if kept else "lost")
+        if not kept:
+            logging.warning(f"Lease on {job['kind']} job {job['key']} was lost before it could be {outcome}.")
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+
+    def _renew(self):
+        while not self._closed.wait(self.lease_seconds / 3):
+            for job in self.held():
+                try:
+                    renewed = self.job_queue.heartbeat(job, self.lease_seconds)
+                except Exception as e:
+                    # The queue may be briefly unreachable; the lease has time left until the next try.
+                    logging.warning(f"Could not renew the lease on {job['kind']} job {job['key']}: {e}")
+                    continue
+                if not renewed:
+                    logging.warning(f"Lost the lease on {job['kind']} job {job['key']} to another worker.")
+                    JOBS.inc(kind=job["kind"], outcome="lost")
+                    with self._lock:
+                        self._jobs.pop(job["key"], None)
+
+class ClaimedCreators:
+    """
+    Creator source for download_and_combine_clips in distributed mode. Every
+    configured creator is queued as one download job per period; each call
+    claims one more job and returns the creators claimed so far, so the
+    download stage takes a new creator from the queue whenever a slot frees.
+    """
+
+    def __init__(self, job_queue, worker_id, state, run_id, configured_creators, stop_event,
+                 lease_seconds=DEFAULT_LEASE_SECONDS, period_hours=DEFAULT_DOWNLOAD_PERIOD_HOURS):
+        self.job_queue = job_queue
+        self.worker_id = worker_id
+        self.state = state
+        self.run_id = run_id
+        self.configured_creators = configured_creators
+        self.stop_event = stop_event
+        self.lease_seconds = lease_seconds
+        self.period = int(time.time() // (period_hours * 3600))
+        self.creators = []
+        self._keeper = LeaseKeeper(job_queue, lease_seconds)
+
+    def __call__(self):
+        configured = list(self.configured_creators())
+        # Idempotent, so every worker can queue the config it sees, including creators added mid-run.
+        for creator in configured:
+            self.job_queue.enqueue(DOWNLOAD_JOB, f"{self.period}:{creator}", {"creator": creator})
+        self._settle_processed()
+        if not self.stop_event.is_set():
+            self._claim_next(set(configured))
+        return list(self.creators)
+
+    def _claim_next(self, configured):
+        processed = self.state.processed_creators(self.run_id)
+        while True:
+            job = self.job_queue.claim(DOWNLOAD_JOB, self.worker_id, self.lease_seconds)
+            if job is None:
+                return
+            JOBS.inc(kind=DOWNLOAD_JOB, outcome="claimed")
+            creator = job["payload"]["creator"]
+            if (creator not in configured or creator in processed or creator in self.creators
+                    or not creator_health.is_due(self.state.get_creator_health(creator))):
+                # Removed from the config, already downloaded by this worker's run, or backing off.
+                self._keeper.settle(job, "completed")
+                continue
+            logging.info(f"Claimed download job for {creator} (attempt {job['attempts']}).")
+            self._keeper.hold(job)
+            self.creators.append(creator)
+            progress.update("jobs", worker_id=self.worker_id, creators_claimed=len(self.creators))
+            return
+
+    def _settle_processed(self):
+        processed = self.state.processed_creators(self.run_id)
+        for job in self._keeper.held():
+            if job["payload"]["creator"] in processed:
+                self._keeper.settle(job, "completed")
+
+    def close(self):
+        """Settles the jobs still held: failed creators are retried, a stop gives them back untouched."""
+        self._settle_processed()
+        for job in self._keeper.held():
+            if self.stop_event.is_set():
+                self._keeper.settle(job, "released")
+            else:
+                self._keeper.settle(job, "failed", f"{job['payload']['creator']} was not downloaded")
+        self._keeper.close()
+
+class JobCandidates:
+    """
+    Stands in for the pipeline's CandidateQueue in distributed mode. The
+    download stage's rows are queued as upload jobs (one per video, so no
+    video is queued twice), and the upload stage drains claimed jobs.
+
+    A worker holds at most as many upload jobs as it may still upload
+    (`max_held`), so the rest stay free for other workers. Jobs are settled
+    as their uploads finish: uploaded ones complete, failed ones go back for
+    a retry.
+
+    With a SharedState as `state`, videos another worker already uploaded
+    are neither queued nor claimed.
+    """
+
+    def __init__(self, job_queue, kind, worker_id, state, download_dir, stop_event, max_held,
+                 lease_seconds=DEFAULT_LEASE_SECONDS, poll_seconds=DEFAULT_POLL_SECONDS):
+        self.job_queue = job_queue
+        self.kind = kind
+        self.worker_id = worker_id
+        self.state = state
+        self.download_dir = download_dir
+        self.stop_event = stop_event
+        self.max_held = max_held
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._closed = threading.Event()
+        self._claimed_at = {}
+        self._keeper = LeaseKeeper(job_queue, lease_seconds)
+
+    # --- Download side ---
+    def put_many(self, rows):
+        queued = sum(self.job_queue.enqueue(self.kind, row["video_id"], row) for row in rows
+                     if row.get("video_id") and not self.state.is_uploaded(row["video_id"]))
+        if queued:
+            JOBS.inc(queued, kind=self.kind, outcome="queued")
+        return True
+
+    def close(self):
+        """Signals that this worker's download stage will not queue any more uploads."""
+        self._closed.set()
+
+    def discard_remaining(self):
+        """Nothing is buffered locally; queued jobs stay in the shared queue."""
+
+    # --- Upload side ---
+    def _producing(self):
+        """True while this worker or another one may still queue uploads."""
+        if not self._closed.is_set():
+            return True
+        return self.job_queue.counts(DOWNLOAD_JOB).get("leased", 0) > 0
+
+    def _claim(self, max_rows=None):
+        """Claims upload jobs up to max_held (and at most max_rows). Returns their rows."""
+        rows = []
+        while len(self._keeper) < self.max_held() and (max_rows is None or len(rows) < max_rows):
+            job = self.job_queue.claim(self.kind, self.worker_id, self.lease_seconds)
+            if job is None:
+                break
+            JOBS.inc(kind=self.kind, outcome="claimed")
+            row = job["payload"]
+            if self.state.is_uploaded(row["video_id"]):
+                self._keeper.settle(job, "completed")
+                continue
+            video_path = os.path.join(self.download_dir, f"@{row.get('author_username')}_video_{row['video_id']}.mp4")
+            if not os.path.exists(video_path):
+                self._keeper.settle(job, "failed", f"{video_path} not found", self.lease_seconds)
+                continue
+            self._claimed_at[job["key"]] = time.time()
+            self._keeper.hold(job)
+            rows.append(row)
+        return rows
+
+    def _settle_finished(self):
+        for job in self._keeper.held():
+            if self.state.is_uploaded(job["key"]):
+                self._keeper.settle(job, "completed")
+                continue
+            attempt = self.state.last_upload_attempt(job["key"])
+            if attempt and not attempt["success"] and attempt["attempted_at"] >= self._claimed_at[job["key"]]:
+                self._keeper.settle(job, "failed", attempt["error"])
+
+    def drain(self, block=True, max_rows=None):
+        """
+        Returns newly claimed rows, at most `max_rows`. With `block`, waits
+        (polling the queue) until there is at least one. Returns None once no
+        worker is producing uploads any more and none are left to claim, or a
+        stop is requested.
+        """
+        while not self.stop_event.is_set():
+            self._settle_finished()
+            rows = self._claim(max_rows)
+            if rows or not block:
+                progress.update("jobs", worker_id=self.worker_id, uploads_held=len(self._keeper))
+                if rows or self._producing():
+                    return rows
+                return None
+            if not self._producing():
+                return None
+            self.stop_event.wait(self.poll_seconds)
+        return None
+
+    def settle(self):
+        """Settles every job still held once the upload stage has finished, and stops renewing leases."""
+        self._settle_finished()
+        for job in self._keeper.held():
+            # Not reached this cycle (limit or stop): free for another worker right away.
+            self._keeper.settle(job, "released")
+        self._keeper.close()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import hashlib
+import logging
+import subprocess
+import numpy as np
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Keyframe hashes that differ in at most this many of their 64 bits are treated as the same clip.
+PERCEPTUAL_HASH_MAX_DISTANCE = 6
+FFMPEG_TIMEOUT_SECONDS = 30
+
+def content_hash(path):
+    """Streams a file through BLAKE2b in fixed-size chunks and returns the hex digest."""
+    digest = hashlib.blake2b(digest_size=20)
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+def _to_signed(value):
+    """Maps an unsigned 64-bit hash onto SQLite's signed INTEGER range."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def perceptual_hash(path):
+    """
+    Returns a 64-bit difference hash of the clip's first keyframe, or None if
+    ffmpeg is not installed or cannot decode the file. Only the keyframe is
+    decoded, scaled down to 9x8 grey pixels by ffmpeg, so this stays cheap.
+    Unlike the content hash it survives re-encoding, which reposts often are.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return None
+    try:
+        result = subprocess.run(
+            [ffmpeg, "-v", "error", "-skip_frame", "nokey", "-i", path, "-frames:v", "1",
+             "-vf", "scale=9:8:flags=area,format=gray", "-f", "rawvideo", "-"],
+            capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS, check=True
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.debug(f"Could not extract a keyframe from {path}: {e}")
+        return None
+    pixels = np.frombuffer(result.stdout, dtype=np.uint8)
+    if pixels.size != 72:
+        return None
+    pixels = pixels.reshape(8, 9).astype(np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return _to_signed(int(np.packbits(bits).view(">u8")[0]))
+
+def hamming_distances(value, hashes):
+    """Returns the number of differing bits between one 64-bit hash and each of several others."""
+    xor = np.bitwise_xor(np.asarray(hashes, dtype=np.int64), np.int64(value))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+def fingerprint_file(state, video_id, path, perceptual=False):
+    """Hashes a downloaded clip and records its fingerprint in the state store. Returns the fingerprint."""
+    fingerprint = {
+        "content_hash": content_hash(path),
+        "perceptual_hash": perceptual_hash(path) if perceptual else None,
+        "file_size": os.path.getsize(path),
+    }
+    state.record_fingerprint(video_id, **fingerprint)
+    return fingerprint
+
+def find_uploaded_duplicate(state, video_id, path, perceptual=False):
+    """
+    Returns the ID of an already uploaded video with the same content as this
+    clip, or None. Clips fingerprinted before this check (or before perceptual
+    hashing was enabled) are hashed on demand.
+    """
+    fingerprint = state.get_fingerprint(video_id)
+    if fingerprint is None or (perceptual and fingerprint["perceptual_hash"] is None):
+        fingerprint = fingerprint_file(state, video_id, path, perceptual)
+
+    duplicate_id = state.find_uploaded_by_content_hash(fingerprint["content_hash"], exclude_video_id=video_id)
+    if duplicate_id or not perceptual or fingerprint["perceptual_hash"] is None:
+        return duplicate_id
+
+    known = state.uploaded_perceptual_hashes(exclude_video_id=video_id)
+    if not known:
+        return None
+    video_ids, hashes = zip(*known)
+    distances = hamming_distances(fingerprint["perceptual_hash"], hashes)
+    closest = int(np.argmin(distances))
+    if distances[closest] <= PERCEPTUAL_HASH_MAX_DISTANCE:
+        return video_ids[closest]
+    return None
@@ -0,0 +1,473 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 5
+JOBS_DB_PATH = os.path.join("resources", "jobs.db")
+JOB_QUEUE_BACKENDS = ("sqlite", "redis", "memory")
+
+# Jobs are handed out at least once: a worker that loses its lease (e.g. it
+# stalled past the visibility timeout) may still finish the job while another
+# worker runs it again, so job handlers must be idempotent. Every claim gets a
+# new token, and heartbeat/complete/fail are refused for stale tokens.
+#
+# Besides jobs, both backends keep state that all workers must agree on:
+# markers (e.g. "uploaded:<video_id>", so no host uploads a clip another host
+# already did) and counters with a limit (e.g. a channel's daily quota units).
+
+class SQLiteJobQueue:
+    """
+    Leased job queue in a SQLite database. Suits several workers on one host
+    or on a volume with working file locks; use RedisJobQueue across hosts.
+    """
+
+    def __init__(self, db_path=JOBS_DB_PATH, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                owner TEXT,
+                token INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                lease_expires_at REAL,
+                last_error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (kind, status, available_at);
+            CREATE TABLE IF NOT EXISTS markers (
+                name TEXT PRIMARY KEY,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+
+    def _connect(self):
+        """Returns this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode, so claims can take the write lock up front with BEGIN IMMEDIATE.
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, work):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def enqueue(self, kind, key, payload=None, delay=0):
+        """Adds a job unless one with the same kind and key exists. Returns True if it was added."""
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT OR IGNORE INTO jobs (kind, key, payload, available_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (kind, str(key), json.dumps(payload), now + delay, now)
+        )
+        return cursor.rowcount == 1
+
+    def _reclaim_expired(self, conn, kind, now):
+        """Makes jobs whose lease ran out visible again, or fails them after max_attempts."""
+        expired = conn.execute(
+            "SELECT key, owner, attempts FROM jobs WHERE kind = ? AND status = 'leased' AND lease_expires_at < ?",
+            (kind, now)
+        ).fetchall()
+        for job in expired:
+            status = "failed" if job["attempts"] >= self.max_attempts else "queued"
+            conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, lease_expires_at = NULL, available_at = ?, "
+                "last_error = ?, updated_at = ? WHERE kind = ? AND key = ?",
+                (status, now, f"lease of {job['owner']} expired", now, kind, job["key"])
+            )
+            logging.warning(f"Reclaimed {kind} job {job['key']} from {job['owner']}; it is now {status}.")
+
+    def claim(self, kind, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Leases the next available job of a kind to worker_id. Returns the job as a dict, or None."""
+        def work(conn):
+            now = time.time()
+            self._reclaim_expired(conn, kind, now)
+            row = conn.execute(
+                "SELECT key FROM jobs WHERE kind = ? AND status = 'queued' AND available_at <= ? "
+                "ORDER BY available_at LIMIT 1",
+                (kind, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', owner = ?, token = token + 1, attempts = attempts + 1, "
+                "lease_expires_at = ?, updated_at = ? WHERE kind = ? AND key = ?",
+                (worker_id, now + lease_seconds, now, kind, row["key"])
+            )
+            job = conn.execute(
+                "SELECT kind, key, payload, token, attempts FROM jobs WHERE kind = ? AND key = ?", (kind, row["key"])
+            ).fetchone()
+            return {"kind": job["kind"], "key": job["key"], "payload": json.loads(job["payload"]),
+                    "token": job["token"], "attempts": job["attempts"], "owner": worker_id}
+        return self._transaction(work)
+
+    def _update_leased(self, job, assignments, params):
+        cursor = self._connect().execute(
+            f"UPDATE jobs SET {assignments}, updated_at = ? "
+            "WHERE kind = ? AND key = ? AND token = ? AND status = 'leased'",
+            (*params, time.time(), job["kind"], job["key"], job["token"])
+        )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Extends the job's lease. Returns False if the lease was lost to another worker."""
+        return self._update_leased(job, "lease_expires_at = ?", (time.time() + lease_seconds,))
+
+    def complete(self, job):
+        """Marks a leased job as done. Returns False if the lease was lost."""
+        return self._update_leased(job, "status = 'done', owner = NULL, lease_expires_at = NULL", ())
+
+    def fail(self, job, error, retry_delay=60):
+        """Gives a job back for a retry after retry_delay, or fails it for good after max_attempts."""
+        status = "failed" if job["attempts"] >= self.max_attempts else "queued"
+        return self._update_leased(
+            job, "status = ?, owner = NULL, lease_expires_at = NULL, available_at = ?, last_error = ?",
+            (status, time.time() + retry_delay, str(error))
+        )
+
+    def release(self, job, delay=0):
+        """Gives a job back without counting the attempt, e.g. when stopping."""
+        return self._update_leased(
+            job, "status = 'queued', owner = NULL, lease_expires_at = NULL, available_at = ?, attempts = attempts - 1",
+            (time.time() + delay,)
+        )
+
+    def counts(self, kind):
+        """Returns the number of jobs of a kind per status."""
+        def work(conn):
+            self._reclaim_expired(conn, kind, time.time())
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs WHERE kind = ? GROUP BY status", (kind,))
+            return {row["status"]: row["n"] for row in rows}
+        return self._transaction(work)
+
+    def mark(self, name):
+        """Sets a marker every worker sees. Returns True if it was not set before."""
+        cursor = self._connect().execute(
+            "INSERT OR IGNORE INTO markers (name, created_at) VALUES (?, ?)", (name, time.time())
+        )
+        return cursor.rowcount == 1
+
+    def is_marked(self, name):
+        return self._connect().execute("SELECT 1 FROM markers WHERE name = ?", (name,)).fetchone() is not None
+
+    def counter_value(self, name):
+        row = self._connect().execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row["value"] if row else 0
+
+    def add_to_counter(self, name, amount, limit):
+        """Atomically adds `amount` to a counter unless that would take it past `limit`. Returns True if added."""
+        def work(conn):
+            conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)", (name,))
+            cursor = conn.execute(
+                "UPDATE counters SET value = value + ? WHERE name = ? AND value + ? <= ?", (amount, name, amount, limit)
+            )
+            return cursor.rowcount == 1
+        return self._transaction(work)
+
+    def take_from_counter(self, name, amount):
+        """Subtracts `amount` from a counter, stopping at 0."""
+        self._connect().execute("UPDATE counters SET value = MAX(0, value - ?) WHERE name = ?", (amount, name))
+
+    def raise_counter(self, name, value):
+        """Raises a counter to at least `value`."""
+        self._connect().execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)",
+            (name, value)
+        )
+
+class RedisJobQueue:
+    """
+    Leased job queue on a Redis-compatible server, for workers on several
+    hosts. Each job is a hash; ready jobs sit in a sorted set scored by when
+    they become available, leased ones in a sorted set scored by lease
+    expiry. Ownership changes hands through ZADD NX, which only one worker
+    can win, so no Lua scripting is needed. `client` must return strings
+    (redis.Redis(decode_responses=True)) or be an InMemoryRedis.
+    """
+
+    def __init__(self, client, prefix="jobs", max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.client = client
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+
+    def _job_key(self, kind, key):
+        return f"{self.prefix}:job:{kind}:{key}"
+
+    def _ready(self, kind):
+        return f"{self.prefix}:ready:{kind}"
+
+    def _leased(self, kind):
+        return f"{self.prefix}:leased:{kind}"
+
+    def enqueue(self, kind, key, payload=None, delay=0):
+        """Adds a job unless one with the same kind and key exists. Returns True if it was added."""
+        job_key = self._job_key(kind, key)
+        if not self.client.hsetnx(job_key, "status", "queued"):
+            return False
+        self.client.hset(job_key, mapping={"payload": json.dumps(payload), "token": 0, "attempts": 0})
+        self.client.zadd(self._ready(kind), {str(key): time.time() + delay})
+        return True
+
+    def _reclaim_expired(self, kind, now):
+        for key in self.client.zrangebyscore(self._leased(kind), "-inf", now):
+            # Whoever removes the entry reclaims the job; a late heartbeat then finds it gone.
+            if not self.client.zrem(self._leased(kind), key):
+                continue
+            job_key = self._job_key(kind, key)
+            job = self.client.hgetall(job_key)
+            if job.get("status") != "leased":
+                continue
+            status = "failed" if int(job.get("attempts", 0)) >= self.max_attempts else "queued"
+            self.client.hset(job_key, mapping={"status": status, "owner": "",
+                                               "last_error": f"lease of {job.get('owner')} expired"})
+            # Invalidates the old owner's token.
+            self.client.hincrby(job_key, "token", 1)
+            if status == "queued":
+                self.client.zadd(self._ready(kind), {key: now})
+            logging.warning(f"Reclaimed {kind} job {key} from {job.get('owner')}; it is now {status}.")
+
+    def claim(self, kind, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Leases the next available job of a kind to worker_id. Returns the job as a dict, or None."""
+        now = time.time()
+        self._reclaim_expired(kind, now)
+        for key in self.client.zrangebyscore(self._ready(kind), "-inf", now, start=0, num=10):
+            if not self.client.zadd(self._leased(kind), {key: now + lease_seconds}, nx=True):
+                continue  # Another worker got there first.
+            self.client.zrem(self._ready(kind), key)
+            job_key = self._job_key(kind, key)
+            if self.client.hget(job_key, "status") != "queued":
+                self.client.zrem(self._leased(kind), key)
+                continue
+            token = self.client.hincrby(job_key, "token", 1)
+            attempts = self.client.hincrby(job_key, "attempts", 1)
+            self.client.hset(job_key, mapping={"status": "leased", "owner": worker_id})
+            return {"kind": kind, "key": key, "payload": json.loads(self.client.hget(job_key, "payload")),
+                    "token": token, "attempts": attempts, "owner": worker_id}
+        return None
+
+    def _owns(self, job):
+        current = self.client.hgetall(self._job_key(job["kind"], job["key"]))
+        return current.get("status") == "leased" and int(current.get("token", -1)) == job["token"]
+
+    def heartbeat(self, job, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Extends the job's lease. Returns False if the lease was lost to another worker."""
+        if not self._owns(job):
+            return False
+        return bool(self.client.zadd(self._leased(job["kind"]), {job["key"]: time.time() + lease_seconds},
+                                     xx=True, ch=True))
+
+    def _finish(self, job, status, error=None, available_at=None, attempts_delta=0):
+        if not self._owns(job):
+            return False
+        job_key = self._job_key(job["kind"], job["key"])
+        fields = {"status": status, "owner": ""}
+        if error is not None:
+            fields["last_error"] = str(error)
+        self.client.hset(job_key, mapping=fields)
+        if attempts_delta:
+            self.client.hincrby(job_key, "attempts", attempts_delta)
+        self.client.zrem(self._leased(job["kind"]), job["key"])
+        if status == "queued":
+            self.client.zadd(self._ready(job["kind"]), {job["key"]: available_at})
+        return True
+
+    def complete(self, job):
+        """Marks a leased job as done. Returns False if the lease was lost."""
+        return self._finish(job, "done")
+
+    def fail(self, job, error, retry_delay=60):
+        """Gives a job back for a retry after retry_delay, or fails it for good after max_attempts."""
+        status = "failed" if job["attempts"] >= self.max_attempts else "queued"
+        return self._finish(job, status, error=error, available_at=time.time() + retry_delay)
+
+    def release(self, job, delay=0):
+        """Gives a job back without counting the attempt, e.g. when stopping."""
+        return self._finish(job, "queued", available_at=time.time() + delay, attempts_delta=-1)
+
+    def counts(self, kind):
+        """Returns the number of queued and leased jobs of a kind."""
+        self._reclaim_expired(kind, time.time())
+        return {"queued": self.client.zcard(self._ready(kind)), "leased": self.client.zcard(self._leased(kind))}
+
+    def _marker(self, name):
+        return f"{self.prefix}:marker:{name}"
+
+    def _counter(self, name):
+        return f"{self.prefix}:counter:{name}"
+
+    def mark(self, name):
+        """Sets a marker every worker sees. Returns True if it was not set before."""
+        return bool(self.client.set(self._marker(name), time.time(), nx=True))
+
+    def is_marked(self, name):
+        return bool(self.client.exists(self._marker(name)))
+
+    def counter_value(self, name):
+        return int(self.client.get(self._counter(name)) or 0)
+
+    def add_to_counter(self, name, amount, limit):
+        """Atomically adds `amount` to a counter unless that would take it past `limit`. Returns True if added."""
+        if self.client.incrby(self._counter(name), amount) <= limit:
+            return True
+        # Over the limit: take it back. Concurrent callers may be refused meanwhile, but never over-booked.
+        self.client.incrby(self._counter(name), -amount)
+        return False
+
+    def take_from_counter(self, name, amount):
+        """Subtracts `amount` from a counter, stopping at 0."""
+        value = self.client.incrby(self._counter(name), -amount)
+        if value < 0:
+            self.client.incrby(self._counter(name), -value)
+
+    def raise_counter(self, name, value):
+        """Raises a counter to at least `value`."""
+        current = self.counter_value(name)
+        if current < value:
+            self.client.incrby(self._counter(name), value - current)
+
+class InMemoryRedis:
+    """
+    Thread-safe stand-in for the subset of the Redis API RedisJobQueue uses,
+    for tests and single-host trials without a server.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashes = {}
+        self._zsets = {}
+        self._strings = {}
+
+    def set(self, name, value, nx=False):
+        with self._lock:
+            if nx and name in self._strings:
+                return None
+            self._strings[name] = str(value)
+            return True
+
+    def get(self, name):
+        with self._lock:
+            return self._strings.get(name)
+
+    def exists(self, *names):
+        with self._lock:
+            return sum(1 for name in names if name in self._strings)
+
+    def incrby(self, name, amount=1):
+        with self._lock:
+            value = int(self._strings.get(name, 0)) + amount
+            self._strings[name] = str(value)
+            return value
+
+    def hsetnx(self, name, key, value):
+        with self._lock:
+            fields = self._hashes.setdefault(name, {})
+            if key in fields:
+                return 0
+            fields[key] = str(value)
+            return 1
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self._lock:
+            fields = self._hashes.setdefault(name, {})
+            updates = dict(mapping or {})
+            if key is not None:
+                updates[key] = value
+            added = sum(1 for field in updates if field not in fields)
+            fields.update({field: str(v) for field, v in updates.items()})
+            return added
+
+    def hget(self, name, key):
+        with self._lock:
+            return self._hashes.get(name, {}).get(key)
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._hashes.get(name, {}))
+
+    def hincrby(self, name, key, amount=1):
+        with self._lock:
+            fields = self._hashes.setdefault(name, {})
+            value = int(fields.get(key, 0)) + amount
+            fields[key] = str(value)
+            return value
+
+    def zadd(self, name, mapping, nx=False, xx=False, ch=False):
+        with self._lock:
+            zset = self._zsets.setdefault(name, {})
+            changed = 0
+            for member, score in mapping.items():
+                exists = member in zset
+                if (nx and exists) or (xx and not exists):
+                    continue
+                if not exists or (ch and zset[member] != float(score)):
+                    changed += 1
+                zset[member] = float(score)
+            return changed
+
+    def zrem(self, name, *members):
+        with self._lock:
+            zset = self._zsets.get(name, {})
+            return sum(1 for member in members if zset.pop(member, None) is not None)
+
+    def zrangebyscore(self, name, min, max, start=None, num=None):
+        low, high = float(min), float(max)
+        with self._lock:
+            members = sorted((score, member) for member, score in self._zsets.get(name, {}).items()
+                             if low <= score <= high)
+        members = [member for _, member in members]
+        if start is not None and num is not None:
+            members = members[start:start + num]
+        return members
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self._zsets.get(name, {}))
+
+def open_job_queue(settings):
+    """
+    Opens the job queue described by the `distributed` config section:
+    {"backend": "sqlite", "path": ...}, {"backend": "redis", "url": ...}
+    or {"backend": "memory"} (one process only).
+    """
+    backend = settings.get("backend", "sqlite")
+    max_attempts = settings.get("max_attempts", DEFAULT_MAX_ATTEMPTS)
+    if backend == "sqlite":
+        return SQLiteJobQueue(settings.get("path", JOBS_DB_PATH), max_attempts)
+    if backend == "memory":
+        return RedisJobQueue(InMemoryRedis(), max_attempts=max_attempts)
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis job queue needs the 'redis' package (pip install redis).")
+        client = redis.Redis.from_url(settings["url"], decode_responses=True)
+        return RedisJobQueue(client, settings.get("prefix", "jobs"), max_attempts)
+    raise ValueError(f"Unknown job queue backend '{backend}'.")
@@ -2,12 +2,40 @@ import logging
 import requests
 import os
 import sys
+import json
+import gzip
+import time
+import queue
+import atexit
+import random
+import shutil
+import threading
+import multiprocessing
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+LOG_FILE = "tiktok_to_youtube.log"
+DEFAULT_LOG_MAX_MB = 50
+DEFAULT_LOG_BACKUP_COUNT = 5
 
 class DiscordHandler(logging.Handler):
-    """A custom logging handler that sends logs to a Discord webhook."""
-    def __init__(self, webhook_url):
+    """
+    A custom logging handler that sends logs to a Discord webhook.
+
+    Records are queued by emit() and posted by a background thread, which
+    packs as many records as fit into each webhook message and honours
+    Discord's rate limits. When the bounded buffer is full, new records are
+    dropped and a summary of how many were lost is sent instead.
+    """
+    MAX_EMBEDS_PER_MESSAGE = 10
+    MAX_CHARS_PER_MESSAGE = 6000
+    MAX_DESCRIPTION_CHARS = 4096
+    MAX_ENTRY_CHARS = 1900
+
+    def __init__(self, webhook_url, max_buffer=1000, flush_interval=2.0):
         super().__init__()
         self.webhook_url = webhook_url
+        self.flush_interval = flush_interval
         self.colors = {
             'DEBUG': 0x808080,
             'INFO': 0x0000FF,
@@ -15,33 +43,292 @@ class DiscordHandler(logging.Handler):
             'ERROR': 0xFF0000,
             'CRITICAL': 0x8B0000
         }
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._closing = threading.Event()
+        self._session = requests.Session()
+        self._sender = threading.Thread(target=self._run, name="discord-log-sender", daemon=True)
+        self._sender.start()
 
     def emit(self, record):
-        """Format and send the log record to Discord."""
+        """Format the log record and queue it for the sender thread."""
+        # Records logged while sending (e.g. by urllib3) would feed back into the queue.
+        if threading.current_thread() is self._sender:
+            return
         try:
             log_entry = self.format(record)
-            if len(log_entry) > 1900:
-                log_entry = log_entry[:1900] + "..."
-
-            embed = {
-                "title": f"Log: {record.levelname}",
-                "description": f"```\n{log_entry}\n```",
-                "color": self.colors.get(record.levelname, 0x000000)
-            }
-            
-            payload = {"embeds": [embed]}
-            # Disable internal logging from requests itself during the post
-            logging.getLogger("urllib3").propagate = False
-            requests.post(self.webhook_url, json=payload, timeout=5)
-            logging.getLogger("urllib3").propagate = True
-
-        except Exception as e:
-            sys.stderr.write(f"--- FATAL: DiscordHandler failed to send log: {e}\n")
-            pass
-
-def setup_logger():
-    """Configure logging settings, including the Discord handler."""
-    
+            if len(log_entry) > self.MAX_ENTRY_CHARS:
+                log_entry = log_entry[:self.MAX_ENTRY_CHARS] + "..."
+            self._queue.put_nowait((record.levelname, log_entry))
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _take_dropped(self):
+        with self._dropped_lock:
+            dropped, self._dropped = self._dropped, 0
+        return dropped
+
+    def _collect_batch(self):
+        """Waits for at least one record, then takes whatever else is already queued."""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self._queue.maxsize:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _build_payloads(self, batch, dropped=0):
+        """Packs records into as few webhook messages as Discord's embed limits allow."""
+        entries = list(batch)
+        if dropped:
+            entries.append(("WARNING", f"{dropped} log records were dropped because the Discord log buffer was full."))
+
+        # Consecutive records of the same level share one embed.
+        embeds = []
+        for levelname, log_entry in entries:
+            block = f"```\n{log_entry}\n```"
+            last = embeds[-1] if embeds else None
+            if (last and last["level"] == levelname
+                    and len(last["description"]) + len(block) + 1 <= self.MAX_DESCRIPTION_CHARS):
+                last["description"] += "\n" + block
+            else:
+                embeds.append({"level": levelname, "description": block})
+
+        payloads = []
+        current, current_chars = [], 0
+        for embed in embeds:
+            title = f"Log: {embed['level']}"
+            size = len(title) + len(embed["description"])
+            if current and (len(current) >= self.MAX_EMBEDS_PER_MESSAGE or current_chars + size > self.MAX_CHARS_PER_MESSAGE):
+                payloads.append({"embeds": current})
+                current, current_chars = [], 0
+            current.append({
+                "title": title,
+                "description": embed["description"],
+                "color": self.colors.get(embed["level"], 0x000000)
+            })
+            current_chars += size
+        if current:
+            payloads.append({"embeds": current})
+        return payloads
+
+    def _post(self, payload):
+        """Posts one message, waiting out 429 responses."""
+        for _ in range(5):
+            response = self._session.post(self.webhook_url, json=payload, timeout=5)
+            if response.status_code == 429:
+                try:
+                    retry_after = float(response.json().get("retry_after", 1))
+                except ValueError:
+                    retry_after = float(response.headers.get("Retry-After", 1))
+                time.sleep(retry_after)
+                continue
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                time.sleep(float(response.headers.get("X-RateLimit-Reset-After", 0)))
+            return
+
+    def _send(self, batch):
+        for payload in self._build_payloads(batch, self._take_dropped()):
+            try:
+                self._post(payload)
+            except Exception as e:
+                sys.stderr.write(f"--- FATAL: DiscordHandler failed to send log: {e}\n")
+
+    def _run(self):
+        """Sender loop: batches queued records until the handler is closed and drained."""
+        while not (self._closing.is_set() and self._queue.empty()):
+            batch = self._collect_batch()
+            if batch or self._dropped:
+                self._send(batch)
+
+    def close(self):
+        """Flush queued records and stop the sender thread."""
+        self._closing.set()
+        self._sender.join(timeout=10)
+        self._session.close()
+        super().close()
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "process": record.process,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """
+    Thins out high-volume records below INFO, per module. `rate_limits` maps
+    a module to the records per second it may log (a token bucket allowing
+    bursts of one second's worth) and `sampling` to the fraction of records
+    kept. "*" applies to every module not listed. How many records were
+    dropped is attached to the next one let through as `suppressed`.
+    """
+
+    def __init__(self, rate_limits=None, sampling=None, level=logging.INFO):
+        super().__init__()
+        self.rate_limits = rate_limits or {}
+        self.sampling = sampling or {}
+        self.level = level
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._suppressed = {}
+
+    def _rule(self, rules, module):
+        return rules.get(module, rules.get("*"))
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        module = record.module
+        rate = self._rule(self.rate_limits, module)
+        ratio = self._rule(self.sampling, module)
+        with self._lock:
+            keep = ratio is None or random.random() < ratio
+            if keep and rate is not None:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(module, (rate, now))
+                tokens = min(rate, tokens + (now - last) * rate)
+                keep = tokens >= 1
+                self._buckets[module] = (tokens - 1 if keep else tokens, now)
+            if not keep:
+                self._suppressed[module] = self._suppressed.get(module, 0) + 1
+                return False
+            suppressed = self._suppressed.pop(module, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+def sampling_filter(settings):
+    """Returns the SamplingFilter configured by log_debug_rate_limits and log_debug_sampling, or None."""
+    rate_limits = settings.get("log_debug_rate_limits")
+    sampling = settings.get("log_debug_sampling")
+    if not rate_limits and not sampling:
+        return None
+    return SamplingFilter(rate_limits, sampling)
+
+def _gzip_rotator(source, dest):
+    """Compresses a rotated log file."""
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def build_file_handler(path=LOG_FILE, max_bytes=DEFAULT_LOG_MAX_MB * 1048576, backup_count=DEFAULT_LOG_BACKUP_COUNT,
+                       when=None):
+    """
+    Returns a JSON-lines file handler that rotates by size, or by time if
+    `when` is given (see TimedRotatingFileHandler), keeping `backup_count`
+    gzip-compressed old files.
+    """
+    if when:
+        handler = TimedRotatingFileHandler(path, when=when, backupCount=backup_count, encoding='utf-8', utc=True)
+    else:
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    handler.namer = lambda name: name + ".gz"
+    handler.rotator = _gzip_rotator
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+class _LocalQueueHandler(QueueHandler):
+    """
+    QueueHandler for a listener in this process. Records are not pickled, so
+    they are queued as they are and all formatting happens on the listener
+    thread instead of in the caller.
+    """
+
+    def prepare(self, record):
+        return record
+
+_listener = None
+
+def stop_log_listener():
+    """Writes out the queued records and closes the file sink."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+atexit.register(stop_log_listener)
+
+class _RootForwarder(logging.Handler):
+    """Hands records logged in pool processes to this process's root handlers."""
+
+    def emit(self, record):
+        logging.getLogger().handle(record)
+
+_worker_queue = None
+_worker_listener = None
+_worker_lock = threading.Lock()
+
+def _stop_worker_listener():
+    global _worker_listener
+    if _worker_listener is not None:
+        _worker_listener.stop()
+        _worker_listener = None
+
+atexit.register(_stop_worker_listener)
+
+def worker_log_queue():
+    """
+    Returns the queue that spawned pool processes send their log records
+    through. A listener thread, started on first use, passes them on to the
+    root handlers here, so they reach the same sinks as the parent's records.
+    """
+    global _worker_queue, _worker_listener
+    with _worker_lock:
+        if _worker_queue is None:
+            _worker_queue = multiprocessing.get_context("spawn").Queue()
+        if _worker_listener is None:
+            _worker_listener = QueueListener(_worker_queue, _RootForwarder())
+            _worker_listener.start()
+        return _worker_queue
+
+def init_worker_logging(log_queue):
+    """Process pool initializer: sends every record of the pool process to the parent through log_queue."""
+    logger = logging.getLogger()
+    for handler in logger.handlers:
+        handler.close()
+    logger.handlers.clear()
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.DEBUG)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+def pool_logging():
+    """Keyword arguments for a spawned ProcessPoolExecutor whose workers should log to this process's sinks."""
+    return {"initializer": init_worker_logging, "initargs": (worker_log_queue(),)}
+
+def setup_logger(settings=None):
+    """
+    Configure logging settings, including the Discord handler. `settings`
+    (the config) may set log_file, log_max_mb, log_backup_count,
+    log_rotate_when and the DEBUG rate limits and sampling.
+    """
+    global _listener
+    settings = settings or {}
+
     # --- THIS IS THE FIX ---
     # Silence the overly verbose 'urllib3' logger used by the 'requests' library.
     # This prevents the feedback loop where sending a log creates more logs.
@@ -52,7 +339,10 @@ def setup_logger():
     logger.setLevel(logging.DEBUG)
 
     if logger.hasHandlers():
+        for handler in logger.handlers:
+            handler.close()
         logger.handlers.clear()
+    stop_log_listener()
 
     log_format = logging.Formatter("%(asctime)s - %(levelname)s - %(module)s - %(message)s")
 
@@ -61,16 +351,31 @@ def setup_logger():
     stream_handler.setFormatter(log_format)
     logger.addHandler(stream_handler)
     
-    file_handler = logging.FileHandler("tiktok_to_youtube.log", encoding='utf-8')
+    # The file sink runs on a listener thread, so log I/O never blocks the pipeline.
+    file_handler = build_file_handler(
+        settings.get("log_file", LOG_FILE),
+        int(settings.get("log_max_mb", DEFAULT_LOG_MAX_MB) * 1048576),
+        settings.get("log_backup_count", DEFAULT_LOG_BACKUP_COUNT),
+        settings.get("log_rotate_when")
+    )
     file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(log_format)
-    logger.addHandler(file_handler)
+    queue_handler = _LocalQueueHandler(queue.SimpleQueue())
+    queue_handler.setLevel(logging.DEBUG)
+    sampling = sampling_filter(settings)
+    if sampling:
+        queue_handler.addFilter(sampling)
+    _listener = QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    logger.addHandler(queue_handler)
 
     webhook_url = os.getenv("DISCORD_WEBHOOK_URL")
     if webhook_url and webhook_url.startswith("https://discord.com/api/webhooks/"):
         discord_handler = DiscordHandler(webhook_url)
         discord_handler.setLevel(logging.DEBUG)
         discord_handler.setFormatter(logging.Formatter('%(message)s'))
+        if sampling:
+            # A filter of its own, so the two sinks do not share one rate budget.
+            discord_handler.addFilter(sampling_filter(settings))
         logger.addHandler(discord_handler)
         logger.info("Discord logging is enabled.")
     else:
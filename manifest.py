@@ -0,0 +1,126 @@
+import re
+import logging
+from functools import lru_cache
+
+# Limits YouTube enforces on videos.insert snippets.
+MAX_TITLE_LENGTH = 100
+MAX_DESCRIPTION_BYTES = 5000
+MAX_TAGS_LENGTH = 500
+CATEGORY_ID = "22"
+DEFAULT_TAGS = ("shorts", "tiktok", "viral", "trending")
+
+# A hashtag runs until whitespace, another '#' or punctuation; chained tags
+# ("#fyp#viral") are matched as one run and split. Matching by exclusion keeps
+# combining marks (Devanagari, Thai, ...) that \w would cut off.
+HASHTAG_PATTERN = re.compile(r"(?<![\w&])((?:#[^\s#@<>.,;:!?()\[\]{}\"'/\\|]+)+)")
+# YouTube rejects titles and descriptions containing angle brackets.
+FORBIDDEN_CHARACTERS = re.compile(r"[<>]")
+WHITESPACE = re.compile(r"\s+")
+
+class ManifestError(ValueError):
+    """Raised when no valid upload snippet can be built for a video."""
+
+def _tag_cost(tag):
+    """Characters a tag takes from the 500-character budget; YouTube quotes tags containing spaces."""
+    return len(tag) + (2 if " " in tag else 0)
+
+def _truncate_title(text):
+    """Cuts a title to MAX_TITLE_LENGTH, at a word boundary where possible."""
+    if len(text) <= MAX_TITLE_LENGTH:
+        return text
+    cut = text[:MAX_TITLE_LENGTH - 1]
+    if " " in cut[MAX_TITLE_LENGTH // 2:]:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip() + "…"
+
+def _truncate_utf8(text, max_bytes):
+    """Cuts text to at most max_bytes of UTF-8 without splitting a character."""
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode("utf-8", errors="ignore")
+
+@lru_cache(maxsize=8192)
+def parse_description(description):
+    """Returns the cleaned title text and the hashtags of a TikTok description. Memoized per description."""
+    clean = FORBIDDEN_CHARACTERS.sub("", description)
+    title = WHITESPACE.sub(" ", clean.split("#", 1)[0]).strip()
+    tags = (tag.strip("-_") for run in HASHTAG_PATTERN.findall(clean) for tag in run.split("#"))
+    return _truncate_title(title), tuple(tag for tag in tags if tag)
+
+def fit_tags(tags):
+    """Drops duplicate tags (ignoring case) and any tag that would push the list past MAX_TAGS_LENGTH."""
+    fitted = []
+    seen = set()
+    used = 0
+    for tag in tags:
+        key = tag.casefold()
+        # Tags are sent comma-separated; every tag after the first also costs its comma.
+        cost = _tag_cost(tag) + (1 if fitted else 0)
+        if key in seen or used + cost > MAX_TAGS_LENGTH:
+            continue
+        seen.add(key)
+        fitted.append(tag)
+        used += cost
+    return fitted
+
+def validate_snippet(snippet):
+    """Returns the ways a snippet breaks YouTube's limits; an empty list means it can be sent."""
+    problems = []
+    title = snippet.get("title") or ""
+    if not title.strip():
+        problems.append("title is empty")
+    if len(title) > MAX_TITLE_LENGTH:
+        problems.append(f"title is longer than {MAX_TITLE_LENGTH} characters")
+    description = snippet.get("description") or ""
+    if len(description.encode("utf-8")) > MAX_DESCRIPTION_BYTES:
+        problems.append(f"description is longer than {MAX_DESCRIPTION_BYTES} bytes")
+    if FORBIDDEN_CHARACTERS.search(title) or FORBIDDEN_CHARACTERS.search(description):
+        problems.append("title or description contains '<' or '>'")
+    tags = snippet.get("tags") or []
+    if sum(_tag_cost(tag) for tag in tags) + max(0, len(tags) - 1) > MAX_TAGS_LENGTH:
+        problems.append(f"tags are longer than {MAX_TAGS_LENGTH} characters")
+    return problems
+
+def build_snippet(row):
+    """
+    Builds the videos.insert snippet (title, description, tags) for a metadata
+    row, fitted to YouTube's limits. Raises ManifestError if it still fails
+    validation.
+    """
+    username = FORBIDDEN_CHARACTERS.sub("", row.get("author_username") or "")
+    video_description = row.get("video_description") or ""
+    title, tiktok_tags = parse_description(video_description)
+    tags = fit_tags(DEFAULT_TAGS + tiktok_tags)
+
+    hashtag_string = " ".join(f"#{tag}" for tag in tags)
+    footer = f"\n\nCredit to @{username} on TikTok.\n\n{hashtag_string}"
+    body = FORBIDDEN_CHARACTERS.sub("", video_description)
+    body = _truncate_utf8(body, MAX_DESCRIPTION_BYTES - len(footer.encode("utf-8")))
+    snippet = {
+        "title": title or _truncate_title(f"Check out this clip from {username}"),
+        "description": body + footer,
+        "tags": tags,
+        "categoryId": CATEGORY_ID,
+    }
+    problems = validate_snippet(snippet)
+    if problems:
+        raise ManifestError(f"Video {row.get('video_id')}: " + "; ".join(problems) + ".")
+    return snippet
+
+def build_manifests(state, rows):
+    """
+    Builds and stores the upload snippets of a batch of metadata rows, so the
+    upload stage only has to send them. Returns the number stored; rows that
+    cannot be made valid are logged and left out.
+    """
+    manifests = []
+    for row in rows:
+        if not row.get("video_id"):
+            continue
+        try:
+            manifests.append((row["video_id"], build_snippet(row)))
+        except ManifestError as e:
+            logging.warning(f"Not uploading: {e}")
+    state.save_manifests(manifests)
+    return len(manifests)
@@ -0,0 +1,259 @@
+import os
+import json
+import queue
+import shutil
+import logging
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import metrics
+import progress
+from fingerprint import fingerprint_file
+from logger import pool_logging
+from state_store import STATE_DB_PATH, get_state_store
+
+# YouTube treats vertical clips of up to three minutes as Shorts.
+DEFAULT_SHORTS_SPEC = {
+    "max_duration_seconds": 180,
+    # Allowed deviation of width/height from 9/16, e.g. 0.02 accepts 0.5425 to 0.5825.
+    "aspect_tolerance": 0.02,
+    # Clips above this total bitrate are re-encoded down to it; None keeps every clip as downloaded.
+    "max_bitrate_kbps": None,
+}
+DEFAULT_MEDIA_CHECK_CONCURRENCY = 2
+SHORTS_ASPECT_RATIO = 9 / 16
+AUDIO_BITRATE_KBPS = 128
+FFPROBE_TIMEOUT_SECONDS = 30
+TRANSCODE_TIMEOUT_SECONDS = 600
+
+MEDIA_CHECKS = metrics.counter("media_checks_total", "Clips checked against the Shorts spec, by outcome.")
+MEDIA_PROBES = metrics.counter("media_probes_total", "ffprobe runs, by whether the result was cached.")
+
+def probe_media(path):
+    """
+    Returns the duration, display size, bitrate and codec of a clip as
+    reported by ffprobe, or None if ffprobe is not installed. Values ffprobe
+    cannot determine (e.g. for a corrupt file) are None.
+    """
+    ffprobe = shutil.which("ffprobe")
+    if not ffprobe:
+        return None
+    try:
+        result = subprocess.run(
+            [ffprobe, "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "format=duration,bit_rate:stream=codec_name,width,height:stream_tags=rotate"
+             ":stream_side_data=rotation", "-of", "json", path],
+            capture_output=True, timeout=FFPROBE_TIMEOUT_SECONDS, check=True
+        )
+        data = json.loads(result.stdout or b"{}")
+    except (OSError, ValueError, subprocess.SubprocessError) as e:
+        logging.debug(f"ffprobe could not read {path}: {e}")
+        data = {}
+
+    stream = (data.get("streams") or [{}])[0]
+    media_format = data.get("format") or {}
+    rotation = stream.get("tags", {}).get("rotate")
+    for side_data in stream.get("side_data_list") or []:
+        rotation = side_data.get("rotation", rotation)
+    width, height = stream.get("width"), stream.get("height")
+    if rotation is not None and abs(int(float(rotation))) % 180 == 90:
+        width, height = height, width
+
+    def number(value, kind):
+        try:
+            return kind(float(value))
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        "duration": number(media_format.get("duration"), float),
+        "width": width,
+        "height": height,
+        "bit_rate": number(media_format.get("bit_rate"), int),
+        "codec": stream.get("codec_name"),
+    }
+
+def evaluate(probe, spec):
+    """
+    Checks probe results against a Shorts spec. Returns ("ok", None),
+    ("rejected", reason) or ("transcode", reason).
+    """
+    if not probe.get("duration") or not probe.get("width") or not probe.get("height"):
+        return "rejected", "no readable video stream"
+    if probe["duration"] > spec["max_duration_seconds"]:
+        return "rejected", f"{probe['duration']:.0f}s is longer than {spec['max_duration_seconds']}s"
+    aspect = probe["width"] / probe["height"]
+    if abs(aspect - SHORTS_ASPECT_RATIO) > spec["aspect_tolerance"]:
+        return "rejected", f"{probe['width']}x{probe['height']} is not 9:16"
+    max_bitrate = spec.get("max_bitrate_kbps")
+    if max_bitrate and probe.get("bit_rate") and probe["bit_rate"] > max_bitrate * 1000:
+        return "transcode", f"{probe['bit_rate'] // 1000} kbps is above {max_bitrate} kbps"
+    return "ok", None
+
+def transcode(path, max_bitrate_kbps):
+    """Re-encodes a clip in place to at most max_bitrate_kbps. Returns True if the file was replaced."""
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return False
+    video_kbps = max(200, max_bitrate_kbps - AUDIO_BITRATE_KBPS)
+    temp_path = f"{path}.transcode.mp4"
+    try:
+        subprocess.run(
+            [ffmpeg, "-v", "error", "-y", "-i", path, "-c:v", "libx264", "-preset", "veryfast",
+             "-b:v", f"{video_kbps}k", "-maxrate", f"{video_kbps}k", "-bufsize", f"{2 * video_kbps}k",
+             "-c:a", "aac", "-b:a", f"{AUDIO_BITRATE_KBPS}k", "-movflags", "+faststart", temp_path],
+            capture_output=True, timeout=TRANSCODE_TIMEOUT_SECONDS, check=True
+        )
+        if os.path.getsize(temp_path) >= os.path.getsize(path):
+            return False
+        os.replace(temp_path, path)
+        return True
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.warning(f"Could not transcode {path}: {e}")
+        return False
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def _cached_probe(state, video_id):
+    """Returns the stored probe of a clip's current content, or None if it was never probed."""
+    fingerprint = state.get_fingerprint(video_id)
+    return state.get_media_probe(fingerprint["content_hash"]) if fingerprint else None
+
+def check_clip(video_id, path, author_username, spec, state_db_path=STATE_DB_PATH):
+    """
+    Probes a clip (or reuses the probe of identical content) and enforces the
+    spec, re-encoding clips above the bitrate cap. Runs in a pool worker.
+    Returns (verdict, reason) with verdict "ok" or "rejected".
+    """
+    state = get_state_store(state_db_path)
+    fingerprint = state.get_fingerprint(video_id) or fingerprint_file(state, video_id, path)
+    probe = state.get_media_probe(fingerprint["content_hash"])
+    if probe is None:
+        probe = probe_media(path)
+        if probe is None:
+            return "ok", "ffprobe is not installed"
+        state.record_media_probe(fingerprint["content_hash"], probe)
+
+    verdict, reason = evaluate(probe, spec)
+    if verdict != "transcode":
+        return verdict, reason
+    if not transcode(path, spec["max_bitrate_kbps"]):
+        return "ok", f"{reason}, uploading as downloaded"
+    # The new file has new content, so it gets a fresh fingerprint and probe.
+    fingerprint = fingerprint_file(state, video_id, path)
+    state.record_media_file(video_id, path, author_username, fingerprint["file_size"])
+    new_probe = probe_media(path)
+    if new_probe is not None:
+        state.record_media_probe(fingerprint["content_hash"], new_probe)
+    return "ok", f"transcoded, {reason}"
+
+class MediaCheckStage:
+    """
+    Pipeline stage between the download and upload stages: checks each clip
+    against the Shorts spec in a pool of `concurrency` worker processes and
+    hands the clips that pass to `on_checked`. Clips whose content was
+    probed before are decided here without a process hop, so no file is ever
+    probed twice. Rejected clips are recorded as failed upload attempts.
+    """
+
+    def __init__(self, state, download_dir, on_checked, spec=None, concurrency=DEFAULT_MEDIA_CHECK_CONCURRENCY):
+        self.state = state
+        self.download_dir = download_dir
+        self.on_checked = on_checked
+        self.spec = dict(DEFAULT_SHORTS_SPEC, **(spec or {}))
+        self.concurrency = max(1, concurrency)
+        self.counts = {"checked": 0, "rejected": 0, "transcoded": 0}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._has_ffprobe = None
+        self._accepting = True
+        self._results = queue.Queue()
+        self._forwarder = threading.Thread(target=self._forward_results, name="media-check", daemon=True)
+        self._forwarder.start()
+
+    def submit(self, rows):
+        """Queues rows for checking. Returns False once the next stage no longer accepts candidates."""
+        if not self._probing_available():
+            self._accepting = self.on_checked(rows) is not False and self._accepting
+            return self._accepting
+        passed = []
+        for row in rows:
+            video_id = row.get("video_id")
+            path = os.path.join(self.download_dir, f"@{row.get('author_username')}_video_{video_id}.mp4")
+            if not video_id or not os.path.exists(path):
+                passed.append(row)  # The upload stage reports these.
+                continue
+            probe = _cached_probe(self.state, video_id)
+            verdict, reason = evaluate(probe, self.spec) if probe else (None, None)
+            if verdict in ("ok", "rejected"):
+                MEDIA_PROBES.inc(cached="yes")
+                if self._record(row, verdict, reason):
+                    passed.append(row)
+                continue
+            if probe is None:
+                MEDIA_PROBES.inc(cached="no")
+            if self._pool is None:
+                # Spawned for the same reason as the download pool, and logging to the parent's sinks like it.
+                self._pool = ProcessPoolExecutor(max_workers=self.concurrency,
+                                                 mp_context=multiprocessing.get_context("spawn"), **pool_logging())
+            future = self._pool.submit(check_clip, video_id, path, row.get("author_username"), self.spec,
+                                       self.state.db_path)
+            future.add_done_callback(lambda future, row=row: self._results.put((row, future)))
+        if passed:
+            self._accepting = self.on_checked(passed) is not False and self._accepting
+        return self._accepting
+
+    def close(self, cancel=False):
+        """
+        Waits for the clips still being checked and hands on the ones that pass.
+        With `cancel` (or once the next stage stopped accepting), clips not yet
+        being checked are dropped instead.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=cancel or not self._accepting)
+        self._results.put(None)
+        self._forwarder.join()
+
+    def _probing_available(self):
+        if self._has_ffprobe is None:
+            self._has_ffprobe = shutil.which("ffprobe") is not None
+            if not self._has_ffprobe:
+                logging.warning("ffprobe is not installed. Clips are uploaded without checking the Shorts spec.")
+        return self._has_ffprobe
+
+    def _record(self, row, verdict, reason):
+        """Counts a verdict and records a rejection. Returns True if the clip may be uploaded."""
+        video_id = row["video_id"]
+        transcoded = bool(reason and reason.startswith("transcoded"))
+        with self._lock:
+            self.counts["checked"] += 1
+            self.counts["transcoded"] += transcoded
+            self.counts["rejected"] += verdict == "rejected"
+            counts = dict(self.counts)
+        if verdict == "rejected":
+            logging.info(f"Skipping video {video_id}: not a Short ({reason}).")
+            self.state.record_upload_attempt(video_id, False, error=f"not a short: {reason}")
+        elif reason:
+            logging.info(f"Video {video_id}: {reason}.")
+        MEDIA_CHECKS.inc(outcome="transcoded" if transcoded else verdict)
+        progress.update("media_check", **counts)
+        return verdict != "rejected"
+
+    def _forward_results(self):
+        while True:
+            item = self._results.get()
+            if item is None:
+                return
+            row, future = item
+            if future.cancelled():
+                continue
+            try:
+                verdict, reason = future.result()
+            except Exception as e:
+                # A clip that could not be checked is uploaded as before rather than lost.
+                logging.error(f"Media check of {row.get('video_id')} failed: {e}", exc_info=True)
+                verdict, reason = "ok", None
+            if self._record(row, verdict, reason) and self._accepting:
+                self._accepting = self.on_checked([row]) is not False
@@ -0,0 +1,237 @@
+import os
+import re
+import time
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_FILE = os.path.join("resources", "metrics.prom")
+DEFAULT_EXPORT_INTERVAL_SECONDS = 15
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float("inf"))
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(label_key, extra=None):
+    items = list(label_key) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    escaped = (
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in items
+    )
+    return "{" + ",".join(escaped) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for label_key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(label_key)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """A value that can go up and down."""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with a running sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != float("inf"):
+            self.buckets += (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for label_key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state["buckets"]):
+                    labels = _format_labels(label_key, [("le", _format_value(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(label_key)} {_format_value(state['sum'])}")
+                lines.append(f"{self.name}_count{_format_labels(label_key)} {state['count']}")
+        return lines
+
+class MetricsRegistry:
+    """Holds the process's metrics and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help_text, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name, help_text):
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+def counter(name, help_text):
+    """Returns the named counter from the default registry, creating it on first use."""
+    return REGISTRY.counter(name, help_text)
+
+def gauge(name, help_text):
+    """Returns the named gauge from the default registry, creating it on first use."""
+    return REGISTRY.gauge(name, help_text)
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    """Returns the named histogram from the default registry, creating it on first use."""
+    return REGISTRY.histogram(name, help_text, buckets=buckets)
+
+# --- Exposition ---
+def write_prometheus_file(path=METRICS_FILE, registry=REGISTRY):
+    """Atomically writes the registry to a Prometheus text-format file (node_exporter textfile style)."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(temp_path, path)
+
+_SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(.*)\})?\s+(\S+)$')
+_LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+def read_prometheus_file(path=METRICS_FILE):
+    """Parses a Prometheus text file into a list of (name, labels, value) samples."""
+    samples = []
+    if not os.path.exists(path):
+        return samples
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            match = _SAMPLE_PATTERN.match(line)
+            if not match:
+                continue
+            name, _, label_text, value = match.groups()
+            labels = dict(_LABEL_PATTERN.findall(label_text or ""))
+            samples.append((name, labels, float(value.replace("+Inf", "inf"))))
+    return samples
+
+def sample_total(samples, name, **labels):
+    """Sums the samples of a metric whose labels include all the given ones."""
+    return sum(
+        value for sample_name, sample_labels, value in samples
+        if sample_name == name and all(sample_labels.get(k) == v for k, v in labels.items())
+    )
+
+_exporter_thread = None
+_exporter_lock = threading.Lock()
+
+def start_file_exporter(path=METRICS_FILE, interval=DEFAULT_EXPORT_INTERVAL_SECONDS):
+    """Starts a daemon thread that rewrites the metrics file every `interval` seconds (once per process)."""
+    global _exporter_thread
+    with _exporter_lock:
+        if _exporter_thread is not None and _exporter_thread.is_alive():
+            return
+
+        def export_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    write_prometheus_file(path)
+                except Exception as e:
+                    logging.debug(f"Failed to write metrics file {path}: {e}")
+
+        _exporter_thread = threading.Thread(target=export_loop, name="metrics-exporter", daemon=True)
+        _exporter_thread.start()
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_http_server = None
+
+def start_http_server(port, host="127.0.0.1"):
+    """Serves the default registry at http://host:port/metrics from a daemon thread (once per process)."""
+    global _http_server
+    with _exporter_lock:
+        if _http_server is not None:
+            return _http_server
+        _http_server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+        threading.Thread(target=_http_server.serve_forever, name="metrics-http", daemon=True).start()
+        logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return _http_server
@@ -0,0 +1,95 @@
+import queue
+import threading
+import logging
+import metrics
+
+DEFAULT_UPLOAD_QUEUE_SIZE = 100
+
+UPLOAD_QUEUE_DEPTH = metrics.gauge("upload_queue_depth", "Upload candidates waiting in the pipeline queue.")
+
+class CandidateQueue:
+    """Bounded hand-off of upload candidates from the download stage to the upload stage."""
+
+    def __init__(self, maxsize, stop_event, poll_seconds=0.5):
+        self._queue = queue.Queue(maxsize=max(1, maxsize))
+        self._stop_event = stop_event
+        self._poll_seconds = poll_seconds
+        self._closed = threading.Event()
+        self._discarding = threading.Event()
+
+    def put(self, row):
+        """
+        Adds a candidate, blocking while the queue is full (backpressure).
+        Returns False if the candidate was not queued because the upload stage
+        has finished or a stop was requested.
+        """
+        while not (self._stop_event.is_set() or self._discarding.is_set()):
+            try:
+                self._queue.put(row, timeout=self._poll_seconds)
+                UPLOAD_QUEUE_DEPTH.set(self._queue.qsize())
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def put_many(self, rows):
+        """Adds several candidates in order. Returns False if any could not be queued."""
+        for row in rows:
+            if not self.put(row):
+                return False
+        return True
+
+    def close(self):
+        """Signals that the download stage will not produce any more candidates."""
+        self._closed.set()
+
+    def discard_remaining(self):
+        """Called once the upload stage is done; further candidates are dropped instead of blocking."""
+        self._discarding.set()
+        dropped = 0
+        while True:
+            try:
+                self._queue.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                break
+        UPLOAD_QUEUE_DEPTH.set(0)
+        if dropped:
+            logging.debug(f"Discarded {dropped} queued upload candidates after the upload stage finished.")
+
+    def drain(self, block=True, max_rows=None):
+        """
+        Returns every queued candidate (at most `max_rows`) without waiting for
+        more. With `block`, first waits until at least one is available.
+        Returns None once the queue is closed and empty or a stop is requested.
+        """
+        rows = []
+        while not self._stop_event.is_set() and (max_rows is None or len(rows) < max_rows):
+            try:
+                rows.append(self._queue.get(block=block and not rows, timeout=self._poll_seconds))
+            except queue.Empty:
+                if rows or not block:
+                    break
+                if self._closed.is_set() and self._queue.empty():
+                    break
+        UPLOAD_QUEUE_DEPTH.set(self._queue.qsize())
+        if rows:
+            return rows
+        if self._stop_event.is_set() or (self._closed.is_set() and self._queue.empty()):
+            return None
+        return rows
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def __iter__(self):
+        """Yields candidates until the download stage closes the queue or a stop is requested."""
+        while not self._stop_event.is_set():
+            try:
+                row = self._queue.get(timeout=self._poll_seconds)
+            except queue.Empty:
+                if self._closed.is_set() and self._queue.empty():
+                    return
+                continue
+            UPLOAD_QUEUE_DEPTH.set(self._queue.qsize())
+            yield row
@@ -0,0 +1,39 @@
+import copy
+import time
+import threading
+import logging
+
+# Live progress of the current worker cycle, keyed by stage ("worker",
+# "download", "upload", ...). The supervisor streams it to the Discord bot.
+_stages = {}
+_listeners = []
+_lock = threading.Lock()
+
+def update(stage, **fields):
+    """Merges fields into a stage's progress and notifies listeners."""
+    with _lock:
+        entry = _stages.setdefault(stage, {})
+        entry.update(fields)
+        entry["updated_at"] = time.time()
+        current = copy.deepcopy(_stages)
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            listener(current)
+        except Exception as e:
+            logging.debug(f"Progress listener failed: {e}")
+
+def snapshot():
+    """Returns a copy of every stage's progress."""
+    with _lock:
+        return copy.deepcopy(_stages)
+
+def reset():
+    """Forgets the progress of the previous cycle."""
+    with _lock:
+        _stages.clear()
+
+def add_listener(listener):
+    """Calls listener(snapshot) after every update."""
+    with _lock:
+        _listeners.append(listener)
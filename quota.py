@@ -0,0 +1,108 @@
+import time
+import zlib
+import logging
+import itertools
+from datetime import datetime, timedelta, timezone
+import metrics
+
+try:
+    from zoneinfo import ZoneInfo
+    # YouTube Data API quotas reset at midnight Pacific time.
+    QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+except Exception:  # No tz database available (e.g. Windows without tzdata); ignores daylight saving.
+    QUOTA_TIMEZONE = timezone(timedelta(hours=-8))
+
+DEFAULT_DAILY_QUOTA_UNITS = 10000
+VIDEO_INSERT_UNITS = 1600
+ROUTING_STRATEGIES = ("affinity", "round_robin")
+
+QUOTA_UNITS_USED = metrics.gauge("youtube_quota_units_used", "YouTube API quota units used today, per channel.")
+
+class QuotaExceededError(Exception):
+    """Raised when YouTube rejects a request because the channel's quota is used up."""
+
+def quota_day(now=None):
+    """Returns the current YouTube quota day as YYYY-MM-DD."""
+    return datetime.fromtimestamp(time.time() if now is None else now, QUOTA_TIMEZONE).date().isoformat()
+
+class QuotaLedger:
+    """Per-channel, per-day count of quota units, persisted in the state store."""
+
+    def __init__(self, state, daily_units=DEFAULT_DAILY_QUOTA_UNITS):
+        self.state = state
+        self.daily_units = daily_units
+
+    def used(self, channel, now=None):
+        return self.state.quota_units_used(channel, quota_day(now))
+
+    def remaining(self, channel, now=None):
+        return max(0, self.daily_units - self.used(channel, now))
+
+    def reserve(self, channel, units, now=None):
+        """
+        Books `units` against today's quota before the request is sent. Returns
+        the quota day that was charged, or None if the units would exceed it.
+        """
+        day = quota_day(now)
+        if not self.state.reserve_quota_units(channel, day, units, self.daily_units):
+            return None
+        QUOTA_UNITS_USED.set(self.state.quota_units_used(channel, day), channel=channel)
+        return day
+
+    def release(self, channel, units, now=None):
+        """Gives back units reserved at `now` for a request that was never sent, e.g. because of a stop."""
+        day = quota_day(now)
+        self.state.release_quota_units(channel, day, units)
+        QUOTA_UNITS_USED.set(self.state.quota_units_used(channel, day), channel=channel)
+
+    def exhaust(self, channel, now=None):
+        """Marks today's quota as used up, e.g. after YouTube answered quotaExceeded."""
+        day = quota_day(now)
+        self.state.exhaust_quota(channel, day, self.daily_units)
+        QUOTA_UNITS_USED.set(self.daily_units, channel=channel)
+        logging.warning(f"YouTube quota of channel '{channel}' is used up for {day}.")
+
+class ChannelRouter:
+    """
+    Assigns upload candidates to channels. With "affinity" a creator always
+    goes to the same channel (pinned in `affinity` or picked by a stable hash
+    of the username); with "round_robin" candidates rotate across channels.
+    Either way, a channel without quota for the upload is passed over for the
+    next one, and no channel is ever booked past its quota.
+    """
+
+    def __init__(self, channels, ledger, strategy="affinity", affinity=None, cost=VIDEO_INSERT_UNITS):
+        if strategy not in ROUTING_STRATEGIES:
+            logging.warning(f"Unknown channel routing '{strategy}'. Using affinity.")
+            strategy = "affinity"
+        self.channels = list(channels)
+        self.ledger = ledger
+        self.strategy = strategy
+        self.affinity = affinity or {}
+        self.cost = cost
+        self._turn = itertools.count()
+
+    def _preference(self, row):
+        """Returns the channels in the order they should be tried for a candidate."""
+        if self.strategy == "round_robin":
+            start = next(self._turn) % len(self.channels)
+        else:
+            username = row.get("author_username") or ""
+            pinned = self.affinity.get(username)
+            if pinned in self.channels:
+                start = self.channels.index(pinned)
+            else:
+                start = zlib.crc32(username.encode("utf-8")) % len(self.channels)
+        return self.channels[start:] + self.channels[:start]
+
+    def route(self, row, now=None):
+        """Reserves quota for the candidate on a channel and returns that channel, or None if none has quota."""
+        for channel in self._preference(row):
+            if self.ledger.reserve(channel, self.cost, now):
+                return channel
+        return None
+
+    def remove(self, channel):
+        """Stops routing to a channel, e.g. because it could not be authenticated."""
+        if channel in self.channels:
+            self.channels.remove(channel)
@@ -0,0 +1,155 @@
+import time
+import logging
+import numpy as np
+import pandas as pd
+
+# Relative weight of each scoring term. Each term is scaled to 0..1 within the
+# batch being ranked, so the weights compare like for like.
+DEFAULT_RANKING_WEIGHTS = {
+    "plays": 1.0,
+    "likes": 1.0,
+    "shares": 1.5,
+    "comments": 1.0,
+    "recency": 1.0,
+    "fairness": 1.0,
+}
+ENGAGEMENT_COLUMNS = {
+    "plays": "video_playcount",
+    "likes": "video_diggcount",
+    "shares": "video_sharecount",
+    "comments": "video_commentcount",
+}
+# A clip loses half of its recency score every RECENCY_HALF_LIFE_HOURS.
+RECENCY_HALF_LIFE_HOURS = 48
+# Most candidates held for ranking at once; further arrivals wait in the upload queue.
+DEFAULT_RANKING_POOL_SIZE = 1000
+
+def resolve_weights(weights=None):
+    """Returns the default ranking weights overridden by any valid configured ones."""
+    resolved = dict(DEFAULT_RANKING_WEIGHTS)
+    for name, value in (weights or {}).items():
+        if name not in resolved:
+            logging.warning(f"Ignoring unknown ranking weight '{name}'.")
+            continue
+        try:
+            resolved[name] = float(value)
+        except (TypeError, ValueError):
+            logging.warning(f"Ignoring non-numeric ranking weight {name}={value!r}.")
+    return resolved
+
+def score_candidates(rows, weights=None, now=None):
+    """
+    Scores metadata rows in one vectorized pass and returns a numpy array.
+
+    Engagement counts are log-scaled so one viral clip does not flatten every
+    other score, then divided by the batch maximum. Recency decays with the
+    clip's age, which TikTok encodes in the top 32 bits of the video ID. The
+    fairness term is a penalty that grows with each further clip from the
+    same creator, so a single prolific creator cannot take every slot.
+    """
+    weights = resolve_weights(weights)
+    now = time.time() if now is None else now
+    if not rows:
+        return np.empty(0)
+    frame = pd.DataFrame.from_records(
+        rows, columns=["video_id", "author_username"] + list(ENGAGEMENT_COLUMNS.values())
+    )
+
+    scores = np.zeros(len(frame))
+    for name, column in ENGAGEMENT_COLUMNS.items():
+        values = np.log1p(pd.to_numeric(frame[column], errors="coerce").fillna(0).clip(lower=0).to_numpy(float))
+        peak = values.max()
+        if peak > 0:
+            scores += weights[name] * values / peak
+
+    created_at = np.floor(pd.to_numeric(frame["video_id"], errors="coerce").to_numpy(float) / 2**32)
+    age_hours = np.clip((now - created_at) / 3600, 0, None)
+    recency = np.exp2(-age_hours / RECENCY_HALF_LIFE_HOURS)
+    scores += weights["recency"] * np.nan_to_num(recency, nan=0.0)
+
+    # 1 for a creator's best clip, 2 for their second best, ...
+    creator_rank = (
+        pd.Series(scores).groupby(frame["author_username"].fillna("").to_numpy())
+        .rank(method="first", ascending=False).to_numpy()
+    )
+    scores -= weights["fairness"] * (1 - 1 / creator_rank)
+    return scores
+
+def top_k_indices(scores, k):
+    """Returns the indices of the k highest scores, best first, using a partial sort."""
+    count = len(scores)
+    k = min(k, count)
+    if k <= 0:
+        return np.empty(0, dtype=int)
+    if k < count:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(count)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def rank_candidates(rows, k, weights=None, now=None):
+    """Returns the k best-scoring metadata rows, best first."""
+    scores = score_candidates(rows, weights, now)
+    return [rows[index] for index in top_k_indices(scores, k)]
+
+def _cap_pool(pool, max_pool, weights):
+    """Evicts the lowest-scoring rows so that at most max_pool are left, keeping arrival order."""
+    if not max_pool or len(pool) <= max_pool:
+        return pool
+    scores = score_candidates(pool, weights)
+    keep = np.sort(np.argpartition(-scores, max_pool - 1)[:max_pool])
+    logging.debug(f"Ranking pool full: evicted {len(pool) - max_pool} of the lowest-scoring candidates.")
+    return [pool[index] for index in keep]
+
+def iter_ranked_candidates(fetch_new, k, weights=None, max_pool=DEFAULT_RANKING_POOL_SIZE):
+    """
+    Yields candidates best-first from a pool that may keep growing.
+
+    `fetch_new(block, limit)` returns up to `limit` (None: any number of)
+    rows that arrived since the last call, waiting for at least one if
+    `block` is true, or None once no more will come. The pool is re-ranked
+    whenever new rows arrive, and each ranking takes only the top `k` rows,
+    so scoring stays a single vectorized pass plus a partial sort.
+
+    The pool holds at most `max_pool` rows (never fewer than `k`). Only the
+    room left is fetched, so a bounded source such as the CandidateQueue
+    fills up and holds back its producer while the uploads catch up. A
+    source that hands over more at once has its lowest-scoring rows evicted;
+    they stay pending in the state store for a later run.
+    """
+    if max_pool:
+        max_pool = max(k, max_pool)
+    pool = []
+    source_open = True
+    while True:
+        room = max_pool - len(pool) if max_pool else None
+        if source_open and room != 0:
+            new_rows = fetch_new(not pool, room)
+            if new_rows is None:
+                source_open = False
+            else:
+                pool.extend(new_rows)
+                pool = _cap_pool(pool, max_pool, weights)
+        if not pool:
+            if source_open:
+                continue
+            return
+
+        scores = score_candidates(pool, weights)
+        picked = set()
+        for index in top_k_indices(scores, k):
+            picked.add(index)
+            yield pool[index]
+            # New arrivals may outrank what is left of this ranking.
+            room = max_pool - len(pool) + len(picked) if max_pool else None
+            if source_open and room != 0 and _has_new_rows(fetch_new, pool, room):
+                break
+        pool = [row for index, row in enumerate(pool) if index not in picked]
+
+def _has_new_rows(fetch_new, pool, limit):
+    """Moves up to `limit` rows that arrived without blocking into the pool. Returns True if there were some."""
+    new_rows = fetch_new(False, limit)
+    if new_rows:
+        pool.extend(new_rows)
+        return True
+    return False
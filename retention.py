@@ -0,0 +1,114 @@
+import os
+import time
+import logging
+import numpy as np
+import metrics
+import progress
+from ranking import score_candidates
+
+VIDEO_FILENAME_MARKER = "_video_"
+
+RECLAIMED_BYTES = metrics.counter("retention_reclaimed_bytes_total", "Bytes freed by evicting downloaded clips.")
+EVICTED_FILES = metrics.counter("retention_evicted_files_total", "Downloaded clips evicted, by reason.")
+DOWNLOAD_DIR_BYTES = metrics.gauge("download_dir_bytes", "Indexed size of the download directory.")
+
+def index_existing_files(state, download_dir):
+    """One-time scan that adds clips downloaded before the media index existed."""
+    if state.get_setting("media_index_built") or not os.path.isdir(download_dir):
+        state.set_setting("media_index_built", "1")
+        return
+    count = 0
+    for entry in os.scandir(download_dir):
+        if entry.is_file() and entry.name.startswith("@") and entry.name.endswith(".mp4"):
+            username, _, video_id = entry.name[1:-len(".mp4")].rpartition(VIDEO_FILENAME_MARKER)
+            if video_id:
+                state.record_media_file(video_id, entry.path, username, entry.stat().st_size)
+                count += 1
+    state.set_setting("media_index_built", "1")
+    logging.info(f"Indexed {count} existing clips in {download_dir}.")
+
+def expire_backlog(state, max_age_seconds):
+    """
+    Drops backlog clips that have waited longer than `max_age_seconds` for an
+    upload: they are marked expired, so they are not fetched again, and their
+    files are deleted. Returns the number of clips that expired.
+    """
+    if not max_age_seconds:
+        return 0
+    expired = state.expire_backlog(time.time() - max_age_seconds)
+    reclaimed = 0
+    for media in expired:
+        try:
+            size = os.path.getsize(media["path"])
+            os.remove(media["path"])
+            reclaimed += size
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not delete expired clip {media['path']}: {e}")
+            continue
+        state.remove_media_file(media["video_id"])
+    if expired:
+        EVICTED_FILES.inc(len(expired), reason="expired")
+        RECLAIMED_BYTES.inc(reclaimed)
+        logging.info(f"⌛ Expired {len(expired)} backlog clips older than {max_age_seconds / 86400:g} days "
+                     f"({reclaimed / 1048576:.1f} MB).")
+    return len(expired)
+
+def eviction_order(state, ranking_weights=None):
+    """
+    Returns indexed clips in the order they should be evicted: uploaded (or
+    skipped) clips first, oldest upload first, then pending clips from the
+    lowest engagement score up. Pending clips without metadata cannot be
+    uploaded, so they go before any ranked ones.
+    """
+    files = state.media_files()
+    done = sorted((f for f in files if f["uploaded_at"] or f["skipped"]),
+                  key=lambda f: f["uploaded_at"] or f["added_at"])
+    pending = [f for f in files if not (f["uploaded_at"] or f["skipped"])]
+    if not pending:
+        return done
+
+    metadata = state.video_metadata(f["video_id"] for f in pending)
+    rows = [metadata.get(f["video_id"], {"video_id": f["video_id"], "author_username": f["author_username"]})
+            for f in pending]
+    scores = score_candidates(rows, ranking_weights)
+    scores[[f["video_id"] not in metadata for f in pending]] = -np.inf
+    return done + [pending[index] for index in np.argsort(scores, kind="stable")]
+
+def enforce_disk_budget(state, budget_bytes, ranking_weights=None):
+    """
+    Evicts clips until the indexed size of the download directory fits within
+    `budget_bytes`. Sizes come from the media index, so the directory is never
+    rescanned. Returns the number of bytes reclaimed.
+    """
+    total = state.media_bytes()
+    DOWNLOAD_DIR_BYTES.set(total)
+    if not budget_bytes or total <= budget_bytes:
+        return 0
+
+    excess = total - budget_bytes
+    reclaimed = 0
+    evicted = 0
+    for media in eviction_order(state, ranking_weights):
+        if reclaimed >= excess:
+            break
+        try:
+            os.remove(media["path"])
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not evict {media['path']}: {e}")
+            continue
+        state.remove_media_file(media["video_id"])
+        reclaimed += media["size"]
+        evicted += 1
+        EVICTED_FILES.inc(reason="uploaded" if media["uploaded_at"] or media["skipped"] else "pending")
+
+    RECLAIMED_BYTES.inc(reclaimed)
+    progress.update("retention", evicted=evicted, reclaimed_bytes=reclaimed, directory_bytes=total - reclaimed)
+    DOWNLOAD_DIR_BYTES.set(total - reclaimed)
+    logging.info(f"♻️ Reclaimed {reclaimed / 1048576:.1f} MB by evicting {evicted} clips. "
+                 f"Download directory now holds {(total - reclaimed) / 1048576:.1f} MB "
+                 f"of a {budget_bytes / 1048576:.1f} MB budget.")
+    return reclaimed
@@ -0,0 +1,768 @@
+import os
+import csv
+import json
+import sqlite3
+import threading
+import logging
+import time
+
+STATE_DB_PATH = os.path.join("resources", "state.db")
+# The metadata.csv columns the pipeline reads. They are also kept per video in
+# the video_metadata table, so candidates can be streamed without the CSV.
+METADATA_COLUMNS = (
+    "video_id", "author_username", "video_description",
+    "video_playcount", "video_diggcount", "video_sharecount", "video_commentcount",
+)
+_METADATA_COUNT_COLUMNS = METADATA_COLUMNS[3:]
+
+# Each entry upgrades the schema by one version; the applied version is kept in
+# PRAGMA user_version so existing databases are migrated in place.
+_MIGRATIONS = [
+    """
+    CREATE TABLE runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started_at REAL NOT NULL,
+        completed_at REAL
+    );
+    CREATE TABLE creators (
+        username TEXT PRIMARY KEY,
+        last_run_id INTEGER,
+        last_processed_at REAL
+    );
+    CREATE INDEX idx_creators_last_run ON creators (last_run_id);
+    CREATE TABLE videos (
+        video_id TEXT PRIMARY KEY,
+        author_username TEXT,
+        run_id INTEGER,
+        downloaded_at REAL,
+        uploaded_at REAL,
+        youtube_id TEXT
+    );
+    CREATE INDEX idx_videos_run ON videos (run_id);
+    CREATE INDEX idx_videos_uploaded ON videos (uploaded_at);
+    CREATE TABLE upload_attempts (
+        attempt_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        video_id TEXT NOT NULL,
+        attempted_at REAL NOT NULL,
+        success INTEGER NOT NULL,
+        youtube_id TEXT,
+        error TEXT
+    );
+    CREATE INDEX idx_upload_attempts_video ON upload_attempts (video_id);
+    CREATE TABLE settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """,
+    """
+    CREATE TABLE publish_slots (
+        run_id INTEGER NOT NULL,
+        slot_index INTEGER NOT NULL,
+        publish_at REAL NOT NULL,
+        video_id TEXT,
+        PRIMARY KEY (run_id, slot_index)
+    );
+    """,
+    """
+    CREATE TABLE upload_sessions (
+        video_id TEXT PRIMARY KEY,
+        session_uri TEXT NOT NULL,
+        bytes_sent INTEGER NOT NULL DEFAULT 0,
+        file_size INTEGER,
+        updated_at REAL NOT NULL
+    );
+    """,
+    """
+    ALTER TABLE creators ADD COLUMN newest_video_id INTEGER;
+    ALTER TABLE creators ADD COLUMN newest_create_time REAL;
+    CREATE INDEX idx_videos_author ON videos (author_username);
+    """,
+    """
+    CREATE TABLE fingerprints (
+        video_id TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        perceptual_hash INTEGER,
+        file_size INTEGER,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX idx_fingerprints_content ON fingerprints (content_hash);
+    """,
+    """
+    CREATE TABLE media_files (
+        video_id TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        author_username TEXT,
+        size INTEGER NOT NULL,
+        added_at REAL NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE quota_usage (
+        channel TEXT NOT NULL,
+        quota_day TEXT NOT NULL,
+        units_used INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (channel, quota_day)
+    );
+    """,
+    """
+    CREATE TABLE video_metadata (
+        video_id TEXT PRIMARY KEY,
+        author_username TEXT,
+        video_description TEXT,
+        video_playcount INTEGER,
+        video_diggcount INTEGER,
+        video_sharecount INTEGER,
+        video_commentcount INTEGER
+    );
+    """,
+    """
+    CREATE TABLE upload_manifests (
+        video_id TEXT PRIMARY KEY,
+        snippet TEXT NOT NULL,
+        built_at REAL NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE media_probes (
+        content_hash TEXT PRIMARY KEY,
+        duration REAL,
+        width INTEGER,
+        height INTEGER,
+        bit_rate INTEGER,
+        codec TEXT,
+        probed_at REAL NOT NULL
+    );
+    """,
+    """
+    ALTER TABLE videos ADD COLUMN expired_at REAL;
+    CREATE INDEX idx_videos_downloaded ON videos (downloaded_at);
+    """,
+    """
+    CREATE TABLE creator_health (
+        username TEXT PRIMARY KEY,
+        consecutive_failures INTEGER NOT NULL DEFAULT 0,
+        circuit_open INTEGER NOT NULL DEFAULT 0,
+        circuit_opens INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        last_failure_at REAL,
+        last_success_at REAL,
+        next_attempt_at REAL
+    );
+    """,
+    """
+    ALTER TABLE videos ADD COLUMN exported_at REAL;
+    UPDATE videos SET exported_at = downloaded_at WHERE run_id IS NOT NULL;
+    """,
+]
+
+# Pending videos that were skipped on purpose and must not be offered again.
+_SKIPPED_ATTEMPT = (
+    "EXISTS (SELECT 1 FROM upload_attempts a WHERE a.video_id = {video_id} "
+    "AND (a.error LIKE 'duplicate of %' OR a.error LIKE 'not a short: %'))"
+)
+# The cross-run backlog: downloaded clips still on disk, not uploaded, skipped or expired.
+_BACKLOG_WHERE = (
+    "v.uploaded_at IS NULL AND v.expired_at IS NULL AND v.downloaded_at >= ? "
+    "AND NOT " + _SKIPPED_ATTEMPT.format(video_id="v.video_id")
+)
+
+def _to_count(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+def project_metadata(row):
+    """Returns only the METADATA_COLUMNS of a metadata row, with counts as integers."""
+    projected = {column: row.get(column) for column in METADATA_COLUMNS}
+    projected["video_id"] = str(projected["video_id"] or "")
+    projected["video_description"] = projected["video_description"] or ""
+    for column in _METADATA_COUNT_COLUMNS:
+        projected[column] = _to_count(projected[column])
+    return projected
+
+class StateStore:
+    """SQLite-backed ledger of runs, creators, videos and upload attempts."""
+
+    def __init__(self, db_path=STATE_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._migrate()
+
+    def _connect(self):
+        """Returns this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self):
+        """Brings the database schema up to the latest version."""
+        conn = self._connect()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for index, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+            with conn:
+                conn.executescript(f"BEGIN; {script} PRAGMA user_version = {index}; COMMIT;")
+            logging.debug(f"State store migrated to schema version {index}.")
+
+    def close(self):
+        """Closes this thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --- Settings ---
+    def get_setting(self, key, default=None):
+        """Returns a stored setting value, or default if it is not set."""
+        row = self._connect().execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else default
+
+    def set_setting(self, key, value):
+        """Stores a setting value, replacing any previous one."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO settings (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+
+    # --- Runs ---
+    def begin_run(self):
+        """Resumes the latest unfinished run or opens a new one. Returns (run_id, resumed)."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT run_id, completed_at FROM runs ORDER BY run_id DESC LIMIT 1").fetchone()
+            if row is not None and row["completed_at"] is None:
+                return row["run_id"], True
+            cursor = conn.execute("INSERT INTO runs (started_at) VALUES (?)", (time.time(),))
+            return cursor.lastrowid, False
+
+    def complete_run(self, run_id):
+        """Marks a run as finished so the next cycle starts fresh."""
+        with self._connect() as conn:
+            conn.execute("UPDATE runs SET completed_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+    # --- Creators ---
+    def processed_creators(self, run_id):
+        """Returns the set of creators already processed in the given run."""
+        rows = self._connect().execute("SELECT username FROM creators WHERE last_run_id = ?", (run_id,))
+        return {row["username"] for row in rows}
+
+    def mark_creator_processed(self, username, run_id, newest_video_id=None):
+        """
+        Records that a creator's downloads finished in the given run and
+        advances their high-water mark to `newest_video_id` if it is newer.
+        """
+        # TikTok video IDs carry their creation time (Unix seconds) in the top 32 bits.
+        newest_create_time = newest_video_id >> 32 if newest_video_id else None
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO creators (username, last_run_id, last_processed_at, newest_video_id, newest_create_time) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET last_run_id = excluded.last_run_id, "
+                "last_processed_at = excluded.last_processed_at, "
+                "newest_video_id = MAX(COALESCE(creators.newest_video_id, 0), COALESCE(excluded.newest_video_id, 0)), "
+                "newest_create_time = MAX(COALESCE(creators.newest_create_time, 0), "
+                "COALESCE(excluded.newest_create_time, 0))",
+                (username, run_id, time.time(), newest_video_id, newest_create_time)
+            )
+
+    def creator_high_water_mark(self, username):
+        """Returns the newest video ID seen for a creator, or None if they were never fetched."""
+        row = self._connect().execute(
+            "SELECT newest_video_id FROM creators WHERE username = ?", (username,)
+        ).fetchone()
+        return row["newest_video_id"] or None if row else None
+
+    def creator_backlog(self, username):
+        """Returns the IDs of a creator's videos that were downloaded but never uploaded."""
+        rows = self._connect().execute(
+            "SELECT video_id FROM videos WHERE author_username = ? AND uploaded_at IS NULL AND expired_at IS NULL",
+            (username,)
+        )
+        return {row["video_id"] for row in rows}
+
+    def get_creator_health(self, username):
+        """Returns a creator's health record (see creator_health.py), or None if they never failed or succeeded."""
+        row = self._connect().execute("SELECT * FROM creator_health WHERE username = ?", (username,)).fetchone()
+        return dict(row) if row else None
+
+    def all_creator_health(self):
+        """Returns every creator's health record, keyed by username."""
+        rows = self._connect().execute("SELECT * FROM creator_health")
+        return {row["username"]: dict(row) for row in rows}
+
+    def save_creator_health(self, username, consecutive_failures, circuit_open, circuit_opens, last_error=None,
+                            last_failure_at=None, last_success_at=None, next_attempt_at=None):
+        """Replaces a creator's health record."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO creator_health (username, consecutive_failures, circuit_open, circuit_opens, "
+                "last_error, last_failure_at, last_success_at, next_attempt_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (username, consecutive_failures, int(bool(circuit_open)), circuit_opens, last_error, last_failure_at,
+                 last_success_at, next_attempt_at)
+            )
+
+    # --- Videos ---
+    def merge_run_videos(self, rows, run_id, append_rows):
+        """
+        Adds metadata rows to a run, deduplicating on video_id at insert time.
+
+        Rows whose video_id is already part of the run are dropped. Rows never
+        exported before are handed to `append_rows` inside the same
+        transaction, so the index is only committed once the rows have been
+        persisted. A clip listed again by a later run (e.g. from the backlog)
+        joins that run but is not handed on twice. Returns the number of rows
+        handed on.
+        """
+        now = time.time()
+        new_rows = []
+        with self._connect() as conn:
+            for row in rows:
+                video_id = str(row.get("video_id") or "")
+                if not video_id:
+                    continue
+                cursor = conn.execute(
+                    "INSERT INTO videos (video_id, author_username, run_id, downloaded_at) VALUES (?, ?, ?, ?) "
+                    # A re-listed clip keeps its first download time, so it still ages out of the backlog.
+                    "ON CONFLICT(video_id) DO UPDATE SET run_id = excluded.run_id, "
+                    "downloaded_at = COALESCE(videos.downloaded_at, excluded.downloaded_at) "
+                    "WHERE videos.run_id IS NOT excluded.run_id",
+                    (video_id, row.get("author_username"), run_id, now)
+                )
+                if cursor.rowcount and conn.execute(
+                    "UPDATE videos SET exported_at = ? WHERE video_id = ? AND exported_at IS NULL", (now, video_id)
+                ).rowcount:
+                    new_rows.append(row)
+            # Engagement counts are refreshed even for videos the run already has.
+            self._upsert_metadata(conn, rows)
+            if new_rows:
+                append_rows(new_rows)
+        return len(new_rows)
+
+    def _upsert_metadata(self, conn, rows):
+        placeholders = ", ".join("?" for _ in METADATA_COLUMNS)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO video_metadata ({', '.join(METADATA_COLUMNS)}) VALUES ({placeholders})",
+            (tuple(projected.values()) for projected in map(project_metadata, rows) if projected["video_id"])
+        )
+
+    def iter_pending_metadata(self, run_id, batch_size=500):
+        """
+        Streams the metadata of the run's videos that are not uploaded yet, as
+        dicts of METADATA_COLUMNS. Rows are fetched in batches straight from
+        the indexes, so nothing is read that the caller does not consume.
+        """
+        cursor = self._connect().execute(
+            f"SELECT {', '.join('m.' + column for column in METADATA_COLUMNS)} FROM videos v "
+            "JOIN video_metadata m ON m.video_id = v.video_id "
+            "WHERE v.run_id = ? AND v.uploaded_at IS NULL",
+            (run_id,)
+        )
+        yield from self._stream(cursor, batch_size)
+
+    def iter_backlog(self, since=0, batch_size=500):
+        """
+        Streams the metadata of the upload backlog: clips from any run that are
+        still on disk and were downloaded at or after `since`, but were not
+        uploaded, skipped or expired.
+        """
+        cursor = self._connect().execute(
+            f"SELECT {', '.join('m.' + column for column in METADATA_COLUMNS)} FROM videos v "
+            "JOIN video_metadata m ON m.video_id = v.video_id "
+            "JOIN media_files f ON f.video_id = v.video_id "
+            f"WHERE {_BACKLOG_WHERE}",
+            (since,)
+        )
+        yield from self._stream(cursor, batch_size)
+
+    def backlog_count(self, since=0):
+        """Returns the number of clips in the upload backlog (see iter_backlog)."""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM videos v JOIN video_metadata m ON m.video_id = v.video_id "
+            f"JOIN media_files f ON f.video_id = v.video_id WHERE {_BACKLOG_WHERE}",
+            (since,)
+        ).fetchone()[0]
+
+    def expire_backlog(self, before):
+        """
+        Marks pending videos downloaded before `before` as expired, so they
+        are neither offered for upload nor fetched again. Returns the expired
+        clips that are still indexed, as dicts of video_id and path.
+        """
+        with self._connect() as conn:
+            expired = [dict(row) for row in conn.execute(
+                "SELECT v.video_id, f.path FROM videos v LEFT JOIN media_files f ON f.video_id = v.video_id "
+                "WHERE v.uploaded_at IS NULL AND v.expired_at IS NULL AND v.downloaded_at < ?",
+                (before,)
+            )]
+            conn.executemany(
+                "UPDATE videos SET expired_at = ? WHERE video_id = ?",
+                ((time.time(), row["video_id"]) for row in expired)
+            )
+        return [row for row in expired if row["path"]]
+
+    @staticmethod
+    def _stream(cursor, batch_size):
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+
+    def video_metadata(self, video_ids):
+        """Returns the stored metadata of the given videos, keyed by video_id."""
+        video_ids = [str(video_id) for video_id in video_ids]
+        found = {}
+        conn = self._connect()
+        # Stay well below SQLite's limit on bound parameters.
+        for start in range(0, len(video_ids), 500):
+            batch = video_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT {', '.join(METADATA_COLUMNS)} FROM video_metadata "
+                f"WHERE video_id IN ({', '.join('?' for _ in batch)})",
+                batch
+            )
+            found.update((row["video_id"], dict(row)) for row in rows)
+        return found
+
+    # --- Upload manifests ---
+    def save_manifests(self, manifests):
+        """Stores prebuilt videos.insert snippets, given as (video_id, snippet) pairs."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO upload_manifests (video_id, snippet, built_at) VALUES (?, ?, ?)",
+                ((str(video_id), json.dumps(snippet, ensure_ascii=False), now) for video_id, snippet in manifests)
+            )
+
+    def get_manifest(self, video_id):
+        """Returns the prebuilt snippet of a video, or None if there is none."""
+        row = self._connect().execute(
+            "SELECT snippet FROM upload_manifests WHERE video_id = ?", (str(video_id),)
+        ).fetchone()
+        return json.loads(row["snippet"]) if row else None
+
+    def import_metadata_csv(self, metadata_path, batch_size=1000):
+        """One-time import of metadata.csv rows collected before the video_metadata table existed."""
+        if self.get_setting("video_metadata_imported"):
+            return
+        count = 0
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'r', encoding='utf-8', newline='') as f:
+                batch = []
+                for row in csv.DictReader(f):
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        with self._connect() as conn:
+                            self._upsert_metadata(conn, batch)
+                        count += len(batch)
+                        batch = []
+                with self._connect() as conn:
+                    self._upsert_metadata(conn, batch)
+                count += len(batch)
+            logging.info(f"Imported the metadata of {count} videos from {metadata_path}.")
+        self.set_setting("video_metadata_imported", "1")
+
+    def run_video_count(self, run_id):
+        """Returns the number of unique videos collected in the given run."""
+        return self._connect().execute("SELECT COUNT(*) FROM videos WHERE run_id = ?", (run_id,)).fetchone()[0]
+
+    def is_uploaded(self, video_id):
+        """Checks the indexed ledger for a successful upload of the video."""
+        row = self._connect().execute(
+            "SELECT 1 FROM videos WHERE video_id = ? AND uploaded_at IS NOT NULL", (str(video_id),)
+        ).fetchone()
+        return row is not None
+
+    def uploaded_count(self):
+        """Returns the number of videos uploaded so far."""
+        return self._connect().execute("SELECT COUNT(*) FROM videos WHERE uploaded_at IS NOT NULL").fetchone()[0]
+
+    def record_upload_attempt(self, video_id, success, youtube_id=None, error=None, publish_slot=None):
+        """
+        Logs an upload attempt and, if it succeeded, marks the video as uploaded.
+        A successful scheduled upload also claims its (run_id, slot_index)
+        publish slot in the same transaction.
+        """
+        now = time.time()
+        video_id = str(video_id)
+        with self._connect() as conn:
+            if success and publish_slot is not None:
+                conn.execute(
+                    "UPDATE publish_slots SET video_id = ? WHERE run_id = ? AND slot_index = ?",
+                    (video_id, publish_slot[0], publish_slot[1])
+                )
+            conn.execute(
+                "INSERT INTO upload_attempts (video_id, attempted_at, success, youtube_id, error) VALUES (?, ?, ?, ?, ?)",
+                (video_id, now, int(bool(success)), youtube_id, error)
+            )
+            if success:
+                conn.execute(
+                    "INSERT INTO videos (video_id, uploaded_at, youtube_id) VALUES (?, ?, ?) "
+                    "ON CONFLICT(video_id) DO UPDATE SET uploaded_at = excluded.uploaded_at, "
+                    "youtube_id = excluded.youtube_id",
+                    (video_id, now, youtube_id)
+                )
+
+    def last_upload_attempt(self, video_id):
+        """Returns the latest upload attempt of a video as a dict, or None if it was never attempted."""
+        row = self._connect().execute(
+            "SELECT attempted_at, success, youtube_id, error FROM upload_attempts WHERE video_id = ? "
+            "ORDER BY attempted_at DESC LIMIT 1",
+            (str(video_id),)
+        ).fetchone()
+        return dict(row) if row else None
+
+    # --- Content fingerprints ---
+    def record_fingerprint(self, video_id, content_hash, perceptual_hash=None, file_size=None):
+        """Stores the content fingerprint of a downloaded clip."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO fingerprints (video_id, content_hash, perceptual_hash, file_size, created_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(video_id) DO UPDATE SET content_hash = excluded.content_hash, "
+                "perceptual_hash = COALESCE(excluded.perceptual_hash, fingerprints.perceptual_hash), "
+                "file_size = excluded.file_size, created_at = excluded.created_at",
+                (str(video_id), content_hash, perceptual_hash, file_size, time.time())
+            )
+
+    def get_fingerprint(self, video_id):
+        """Returns the stored fingerprint of a clip as a dict, or None."""
+        row = self._connect().execute(
+            "SELECT content_hash, perceptual_hash, file_size FROM fingerprints WHERE video_id = ?", (str(video_id),)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def find_uploaded_by_content_hash(self, content_hash, exclude_video_id=None):
+        """Returns the ID of an uploaded video with the given content hash, or None."""
+        row = self._connect().execute(
+            "SELECT f.video_id FROM fingerprints f JOIN videos v ON v.video_id = f.video_id "
+            "WHERE f.content_hash = ? AND f.video_id IS NOT ? AND v.uploaded_at IS NOT NULL LIMIT 1",
+            (content_hash, None if exclude_video_id is None else str(exclude_video_id))
+        ).fetchone()
+        return row["video_id"] if row else None
+
+    def uploaded_perceptual_hashes(self, exclude_video_id=None):
+        """Returns (video_id, perceptual_hash) for every uploaded video that has a perceptual hash."""
+        rows = self._connect().execute(
+            "SELECT f.video_id, f.perceptual_hash FROM fingerprints f JOIN videos v ON v.video_id = f.video_id "
+            "WHERE f.perceptual_hash IS NOT NULL AND f.video_id IS NOT ? AND v.uploaded_at IS NOT NULL",
+            (None if exclude_video_id is None else str(exclude_video_id),)
+        )
+        return [(row["video_id"], row["perceptual_hash"]) for row in rows]
+
+    # --- Downloaded media ---
+    def record_media_file(self, video_id, path, author_username, size):
+        """Adds a downloaded clip to the index of files kept in the download directory."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO media_files (video_id, path, author_username, size, added_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(video_id) DO UPDATE SET path = excluded.path, size = excluded.size, "
+                "added_at = excluded.added_at",
+                (str(video_id), path, author_username, size, time.time())
+            )
+
+    def remove_media_file(self, video_id):
+        """Drops a clip from the media index after its file was deleted."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM media_files WHERE video_id = ?", (str(video_id),))
+
+    def media_bytes(self):
+        """Returns the total size of the indexed clips."""
+        return self._connect().execute("SELECT COALESCE(SUM(size), 0) FROM media_files").fetchone()[0]
+
+    def media_files(self):
+        """
+        Returns every indexed clip with its size, its upload time (None if not
+        uploaded) and whether it was skipped, as a duplicate of an uploaded
+        video or because it is not a Short.
+        """
+        rows = self._connect().execute(
+            "SELECT m.video_id, m.path, m.author_username, m.size, m.added_at, v.uploaded_at, "
+            f"{_SKIPPED_ATTEMPT.format(video_id='m.video_id')} AS skipped "
+            "FROM media_files m LEFT JOIN videos v ON v.video_id = m.video_id"
+        )
+        return [dict(row) for row in rows]
+
+    def record_media_probe(self, content_hash, probe):
+        """Caches ffprobe results for a clip's content."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO media_probes (content_hash, duration, width, height, bit_rate, codec, probed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (content_hash, probe.get("duration"), probe.get("width"), probe.get("height"),
+                 probe.get("bit_rate"), probe.get("codec"), time.time())
+            )
+
+    def get_media_probe(self, content_hash):
+        """Returns the cached ffprobe results for a content hash, or None."""
+        row = self._connect().execute(
+            "SELECT duration, width, height, bit_rate, codec FROM media_probes WHERE content_hash = ?",
+            (content_hash,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    # --- API quota ---
+    def quota_units_used(self, channel, quota_day):
+        """Returns the quota units a channel has booked on the given quota day."""
+        row = self._connect().execute(
+            "SELECT units_used FROM quota_usage WHERE channel = ? AND quota_day = ?", (channel, quota_day)
+        ).fetchone()
+        return row["units_used"] if row else 0
+
+    def reserve_quota_units(self, channel, quota_day, units, limit):
+        """Atomically books units for a channel unless that would exceed `limit`. Returns True if booked."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO quota_usage (channel, quota_day, units_used) VALUES (?, ?, 0)",
+                (channel, quota_day)
+            )
+            cursor = conn.execute(
+                "UPDATE quota_usage SET units_used = units_used + ? "
+                "WHERE channel = ? AND quota_day = ? AND units_used + ? <= ?",
+                (units, channel, quota_day, units, limit)
+            )
+            return cursor.rowcount == 1
+
+    def release_quota_units(self, channel, quota_day, units):
+        """Gives back units booked for a request that was never sent."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE quota_usage SET units_used = MAX(0, units_used - ?) WHERE channel = ? AND quota_day = ?",
+                (units, channel, quota_day)
+            )
+
+    def exhaust_quota(self, channel, quota_day, limit):
+        """Marks a channel's quota for the day as fully used."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO quota_usage (channel, quota_day, units_used) VALUES (?, ?, ?) "
+                "ON CONFLICT(channel, quota_day) DO UPDATE SET units_used = MAX(units_used, excluded.units_used)",
+                (channel, quota_day, limit)
+            )
+
+    # --- Resumable upload sessions ---
+    def get_upload_session(self, video_id):
+        """Returns (session_uri, bytes_sent, file_size) of an interrupted upload, or None."""
+        row = self._connect().execute(
+            "SELECT session_uri, bytes_sent, file_size FROM upload_sessions WHERE video_id = ?", (str(video_id),)
+        ).fetchone()
+        return (row["session_uri"], row["bytes_sent"], row["file_size"]) if row else None
+
+    def save_upload_session(self, video_id, session_uri, bytes_sent, file_size):
+        """Persists the resumable session URI and confirmed offset of an upload in progress."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO upload_sessions (video_id, session_uri, bytes_sent, file_size, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(video_id) DO UPDATE SET session_uri = excluded.session_uri, "
+                "bytes_sent = excluded.bytes_sent, file_size = excluded.file_size, updated_at = excluded.updated_at",
+                (str(video_id), session_uri, bytes_sent, file_size, time.time())
+            )
+
+    def clear_upload_session(self, video_id):
+        """Forgets the resumable session of a finished or abandoned upload."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM upload_sessions WHERE video_id = ?", (str(video_id),))
+
+    # --- Publish schedule ---
+    def ensure_publish_schedule(self, run_id, publish_times):
+        """Persists the run's publish schedule unless one already exists. Returns the slot count."""
+        with self._connect() as conn:
+            existing = conn.execute("SELECT COUNT(*) FROM publish_slots WHERE run_id = ?", (run_id,)).fetchone()[0]
+            if existing:
+                return existing
+            conn.executemany(
+                "INSERT INTO publish_slots (run_id, slot_index, publish_at) VALUES (?, ?, ?)",
+                ((run_id, index, publish_at) for index, publish_at in enumerate(publish_times))
+            )
+            return len(publish_times)
+
+    def next_free_publish_slot(self, run_id, exclude=()):
+        """
+        Returns (slot_index, publish_at) of the earliest unclaimed slot, or None
+        when the schedule is full. Slots in `exclude` (held by uploads still in
+        progress) are skipped.
+        """
+        exclude = list(exclude)
+        row = self._connect().execute(
+            "SELECT slot_index, publish_at FROM publish_slots WHERE run_id = ? AND video_id IS NULL "
+            f"AND slot_index NOT IN ({','.join('?' * len(exclude))}) ORDER BY slot_index LIMIT 1",
+            (run_id, *exclude)
+        ).fetchone()
+        return (row["slot_index"], row["publish_at"]) if row else None
+
+    def claimed_publish_slot_count(self, run_id):
+        """Returns how many of the run's publish slots already have a video."""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM publish_slots WHERE run_id = ? AND video_id IS NOT NULL", (run_id,)
+        ).fetchone()[0]
+
+    # --- Legacy import ---
+    def import_legacy_files(self, upload_log_path, progress_log_path, run_marker_path, metadata_path):
+        """One-time import of the flat-file state used before the SQLite ledger existed."""
+        if self.get_setting("legacy_imported"):
+            return
+        now = time.time()
+        with self._connect() as conn:
+            if os.path.exists(upload_log_path):
+                with open(upload_log_path, 'r', encoding='utf-8') as f:
+                    uploaded_ids = [line.strip() for line in f if line.strip()]
+                conn.executemany(
+                    "INSERT INTO videos (video_id, uploaded_at) VALUES (?, ?) "
+                    "ON CONFLICT(video_id) DO UPDATE SET uploaded_at = COALESCE(uploaded_at, excluded.uploaded_at)",
+                    ((video_id, now) for video_id in uploaded_ids)
+                )
+                logging.info(f"Imported {len(uploaded_ids)} uploaded video IDs from {upload_log_path}.")
+
+            has_run_files = os.path.exists(progress_log_path) or os.path.exists(metadata_path)
+            if has_run_files or os.path.exists(run_marker_path):
+                completed_at = now if os.path.exists(run_marker_path) else None
+                run_id = conn.execute(
+                    "INSERT INTO runs (started_at, completed_at) VALUES (?, ?)", (now, completed_at)
+                ).lastrowid
+
+                if os.path.exists(progress_log_path):
+                    with open(progress_log_path, 'r', encoding='utf-8') as f:
+                        creators = [line.strip() for line in f if line.strip()]
+                    conn.executemany(
+                        "INSERT INTO creators (username, last_run_id, last_processed_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(username) DO UPDATE SET last_run_id = excluded.last_run_id",
+                        ((creator, run_id, now) for creator in creators)
+                    )
+                    logging.info(f"Imported {len(creators)} processed creators from {progress_log_path}.")
+
+                if os.path.exists(metadata_path):
+                    with open(metadata_path, 'r', encoding='utf-8') as f:
+                        rows = [(row["video_id"], row.get("author_username")) for row in csv.DictReader(f) if row.get("video_id")]
+                    conn.executemany(
+                        "INSERT INTO videos (video_id, author_username, run_id, downloaded_at, exported_at) "
+                        "VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT(video_id) DO UPDATE SET author_username = excluded.author_username, "
+                        "run_id = excluded.run_id, downloaded_at = excluded.downloaded_at, "
+                        "exported_at = excluded.exported_at",
+                        ((video_id, author, run_id, now, now) for video_id, author in rows)
+                    )
+                    logging.info(f"Imported {len(rows)} downloaded videos from {metadata_path}.")
+
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('legacy_imported', ?)", (str(now),))
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_state_store(db_path=STATE_DB_PATH):
+    """Returns the process-wide StateStore for the given database path."""
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = StateStore(db_path)
+            _stores[db_path] = store
+        return store
@@ -0,0 +1,245 @@
+import os
+import time
+import queue
+import signal
+import logging
+import itertools
+import threading
+import multiprocessing
+from logging.handlers import QueueHandler
+from logger import sampling_filter
+from config_store import get_config_store, ConfigError
+
+# How long a stop request may take before the worker process is terminated,
+# and how long termination may take before it is killed outright.
+DEFAULT_STOP_TIMEOUT_SECONDS = 120
+DEFAULT_KILL_TIMEOUT_SECONDS = 10
+
+def _run_command(status_queue, request_id, handler, kwargs):
+    try:
+        status_queue.put({"type": "reply", "id": request_id, "result": handler(**kwargs)})
+    except Exception as e:
+        status_queue.put({"type": "reply", "id": request_id, "error": f"{type(e).__name__}: {e}"})
+
+def _serve_commands(command_queue, status_queue, stop_event, handlers):
+    """
+    Child side: answers commands sent by the supervisor until the process
+    exits. Each command runs in its own thread, so a long one (a profile)
+    does not hold up the others, least of all stop.
+    """
+    while True:
+        command = command_queue.get()
+        if command is None:
+            return
+        request_id, name, kwargs = command
+        if name == "stop":
+            stop_event.set()
+            status_queue.put({"type": "reply", "id": request_id, "result": True})
+        elif name in handlers:
+            threading.Thread(
+                target=_run_command, args=(status_queue, request_id, handlers[name], kwargs),
+                name=f"command-{name}", daemon=True
+            ).start()
+        else:
+            status_queue.put({"type": "reply", "id": request_id, "error": f"ValueError: Unknown worker command '{name}'."})
+
+def _worker_main(stop_event, status_queue, command_queue, log_queue):
+    """Entry point of the worker process: runs one bot cycle and reports back over the queues."""
+    if hasattr(os, "setsid"):
+        # Own process group, so a hard kill also takes down the download pool.
+        os.setsid()
+    root = logging.getLogger()
+    root.handlers.clear()
+    log_handler = QueueHandler(log_queue)
+    try:
+        # Sampled here as well, so suppressed DEBUG records are never pickled and sent over.
+        sampling = sampling_filter(get_config_store().get())
+    except ConfigError:
+        sampling = None
+    if sampling:
+        log_handler.addFilter(sampling)
+    root.addHandler(log_handler)
+    root.setLevel(logging.DEBUG)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+    import worker
+    import metrics
+    import progress
+    import profiler
+
+    progress.add_listener(lambda stages: status_queue.put({"type": "progress", "stages": stages}))
+    handlers = {
+        "write_metrics": lambda: metrics.write_prometheus_file(metrics.METRICS_FILE),
+        "profile": profiler.profile,
+    }
+    threading.Thread(
+        target=_serve_commands, args=(command_queue, status_queue, stop_event, handlers),
+        name="supervisor-commands", daemon=True
+    ).start()
+    status_queue.put({"type": "started", "pid": os.getpid()})
+    try:
+        worker.run_bot_cycle(stop_event)
+    finally:
+        status_queue.put({"type": "finished", "stages": progress.snapshot()})
+
+class WorkerSupervisor:
+    """
+    Runs worker.run_bot_cycle in a child process so that downloads, hashing
+    and uploads never compete with the Discord event loop for the GIL.
+
+    The child streams log records and per-stage progress back over
+    multiprocessing queues, and answers commands (see call). stop asks the
+    worker to finish cooperatively and escalates to SIGTERM and then SIGKILL
+    of the whole process group when it does not exit in time.
+    """
+
+    def __init__(self, stop_timeout=DEFAULT_STOP_TIMEOUT_SECONDS, kill_timeout=DEFAULT_KILL_TIMEOUT_SECONDS,
+                 target=_worker_main):
+        self.stop_timeout = stop_timeout
+        self.kill_timeout = kill_timeout
+        self._target = target
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._process = None
+        self._stop_event = None
+        self._command_queue = None
+        self._status = {"state": "stopped", "stages": {}}
+        self._request_ids = itertools.count(1)
+        self._replies = {}
+
+    # --- Lifecycle ---
+    def is_running(self):
+        with self._lock:
+            return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        """Starts a worker process unless one is already running. Returns True if it was started."""
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                return False
+            self._stop_event = self._context.Event()
+            status_queue = self._context.Queue()
+            log_queue = self._context.Queue()
+            self._command_queue = self._context.Queue()
+            self._process = self._context.Process(
+                target=self._target,
+                args=(self._stop_event, status_queue, self._command_queue, log_queue),
+                name="bot-worker"
+            )  # Not a daemon: daemonic processes may not start the download pool.
+            self._process.start()
+            self._status = {"state": "running", "pid": self._process.pid, "started_at": time.time(), "stages": {}}
+            process = self._process
+        threading.Thread(target=self._relay_logs, args=(process, log_queue), name="worker-logs", daemon=True).start()
+        threading.Thread(target=self._relay_status, args=(process, status_queue), name="worker-status", daemon=True).start()
+        logging.info(f"Started worker process {process.pid}.")
+        return True
+
+    def stop(self, wait=False):
+        """
+        Asks the worker to stop. Escalates to terminate and kill if it has not
+        exited after stop_timeout (and then kill_timeout) seconds. With `wait`,
+        blocks until the process is gone. Returns False if nothing was running.
+        """
+        with self._lock:
+            process = self._process
+            if process is None or not process.is_alive():
+                return False
+            self._stop_event.set()
+            self._status["state"] = "stopping"
+            self._status["stop_requested_at"] = time.time()
+        enforcer = threading.Thread(target=self._enforce_stop, args=(process,), name="worker-stop", daemon=True)
+        enforcer.start()
+        if wait:
+            enforcer.join()
+        return True
+
+    def _enforce_stop(self, process):
+        process.join(self.stop_timeout)
+        if not process.is_alive():
+            return
+        logging.warning(f"Worker process {process.pid} did not stop within {self.stop_timeout}s. Terminating it.")
+        self._signal_group(process, signal.SIGTERM)
+        process.join(self.kill_timeout)
+        if process.is_alive():
+            logging.error(f"Worker process {process.pid} ignored SIGTERM. Killing it.")
+            self._signal_group(process, getattr(signal, "SIGKILL", signal.SIGTERM))
+            process.join()
+
+    @staticmethod
+    def _signal_group(process, signum):
+        """Signals the worker's whole process group (itself and its download pool)."""
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(process.pid, signum)
+            elif signum == signal.SIGTERM:
+                process.terminate()
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            process.kill()
+
+    # --- Status and commands ---
+    def status(self):
+        """Returns the latest status reported by the worker, including per-stage progress."""
+        with self._lock:
+            status = dict(self._status)
+            if self._process is not None and not self._process.is_alive() and status["state"] != "stopped":
+                status["state"] = "stopped"
+                status["exit_code"] = self._process.exitcode
+            return status
+
+    def call(self, name, timeout=10, **kwargs):
+        """Sends a command to the worker process and waits for its result. Raises RuntimeError on failure."""
+        with self._lock:
+            if self._process is None or not self._process.is_alive():
+                raise RuntimeError("The worker is not running.")
+            request_id = next(self._request_ids)
+            reply = {"event": threading.Event()}
+            self._replies[request_id] = reply
+            self._command_queue.put((request_id, name, kwargs))
+        try:
+            if not reply["event"].wait(timeout):
+                raise RuntimeError(f"The worker did not answer '{name}' within {timeout}s.")
+        finally:
+            with self._lock:
+                self._replies.pop(request_id, None)
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply.get("result")
+
+    def _relay_logs(self, process, log_queue):
+        """Hands the worker's log records to this process's handlers (console, file, Discord)."""
+        while process.is_alive() or not log_queue.empty():
+            try:
+                record = log_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            logging.getLogger(record.name).handle(record)
+
+    def _relay_status(self, process, status_queue):
+        """Applies status messages from the worker until it exits."""
+        while True:
+            try:
+                message = status_queue.get(timeout=0.5)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+                break
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                if message["type"] == "progress" or message["type"] == "finished":
+                    self._status["stages"] = message["stages"]
+                elif message["type"] == "reply":
+                    reply = self._replies.get(message["id"])
+                    if reply is not None:
+                        reply.update({k: v for k, v in message.items() if k in ("result", "error")})
+                        reply["event"].set()
+        with self._lock:
+            if self._process is process:
+                self._status["state"] = "stopped"
+                self._status["exit_code"] = process.exitcode
+                self._status["finished_at"] = time.time()
+        logging.info(f"Worker process {process.pid} exited with code {process.exitcode}.")
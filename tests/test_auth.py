@@ -1,7 +1,32 @@
+import json
+import pickle
 import pytest
+import auth
 from auth import get_authenticated_service
-from unittest.mock import MagicMock, patch
-import pickle
+from datetime import datetime, timedelta
+from google.oauth2.credentials import Credentials
+
+
+@pytest.fixture(autouse=True)
+def token_paths(tmp_path, monkeypatch):
+    """Point the token files at a temporary directory and reset the cached service."""
+    monkeypatch.setattr(auth, "TOKEN_FILE", str(tmp_path / "token.json"))
+    monkeypatch.setattr(auth, "LEGACY_TOKEN_FILE", str(tmp_path / "token.pickle"))
+    auth.clear_cached_service()
+    yield tmp_path
+    auth.clear_cached_service()
+
+
+def _credentials(expires_in=3600):
+    return Credentials(
+        token="mock_token",
+        refresh_token="mock_refresh",
+        token_uri="https://oauth2.googleapis.com/token",
+        client_id="test_id",
+        client_secret="test_secret",
+        scopes=auth.SCOPES,
+        expiry=datetime.utcnow() + timedelta(seconds=expires_in),
+    )
 
 
 @pytest.fixture
@@ -14,53 +39,68 @@ def mock_credentials_file(tmp_path):
 
 def test_valid_credentials(mock_credentials_file, mocker):
     """Test successful authentication with valid credentials."""
-    mocker.patch("os.path.exists", return_value=True)
-
-    # Mock serialized credentials
-    mock_serialized_credentials = {"valid": True, "token": "mock_token"}
-    mocker.patch("pickle.load", return_value=mock_serialized_credentials)
-
-    # Mock the discovery build
-    mock_discovery_doc = {
-        "rootUrl": "https://www.googleapis.com/",
-        "servicePath": "youtube/v3/"
-    }
-    mocker.patch("googleapiclient.discovery.build", return_value=mock_discovery_doc)
+    with open(auth.TOKEN_FILE, "w") as f:
+        f.write(_credentials().to_json())
+    mock_build = mocker.patch("auth.build", return_value=mocker.Mock())
 
     service = get_authenticated_service()
     assert service is not None
+    assert mock_build.call_args.kwargs["static_discovery"] is True
 
 
-def test_missing_credentials_file(mocker):
+def test_service_is_cached(mocker):
+    """Test that the service is built only once per process."""
+    with open(auth.TOKEN_FILE, "w") as f:
+        f.write(_credentials().to_json())
+    mock_build = mocker.patch("auth.build", return_value=mocker.Mock())
+
+    assert get_authenticated_service() is get_authenticated_service()
+    mock_build.assert_called_once()
+
+
+def test_missing_credentials_file(mocker, caplog):
     """Test behavior when the credentials file is missing."""
-    mocker.patch("os.path.exists", return_value=False)
+    mocker.patch("auth.CREDENTIALS_FILE", "does/not/exist.json")
 
-    with pytest.raises(Exception, match="Error during authentication"):
+    with pytest.raises(FileNotFoundError, match="does/not/exist.json"):
         get_authenticated_service()
+    assert "Error during authentication for channel 'default'" in caplog.text
 
 
 def test_expired_token(mocker, mock_credentials_file):
     """Test behavior when the access token is expired."""
-    mock_credentials = {"valid": False, "expired": True, "refresh_token": "mock_refresh"}
-    mocker.patch("os.path.exists", return_value=True)
-    mocker.patch("pickle.load", return_value=mock_credentials)
+    with open(auth.TOKEN_FILE, "w") as f:
+        f.write(_credentials(expires_in=-60).to_json())
+
+    def fake_refresh(credentials, request):
+        credentials.token = "refreshed_token"
+        credentials.expiry = datetime.utcnow() + timedelta(hours=1)
+
+    mocker.patch.object(Credentials, "refresh", fake_refresh)
+    mocker.patch("auth.build", return_value=mocker.Mock())
 
     service = get_authenticated_service()
     assert service is not None
+    with open(auth.TOKEN_FILE) as f:
+        assert json.load(f)["token"] == "refreshed_token"
 
 
-def test_invalid_credentials_file(mocker, tmp_path):
-    """Test behavior when the credentials file is invalid."""
-    invalid_credentials_file = tmp_path / "invalid_client_secrets.json"
-    invalid_credentials_file.write_text("INVALID_JSON")
+def test_legacy_pickle_token_is_migrated(mocker, token_paths):
+    """Test that an existing token.pickle is converted to the JSON token file."""
+    with open(auth.LEGACY_TOKEN_FILE, "wb") as f:
+        pickle.dump(_credentials(), f)
+    mocker.patch("auth.build", return_value=mocker.Mock())
 
-    mocker.patch("os.path.exists", return_value=True)
+    get_authenticated_service()
+    with open(auth.TOKEN_FILE) as f:
+        assert json.load(f)["refresh_token"] == "mock_refresh"
 
-    # Mock invalid JSON in the credentials file
-    mocker.patch("builtins.open", mocker.mock_open(read_data="INVALID_JSON"))
 
-    # Ensure an error is raised during deserialization
-    mocker.patch("pickle.load", side_effect=Exception("Invalid credentials file"))
+def test_invalid_credentials_file(mocker, tmp_path, caplog):
+    """Test behavior when the credentials file is invalid."""
+    with open(auth.TOKEN_FILE, "w") as f:
+        f.write("INVALID_JSON")
 
-    with pytest.raises(Exception, match="Invalid credentials file"):
+    with pytest.raises(json.JSONDecodeError, match="Expecting value"):
         get_authenticated_service()
+    assert "Error during authentication for channel 'default'" in caplog.text
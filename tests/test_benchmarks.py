@@ -0,0 +1,20 @@
+from benchmarks.run_pipeline import run_scenario
+
+
+def test_benchmark_scenario_uploads_every_synthetic_video(tmp_path):
+    """Test that a small end-to-end run downloads and uploads every fake video through the stand-ins."""
+    result = run_scenario(2, 2, video_bytes=4096, concurrency=2, error_rate=0.2, workdir=str(tmp_path))
+
+    assert result["videos_collected"] == 4
+    assert result["videos_uploaded"] == 4
+    assert result["server"]["videos"] == 4
+    assert set(result["stages"]) == {"download_seconds", "upload_seconds"}
+
+
+def test_benchmark_rerun_only_fetches_new_videos(tmp_path):
+    """Test that a second run over the same creators downloads and uploads nothing already handled."""
+    run_scenario(2, 2, video_bytes=4096, concurrency=2, workdir=str(tmp_path))
+    result = run_scenario(2, 2, video_bytes=4096, concurrency=2, workdir=str(tmp_path))
+
+    assert result["videos_collected"] == 0
+    assert result["server"]["videos"] == 0
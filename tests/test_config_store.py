@@ -0,0 +1,57 @@
+import os
+import json
+import pytest
+from config_store import ConfigStore, ConfigError
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    """Create a config.json with two creators."""
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"tiktok_creators": ["alice", "bob"], "max_uploads_per_day": 5}))
+    return str(path)
+
+
+def test_reloads_when_the_file_changes(config_path):
+    """Test that a change written by another process is picked up on the next read."""
+    store = ConfigStore(config_path)
+    assert store.get()["max_uploads_per_day"] == 5
+
+    other = ConfigStore(config_path)
+    other.update(lambda config: config.update(max_uploads_per_day=8))
+    assert store.get()["max_uploads_per_day"] == 8
+
+
+def test_invalid_update_leaves_the_file_untouched(config_path):
+    """Test that an update failing validation is neither applied nor written."""
+    store = ConfigStore(config_path)
+    with pytest.raises(ConfigError):
+        store.update(lambda config: config.update(max_uploads_per_day="many"))
+
+    assert store.get()["max_uploads_per_day"] == 5
+    with open(config_path) as f:
+        assert json.load(f)["max_uploads_per_day"] == 5
+    assert os.listdir(os.path.dirname(config_path)) == ["config.json"]
+
+
+def test_invalid_file_keeps_the_last_valid_config(config_path):
+    """Test that a hand-edited file with errors is ignored until it is fixed."""
+    store = ConfigStore(config_path)
+    store.get()
+    with open(config_path, 'w') as f:
+        f.write('{"tiktok_creators": ')
+
+    assert store.get()["tiktok_creators"] == ["alice", "bob"]
+    with pytest.raises(ConfigError):
+        ConfigStore(config_path).get()
+
+
+def test_missing_file_raises_config_error(tmp_path, config_path):
+    """Test that a missing config.json is reported as a ConfigError, and that a deleted one keeps the last config."""
+    with pytest.raises(ConfigError, match="Could not load"):
+        ConfigStore(str(tmp_path / "missing.json")).get()
+
+    store = ConfigStore(config_path)
+    store.get()
+    os.remove(config_path)
+    assert store.get()["max_uploads_per_day"] == 5
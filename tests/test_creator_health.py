@@ -0,0 +1,91 @@
+import pytest
+import creator_health
+from state_store import StateStore
+
+
+@pytest.fixture
+def state(tmp_path):
+    """Create a state store in a temporary directory."""
+    return StateStore(str(tmp_path / "state.db"))
+
+
+def test_errors_are_classified():
+    """Test that network and rate-limit errors are transient and dead accounts are permanent."""
+    assert creator_health.classify_error(TimeoutError("read timed out")) == "transient"
+    assert creator_health.classify_error(RuntimeError("HTTP 429 Too Many Requests")) == "transient"
+    assert creator_health.classify_error(RuntimeError("This account is private")) == "permanent"
+    assert creator_health.classify_error(KeyError("itemList")) == "unknown"
+
+
+def test_backoff_opens_the_circuit_and_success_closes_it(state, mocker):
+    """Test that failures back off exponentially, open the circuit at the threshold, and a success resets it."""
+    clock = mocker.patch("time.time", return_value=1000.0)
+    mocker.patch("random.uniform", side_effect=lambda low, high: high)
+    policy = {"failure_threshold": 3, "backoff_base_seconds": 60, "cooldown_seconds": 3600}
+
+    creator_health.record_failure(state, "alice", RuntimeError("boom"), policy)
+    assert state.get_creator_health("alice")["next_attempt_at"] == 1060.0
+    creator_health.record_failure(state, "alice", RuntimeError("boom"), policy)
+    assert state.get_creator_health("alice")["next_attempt_at"] == 1120.0
+    assert creator_health.health_state(state.get_creator_health("alice")) == "backing_off"
+
+    creator_health.record_failure(state, "alice", RuntimeError("boom"), policy)
+    record = state.get_creator_health("alice")
+    assert creator_health.health_state(record) == "open"
+    assert record["next_attempt_at"] == 4600.0
+    clock.return_value = 5000.0
+    assert creator_health.health_state(record) == "half_open"
+
+    # A failed trial reopens the circuit for twice as long.
+    creator_health.record_failure(state, "alice", RuntimeError("boom"), policy)
+    assert state.get_creator_health("alice")["next_attempt_at"] == 5000.0 + 7200
+
+    creator_health.record_success(state, "alice")
+    assert creator_health.health_state(state.get_creator_health("alice")) == "healthy"
+    creator_health.record_failure(state, "bob", RuntimeError("user not found"), policy)
+    assert creator_health.health_state(state.get_creator_health("bob")) == "open"
+    assert creator_health.schedule_key(state.get_creator_health("alice")) < \
+        creator_health.schedule_key(state.get_creator_health("bob"))
+
+
+def test_retry_transient_retries_only_transient_errors(mocker):
+    """Test that transient errors are retried with a jittered sleep and other errors are raised at once."""
+    sleep = mocker.Mock()
+    action = mocker.Mock(side_effect=[ConnectionError("reset by peer"), "ok"])
+    assert creator_health.retry_transient(action, "Listing alice", sleep=sleep) == "ok"
+    assert sleep.call_count == 1 and 0 <= sleep.call_args[0][0] <= 2
+
+    action = mocker.Mock(side_effect=RuntimeError("account is private"))
+    with pytest.raises(RuntimeError):
+        creator_health.retry_transient(action, "Listing bob", sleep=sleep)
+    assert action.call_count == 1
+
+
+def test_worker_outcomes_are_recorded_in_the_parent(state, tmp_path, mocker):
+    """Test that the health records and metrics of pool downloads are updated in the parent process."""
+    from concurrent.futures import ThreadPoolExecutor
+    import metrics
+    import tiktok_downloader
+    mocker.patch("tiktok_downloader._create_download_pool", side_effect=ThreadPoolExecutor)
+    outcomes = {
+        "alice": {"metadata_path": str(tmp_path / "none.csv"), "error": None, "error_kind": None, "retries": 1},
+        "bob": {"metadata_path": None, "error": "This account is private", "error_kind": "permanent", "retries": 0},
+    }
+    mocker.patch("tiktok_downloader._download_single_creator", side_effect=lambda creator, *args: outcomes[creator])
+    metrics_file = tmp_path / "metrics.prom"
+    metrics.write_prometheus_file(str(metrics_file))
+    before = metrics.read_prometheus_file(str(metrics_file))
+
+    run_id, _ = state.begin_run()
+    tiktok_downloader.download_and_combine_clips(["alice", "bob"], str(tmp_path), state, run_id,
+                                                 str(tmp_path / "metadata.csv"), 5)
+
+    metrics.write_prometheus_file(str(metrics_file))
+    after = metrics.read_prometheus_file(str(metrics_file))
+    def delta(name, **labels):
+        return metrics.sample_total(after, name, **labels) - metrics.sample_total(before, name, **labels)
+    assert delta("creator_download_retries_total") == 1
+    assert delta("creator_download_failures_total", kind="permanent") == 1
+    assert delta("creator_circuits_opened_total") == 1
+    assert creator_health.health_state(state.get_creator_health("alice")) == "healthy"
+    assert creator_health.health_state(state.get_creator_health("bob")) == "open"
@@ -0,0 +1,67 @@
+import threading
+from jobqueue import RedisJobQueue, InMemoryRedis
+from distributed import ClaimedCreators, JobCandidates, SharedState
+
+
+def test_workers_split_the_configured_creators(mocker):
+    """Test that two workers sharing a queue each download a different creator and settle their jobs."""
+    job_queue = RedisJobQueue(InMemoryRedis())
+    stop_event = threading.Event()
+    configured = lambda: ["alice", "bob"]
+    state_a, state_b = mocker.Mock(), mocker.Mock()
+    state_a.processed_creators.return_value = set()
+    state_b.processed_creators.return_value = set()
+    state_a.get_creator_health.return_value = state_b.get_creator_health.return_value = None
+
+    worker_a = ClaimedCreators(job_queue, "a", state_a, 1, configured, stop_event)
+    worker_b = ClaimedCreators(job_queue, "b", state_b, 1, configured, stop_event)
+    claimed_a, claimed_b = worker_a(), worker_b()
+    assert sorted(claimed_a + claimed_b) == ["alice", "bob"]
+    assert worker_a() == claimed_a  # Nothing left to claim.
+
+    state_a.processed_creators.return_value = set(claimed_a)
+    worker_a.close()
+    worker_b.close()  # Not processed: failed, and retried later.
+    assert job_queue.counts("download") == {"queued": 1, "leased": 0}
+
+
+def test_job_candidates_queue_rows_and_settle_uploads(mocker, tmp_path):
+    """Test that rows become upload jobs once, and that uploaded jobs complete while the rest are released."""
+    job_queue = RedisJobQueue(InMemoryRedis())
+    stop_event = threading.Event()
+    for video_id in ("1", "2"):
+        (tmp_path / f"@alice_video_{video_id}.mp4").write_bytes(b"clip")
+    state = mocker.Mock()
+    state.is_uploaded.side_effect = lambda video_id: video_id == "1" and uploaded.is_set()
+    state.last_upload_attempt.return_value = None
+    uploaded = threading.Event()
+
+    candidates = JobCandidates(job_queue, "upload", "a", state, str(tmp_path), stop_event, lambda: 5)
+    rows = [{"video_id": "1", "author_username": "alice"}, {"video_id": "2", "author_username": "alice"}]
+    candidates.put_many(rows)
+    candidates.put_many(rows[:1])
+    candidates.close()
+    assert candidates.drain() == rows
+
+    uploaded.set()
+    candidates.settle()
+    assert job_queue.counts("upload") == {"queued": 1, "leased": 0}
+    assert job_queue.claim("upload", "b")["key"] == "2"
+
+
+def test_shared_state_spans_workers_with_local_stores(tmp_path):
+    """Test that workers with their own state stores see each other's uploads and book one quota."""
+    from state_store import StateStore
+    from quota import QuotaLedger
+    job_queue = RedisJobQueue(InMemoryRedis())
+    state_a = SharedState(job_queue, StateStore(str(tmp_path / "a.db")))
+    state_b = SharedState(job_queue, StateStore(str(tmp_path / "b.db")))
+
+    state_a.record_upload_attempt("1", True, youtube_id="yt1")
+    assert state_b.is_uploaded("1")
+    candidates = JobCandidates(job_queue, "upload:b", "b", state_b, str(tmp_path), threading.Event(), lambda: 5)
+    candidates.put_many([{"video_id": "1", "author_username": "alice"}])
+    assert job_queue.counts("upload:b") == {"queued": 0, "leased": 0}
+
+    assert QuotaLedger(state_a, 2000).reserve("main", 1600, now=0)
+    assert not QuotaLedger(state_b, 2000).reserve("main", 1600, now=0)
@@ -0,0 +1,53 @@
+import hashlib
+import pytest
+import fingerprint
+from fingerprint import content_hash, hamming_distances, find_uploaded_duplicate
+from state_store import StateStore
+
+
+@pytest.fixture
+def state(tmp_path):
+    """Create a state store backed by a temporary database."""
+    return StateStore(str(tmp_path / "state.db"))
+
+
+def write_clip(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_content_hash_streams_whole_file(tmp_path, mocker):
+    """Test that chunked hashing gives the same digest as hashing the file in one go."""
+    mocker.patch.object(fingerprint, "HASH_CHUNK_SIZE", 1000)
+    data = bytes(range(256)) * 50
+    path = write_clip(tmp_path / "clip.mp4", data)
+    assert content_hash(path) == hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def test_repost_of_uploaded_clip_is_detected(state, tmp_path):
+    """Test that a byte-identical clip under another video ID matches the uploaded original."""
+    original = write_clip(tmp_path / "@a_video_1.mp4", b"same clip")
+    repost = write_clip(tmp_path / "@b_video_2.mp4", b"same clip")
+    other = write_clip(tmp_path / "@c_video_3.mp4", b"different clip")
+
+    assert find_uploaded_duplicate(state, "1", original) is None
+    state.record_upload_attempt("1", True, youtube_id="yt1")
+
+    assert find_uploaded_duplicate(state, "2", repost) == "1"
+    assert find_uploaded_duplicate(state, "3", other) is None
+    assert find_uploaded_duplicate(state, "1", original) is None
+
+
+def test_reencoded_repost_matches_by_perceptual_hash(state, tmp_path, mocker):
+    """Test that clips with different bytes but nearly equal keyframe hashes count as duplicates."""
+    mocker.patch.object(fingerprint, "perceptual_hash", side_effect=[0b1011_0000, 0b1011_0001, -1])
+    original = write_clip(tmp_path / "@a_video_1.mp4", b"original encode")
+    reencoded = write_clip(tmp_path / "@b_video_2.mp4", b"re-encoded")
+    unrelated = write_clip(tmp_path / "@c_video_3.mp4", b"unrelated")
+
+    fingerprint.fingerprint_file(state, "1", original, perceptual=True)
+    state.record_upload_attempt("1", True, youtube_id="yt1")
+
+    assert find_uploaded_duplicate(state, "2", reencoded, perceptual=True) == "1"
+    assert find_uploaded_duplicate(state, "3", unrelated, perceptual=True) is None
+    assert list(hamming_distances(0, [0, 1, 3, -1])) == [0, 1, 2, 64]
@@ -0,0 +1,91 @@
+import threading
+import pytest
+from jobqueue import SQLiteJobQueue, RedisJobQueue, InMemoryRedis
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def job_queue(request, tmp_path):
+    """A job queue on each backend; the Redis one runs against the in-memory stand-in."""
+    if request.param == "sqlite":
+        return SQLiteJobQueue(str(tmp_path / "jobs.db"), max_attempts=2)
+    return RedisJobQueue(InMemoryRedis(), max_attempts=2)
+
+
+def test_jobs_are_queued_once_and_claimed_once(job_queue):
+    """Test that enqueueing is idempotent and that concurrent workers never claim the same job."""
+    for key in range(20):
+        assert job_queue.enqueue("download", key, {"creator": f"c{key}"})
+    assert not job_queue.enqueue("download", 0, {"creator": "c0"})
+
+    claimed = []
+    def work(worker_id):
+        while True:
+            job = job_queue.claim("download", worker_id)
+            if job is None:
+                return
+            claimed.append(job["payload"]["creator"])
+            assert job_queue.complete(job)
+
+    workers = [threading.Thread(target=work, args=(f"w{i}",)) for i in range(4)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    assert sorted(claimed) == sorted(f"c{key}" for key in range(20))
+    assert job_queue.claim("download", "late") is None
+
+
+def test_expired_lease_is_reclaimed_and_stale_owner_is_fenced(job_queue, mocker):
+    """Test that a crashed worker's job becomes claimable again and its late calls are refused."""
+    clock = mocker.patch("time.time", return_value=1000.0)
+    job_queue.enqueue("upload", "v1", {"video_id": "v1"})
+    first = job_queue.claim("upload", "crashed", lease_seconds=60)
+    assert job_queue.claim("upload", "other", lease_seconds=60) is None
+
+    clock.return_value = 1030.0
+    assert job_queue.heartbeat(first, lease_seconds=60)
+    clock.return_value = 1080.0
+    assert job_queue.claim("upload", "other", lease_seconds=60) is None  # Renewed until 1090.
+
+    clock.return_value = 1200.0
+    second = job_queue.claim("upload", "other", lease_seconds=60)
+    assert second["key"] == "v1" and second["attempts"] == 2
+    assert not job_queue.heartbeat(first)
+    assert not job_queue.complete(first)
+    assert job_queue.complete(second)
+
+
+def test_failed_jobs_are_retried_until_max_attempts(job_queue, mocker):
+    """Test that fail() delays a retry and gives up after max_attempts, while release() does not count."""
+    clock = mocker.patch("time.time", return_value=1000.0)
+    job_queue.enqueue("download", "alice", {"creator": "alice"})
+    job = job_queue.claim("download", "w1")
+    assert job_queue.release(job)
+    job = job_queue.claim("download", "w1")
+    assert job["attempts"] == 1
+
+    assert job_queue.fail(job, "timeout", retry_delay=30)
+    assert job_queue.claim("download", "w1") is None
+    clock.return_value = 1031.0
+    job = job_queue.claim("download", "w1")
+    assert job["attempts"] == 2
+    assert job_queue.fail(job, "timeout", retry_delay=30)
+    clock.return_value = 2000.0
+    assert job_queue.claim("download", "w1") is None
+
+
+def test_markers_and_counters_are_shared(job_queue):
+    """Test that a marker is set once and that a counter stays between 0 and its limit."""
+    assert not job_queue.is_marked("uploaded:v1")
+    assert job_queue.mark("uploaded:v1")
+    assert not job_queue.mark("uploaded:v1")
+    assert job_queue.is_marked("uploaded:v1")
+
+    assert job_queue.add_to_counter("quota", 600, 1000)
+    assert not job_queue.add_to_counter("quota", 600, 1000)
+    assert job_queue.counter_value("quota") == 600
+    job_queue.raise_counter("quota", 1000)
+    job_queue.raise_counter("quota", 400)
+    assert job_queue.counter_value("quota") == 1000
+    job_queue.take_from_counter("quota", 1600)
+    assert job_queue.counter_value("quota") == 0
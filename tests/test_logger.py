@@ -1,6 +1,8 @@
+import gzip
+import json
 import logging
 import pytest
-from logger import setup_logger
+from logger import setup_logger, DiscordHandler, SamplingFilter, build_file_handler, stop_log_listener
 
 
 def test_logger_configuration(tmp_path, mocker):
@@ -27,20 +29,114 @@ def test_logger_output(capsys):
     assert "Test log message" in captured.out
 
 
-def test_log_file_creation(tmp_path, mocker):
-    """Test that a log file is created and written to."""
+def test_log_file_creation(tmp_path):
+    """Test that the file sink writes JSON lines from its listener thread."""
     log_file = tmp_path / "test_log_file.log"
-
-    # Patch the FileHandler to use a temporary file
-    mocker.patch("logging.FileHandler", return_value=logging.FileHandler(log_file))
-    setup_logger()
+    setup_logger({"log_file": str(log_file)})
 
     # Log a test message
     logger = logging.getLogger()
     logger.info("Logging to file test")
+    stop_log_listener()
 
     # Verify the log file was created and contains the message
     assert log_file.exists()
-    with open(log_file, "r") as file:
-        log_contents = file.read()
-    assert "Logging to file test" in log_contents
+    entries = [json.loads(line) for line in log_file.read_text(encoding="utf-8").splitlines()]
+    assert any(entry["message"] == "Logging to file test" and entry["level"] == "INFO" for entry in entries)
+
+
+def test_rotated_log_files_are_compressed(tmp_path):
+    """Test that size-based rotation gzips old files and keeps only backup_count of them."""
+    log_file = tmp_path / "bot.log"
+    handler = build_file_handler(str(log_file), max_bytes=500, backup_count=2)
+    for i in range(40):
+        handler.emit(_make_record(f"message {i} " + "x" * 50))
+    handler.close()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["bot.log", "bot.log.1.gz", "bot.log.2.gz"]
+    with gzip.open(tmp_path / "bot.log.1.gz", "rt", encoding="utf-8") as f:
+        assert all(json.loads(line)["message"].startswith("message") for line in f)
+
+
+def test_sampling_filter_rate_limits_debug_records(mocker):
+    """Test that DEBUG records beyond a module's rate are dropped and counted, while INFO always passes."""
+    clock = mocker.patch("logger.time.monotonic", return_value=100.0)
+    sampling = SamplingFilter(rate_limits={"*": 2})
+    debug = [_make_record(f"skip {i}", logging.DEBUG) for i in range(5)]
+    assert [sampling.filter(record) for record in debug] == [True, True, False, False, False]
+    assert sampling.filter(_make_record("important", logging.INFO))
+
+    clock.return_value = 101.0
+    record = _make_record("later", logging.DEBUG)
+    assert sampling.filter(record)
+    assert record.suppressed == 3
+
+
+def _make_record(message, level=logging.INFO):
+    return logging.LogRecord("test", level, __file__, 1, message, None, None)
+
+
+def test_discord_handler_batches_records(mocker):
+    """Test that queued records are packed into a few webhook posts by the sender thread."""
+    session = mocker.patch("logger.requests.Session").return_value
+    session.post.return_value = mocker.Mock(status_code=204, headers={})
+    handler = DiscordHandler("https://discord.com/api/webhooks/test", flush_interval=0.05)
+
+    for i in range(30):
+        handler.emit(_make_record(f"message {i}", logging.INFO if i % 2 else logging.DEBUG))
+    handler.close()
+
+    payloads = [call.kwargs["json"] for call in session.post.call_args_list]
+    assert len(payloads) < 30
+    assert all(len(payload["embeds"]) <= DiscordHandler.MAX_EMBEDS_PER_MESSAGE for payload in payloads)
+    descriptions = "".join(embed["description"] for payload in payloads for embed in payload["embeds"])
+    assert all(f"message {i}\n" in descriptions for i in range(30))
+
+
+def test_discord_handler_summarizes_dropped_records(mocker):
+    """Test that records beyond the buffer are counted and reported instead of blocking."""
+    mocker.patch("logger.requests.Session")
+    handler = DiscordHandler("https://discord.com/api/webhooks/test", max_buffer=2)
+    handler._closing.set()
+
+    payloads = handler._build_payloads([("INFO", "kept")], dropped=5)
+    handler.close()
+
+    assert "5 log records were dropped" in payloads[0]["embeds"][-1]["description"]
+
+
+def test_discord_handler_respects_rate_limit(mocker):
+    """Test that a 429 response is retried after Discord's retry_after."""
+    sleep = mocker.patch("logger.time.sleep")
+    session = mocker.patch("logger.requests.Session").return_value
+    limited = mocker.Mock(status_code=429, headers={})
+    limited.json.return_value = {"retry_after": 1.5}
+    session.post.side_effect = [limited, mocker.Mock(status_code=204, headers={})]
+    handler = DiscordHandler("https://discord.com/api/webhooks/test")
+
+    handler._post({"embeds": []})
+    handler.close()
+
+    sleep.assert_any_call(1.5)
+    assert session.post.call_count == 2
+
+
+def test_pool_process_records_reach_the_parent_handlers():
+    """Test that a record logged in a spawned download worker is handled by the parent's root handlers."""
+    import time
+    from tiktok_downloader import _create_download_pool
+    received = []
+    handler = logging.Handler()
+    handler.emit = received.append
+    logging.getLogger().addHandler(handler)
+    try:
+        with _create_download_pool(1) as pool:
+            pool.submit(logging.warning, "Logged from the pool").result()
+        deadline = time.monotonic() + 10
+        while not received and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        logging.getLogger().removeHandler(handler)
+
+    assert [record.getMessage() for record in received] == ["Logged from the pool"]
+    assert received[0].levelname == "WARNING"
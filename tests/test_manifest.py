@@ -0,0 +1,31 @@
+from manifest import (build_snippet, parse_description, fit_tags, validate_snippet, MAX_TITLE_LENGTH,
+                      MAX_TAGS_LENGTH)
+
+
+def test_hashtags_keep_unicode_and_split_on_punctuation():
+    """Test that hashtags in any script are extracted whole, and punctuation or '#' ends a tag."""
+    title, tags = parse_description("Namaste 🙏 #नमस्ते #café,#fyp#viral. #_dance_")
+    assert title == "Namaste 🙏"
+    assert tags == ("नमस्ते", "café", "fyp", "viral", "dance")
+
+
+def test_snippet_fits_youtube_limits():
+    """Test that an oversized title and tag list are cut down to what YouTube accepts."""
+    hashtags = " ".join(f"#tag{index:03d}longerword" for index in range(60))
+    snippet = build_snippet({
+        "video_id": "1", "author_username": "creator",
+        "video_description": "word " * 40 + "<b>bold</b> " + hashtags,
+    })
+
+    assert len(snippet["title"]) <= MAX_TITLE_LENGTH
+    assert snippet["title"].endswith("…")
+    assert snippet["tags"][:4] == ["shorts", "tiktok", "viral", "trending"]
+    assert len(",".join(snippet["tags"])) <= MAX_TAGS_LENGTH
+    assert validate_snippet(snippet) == []
+
+
+def test_tags_are_deduplicated_and_quoted_tags_cost_more():
+    """Test that repeated tags are dropped ignoring case, and tags with spaces count their quotes."""
+    assert fit_tags(["Viral", "viral", "VIRAL"]) == ["Viral"]
+    assert fit_tags(["x" * (MAX_TAGS_LENGTH - 3) + " y"]) == []
+    assert fit_tags(["x" * (MAX_TAGS_LENGTH - 2) + "y"]) == ["x" * (MAX_TAGS_LENGTH - 2) + "y"]
@@ -0,0 +1,58 @@
+import pytest
+from media_check import MediaCheckStage, evaluate, DEFAULT_SHORTS_SPEC
+from state_store import StateStore
+
+
+@pytest.fixture
+def state(tmp_path):
+    """Create a state store backed by a temporary database."""
+    return StateStore(str(tmp_path / "state.db"))
+
+
+def test_evaluate_enforces_the_shorts_spec():
+    """Test that long or non-vertical clips are rejected and high-bitrate ones are marked for transcoding."""
+    spec = dict(DEFAULT_SHORTS_SPEC, max_bitrate_kbps=2000)
+    vertical = {"duration": 30.0, "width": 720, "height": 1280, "bit_rate": 1500000}
+
+    assert evaluate(vertical, spec) == ("ok", None)
+    assert evaluate(dict(vertical, duration=200.0), spec)[0] == "rejected"
+    assert evaluate(dict(vertical, width=1280, height=720), spec)[0] == "rejected"
+    assert evaluate(dict(vertical, duration=None), spec)[0] == "rejected"
+    assert evaluate(dict(vertical, bit_rate=8000000), spec)[0] == "transcode"
+
+
+def test_cached_probes_are_decided_without_the_pool(state, tmp_path, mocker):
+    """Test that clips with a cached probe are never probed again, and rejected clips are not handed on."""
+    mocker.patch("media_check.shutil.which", return_value="/usr/bin/ffprobe")
+    pool = mocker.patch("media_check.ProcessPoolExecutor")
+    rows = []
+    for video_id, size in (("1", (720, 1280)), ("2", (1920, 1080))):
+        path = tmp_path / f"@creator_video_{video_id}.mp4"
+        path.write_bytes(video_id.encode())
+        state.record_media_file(video_id, str(path), "creator", 1)
+        state.record_fingerprint(video_id, f"hash-{video_id}")
+        state.record_media_probe(f"hash-{video_id}", {"duration": 20.0, "width": size[0], "height": size[1]})
+        rows.append({"video_id": video_id, "author_username": "creator"})
+    checked = []
+
+    stage = MediaCheckStage(state, str(tmp_path), lambda passed: checked.extend(passed) or True)
+    assert stage.submit(rows)
+    stage.close()
+
+    assert [row["video_id"] for row in checked] == ["1"]
+    assert stage.counts == {"checked": 2, "rejected": 1, "transcoded": 0}
+    assert not pool.called
+    assert [media["video_id"] for media in state.media_files() if media["skipped"]] == ["2"]
+
+
+def test_pool_workers_log_to_the_parent(state, tmp_path, mocker):
+    """Test that the check pool is started with the initializer that sends worker logs to the parent's sinks."""
+    from logger import init_worker_logging
+    mocker.patch("media_check.shutil.which", return_value="/usr/bin/ffprobe")
+    pool = mocker.patch("media_check.ProcessPoolExecutor")
+    (tmp_path / "@creator_video_1.mp4").write_bytes(b"1")
+
+    stage = MediaCheckStage(state, str(tmp_path), lambda passed: True)
+    stage.submit([{"video_id": "1", "author_username": "creator"}])
+
+    assert pool.call_args.kwargs["initializer"] is init_worker_logging
@@ -0,0 +1,49 @@
+import urllib.request
+from metrics import MetricsRegistry, write_prometheus_file, read_prometheus_file, sample_total, start_http_server
+import metrics
+
+
+def test_registry_renders_prometheus_text():
+    """Test counters, gauges and histograms in the Prometheus text format."""
+    registry = MetricsRegistry()
+    registry.counter("uploads_total", "Uploads.").inc(outcome="ok")
+    registry.counter("uploads_total", "Uploads.").inc(2, outcome="ok")
+    registry.gauge("queue_depth", "Depth.").set(7)
+    registry.histogram("latency_seconds", "Latency.", buckets=(1, 5)).observe(3)
+
+    text = registry.render()
+
+    assert '# TYPE uploads_total counter' in text
+    assert 'uploads_total{outcome="ok"} 3' in text
+    assert 'queue_depth 7' in text
+    assert 'latency_seconds_bucket{le="1"} 0' in text
+    assert 'latency_seconds_bucket{le="5"} 1' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 1' in text
+    assert 'latency_seconds_count 1' in text
+
+
+def test_file_round_trip(tmp_path):
+    """Test that a written metrics file can be parsed back and summed by label."""
+    registry = MetricsRegistry()
+    downloads = registry.counter("downloads_total", "Downloads.")
+    downloads.inc(3, outcome="ok")
+    downloads.inc(1, outcome="failed")
+    path = str(tmp_path / "metrics.prom")
+
+    write_prometheus_file(path, registry)
+    samples = read_prometheus_file(path)
+
+    assert sample_total(samples, "downloads_total") == 4
+    assert sample_total(samples, "downloads_total", outcome="ok") == 3
+
+
+def test_http_endpoint_serves_default_registry():
+    """Test that /metrics serves the default registry."""
+    metrics.counter("test_http_requests_total", "Test counter.").inc()
+    server = start_http_server(0)
+    port = server.server_address[1]
+
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        body = response.read().decode()
+
+    assert "test_http_requests_total 1" in body
@@ -0,0 +1,41 @@
+import threading
+from pipeline import CandidateQueue
+
+
+def test_candidates_flow_until_closed():
+    """Test that the consumer sees every candidate and stops once the queue is closed."""
+    stop_event = threading.Event()
+    candidate_queue = CandidateQueue(2, stop_event, poll_seconds=0.01)
+
+    def produce():
+        candidate_queue.put_many([{"video_id": str(i)} for i in range(5)])
+        candidate_queue.close()
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    received = [row["video_id"] for row in candidate_queue]
+    producer.join(timeout=5)
+
+    assert received == ["0", "1", "2", "3", "4"]
+
+
+def test_put_does_not_block_after_discard():
+    """Test that a full queue stops applying backpressure once the consumer is done."""
+    stop_event = threading.Event()
+    candidate_queue = CandidateQueue(1, stop_event, poll_seconds=0.01)
+    assert candidate_queue.put({"video_id": "1"})
+
+    candidate_queue.discard_remaining()
+    assert not candidate_queue.put({"video_id": "2"})
+    assert candidate_queue.qsize() == 0
+
+
+def test_stop_event_releases_both_sides():
+    """Test that a stop request unblocks a producer on a full queue and ends iteration."""
+    stop_event = threading.Event()
+    candidate_queue = CandidateQueue(1, stop_event, poll_seconds=0.01)
+    candidate_queue.put({"video_id": "1"})
+
+    stop_event.set()
+    assert not candidate_queue.put({"video_id": "2"})
+    assert list(candidate_queue) == []
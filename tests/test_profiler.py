@@ -0,0 +1,42 @@
+import threading
+import pytest
+import profiler
+
+
+def _busy_loop(stop_event):
+    """Keeps a thread on the CPU until stopped."""
+    total = 0
+    while not stop_event.is_set():
+        total += sum(range(1000))
+    return total
+
+
+def test_profile_writes_collapsed_stacks_and_summary(tmp_path):
+    """Test that a busy thread shows up in the collapsed stacks and as a hot function in the summary."""
+    stop_event = threading.Event()
+    busy = threading.Thread(target=_busy_loop, args=(stop_event,), name="busy-stage", daemon=True)
+    busy.start()
+    try:
+        result = profiler.profile(1, interval=0.005, out_dir=str(tmp_path))
+    finally:
+        stop_event.set()
+        busy.join()
+
+    lines = open(result["path"], encoding="utf-8").read().splitlines()
+    busy_lines = [line for line in lines if line.startswith("busy-stage;")]
+    assert busy_lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("_busy_loop (test_profiler.py:" in line for line in busy_lines)
+    self_time = result["summary"].split("by self time")[1].split("by total time")[0]
+    assert "_busy_loop" in self_time
+    assert result["summary"].endswith(profiler.SCOPE_NOTE)
+
+
+def test_only_one_profile_runs_at_a_time(tmp_path):
+    """Test that a second concurrent capture is refused instead of doubling the overhead."""
+    started = threading.Thread(target=profiler.profile, args=(1,), kwargs={"out_dir": str(tmp_path)}, daemon=True)
+    started.start()
+    while not profiler._profile_lock.locked():
+        pass
+    with pytest.raises(RuntimeError):
+        profiler.profile(1, out_dir=str(tmp_path))
+    started.join()
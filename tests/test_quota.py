@@ -0,0 +1,126 @@
+import threading
+import pytest
+import youtube_uploader
+from quota import QuotaLedger, ChannelRouter, QuotaExceededError, quota_day, VIDEO_INSERT_UNITS
+from state_store import StateStore
+
+# 2024-01-15 07:59:59 UTC is 23:59:59 the day before in Los Angeles (PST, UTC-8).
+BEFORE_RESET = 1705305599
+AFTER_RESET = BEFORE_RESET + 1
+
+
+@pytest.fixture
+def state(tmp_path):
+    """Create a state store backed by a temporary database."""
+    return StateStore(str(tmp_path / "state.db"))
+
+
+def test_quota_day_resets_at_pacific_midnight():
+    """Test that the quota day rolls over at midnight Pacific time, not UTC."""
+    assert quota_day(BEFORE_RESET) == "2024-01-14"
+    assert quota_day(AFTER_RESET) == "2024-01-15"
+
+
+def test_ledger_never_books_past_the_daily_quota(state):
+    """Test that reservations stop once another insert would exceed the quota, until the next quota day."""
+    ledger = QuotaLedger(state, daily_units=2 * VIDEO_INSERT_UNITS + 100)
+    assert ledger.reserve("main", VIDEO_INSERT_UNITS, now=BEFORE_RESET)
+    assert ledger.reserve("main", VIDEO_INSERT_UNITS, now=BEFORE_RESET)
+    assert not ledger.reserve("main", VIDEO_INSERT_UNITS, now=BEFORE_RESET)
+    assert ledger.remaining("main", now=BEFORE_RESET) == 100
+    assert ledger.reserve("main", VIDEO_INSERT_UNITS, now=AFTER_RESET)
+
+
+def test_router_keeps_creator_affinity_and_falls_back(state):
+    """Test that a creator sticks to one channel and moves on only when that channel is out of quota."""
+    ledger = QuotaLedger(state, daily_units=VIDEO_INSERT_UNITS)
+    router = ChannelRouter(["main", "second"], ledger, affinity={"alice": "second"})
+
+    assert router.route({"author_username": "alice"}) == "second"
+    assert router.route({"author_username": "alice"}) == "main"
+    assert router.route({"author_username": "alice"}) is None
+
+
+def test_upload_lanes_share_work_across_channels(state, tmp_path, mocker):
+    """Test that candidates are spread over channels and a quota error moves the clip to another channel."""
+    rows = []
+    for index in range(3):
+        (tmp_path / f"@creator{index}_video_{index}.mp4").write_bytes(f"clip {index}".encode())
+        rows.append({"video_id": str(index), "author_username": f"creator{index}", "video_playcount": "1"})
+    mocker.patch("youtube_uploader.time.sleep")
+    mocker.patch("youtube_uploader.get_authenticated_service", side_effect=lambda channel: channel)
+    used_channels = []
+
+    def fake_upload(youtube, video_path, *args, **kwargs):
+        if youtube == "broken":
+            raise QuotaExceededError("quotaExceeded")
+        used_channels.append(youtube)
+        return f"yt-{kwargs['video_id']}"
+
+    mocker.patch("youtube_uploader.upload_to_youtube", side_effect=fake_upload)
+    youtube_uploader.process_and_upload_clips(
+        str(tmp_path), 3, threading.Event(), state=state, candidates=rows, scheduled_publishing=False,
+        channels=["broken", "main", "second"], routing="round_robin", daily_quota_units=10 * VIDEO_INSERT_UNITS
+    )
+
+    assert state.uploaded_count() == 3
+    assert sorted(set(used_channels)) == ["main", "second"]
+    assert QuotaLedger(state).remaining("broken") == 0
+
+
+def test_stop_gives_back_quota_of_routed_clips(state, tmp_path, mocker):
+    """Test that a clip routed to a channel but stopped before its upload does not keep its quota units."""
+    rows = []
+    for index in range(2):
+        (tmp_path / f"@creator_video_{index}.mp4").write_bytes(f"clip {index}".encode())
+        rows.append({"video_id": str(index), "author_username": "creator", "video_playcount": str(2 - index)})
+    mocker.patch("youtube_uploader.get_authenticated_service", return_value="main")
+    stop_event = threading.Event()
+    ledger = QuotaLedger(state)
+
+    def fake_upload(youtube, video_path, *args, **kwargs):
+        # Stops once the second clip has been routed, while the first one is uploading.
+        while ledger.used("main") < 2 * VIDEO_INSERT_UNITS:
+            stop_event.wait(0.01)
+        stop_event.set()
+        return f"yt-{kwargs['video_id']}"
+
+    upload = mocker.patch("youtube_uploader.upload_to_youtube", side_effect=fake_upload)
+    youtube_uploader.process_and_upload_clips(str(tmp_path), 2, stop_event, state=state, candidates=rows,
+                                              channels=["main"])
+
+    assert upload.call_count == 1
+    assert ledger.used("main") == VIDEO_INSERT_UNITS
+
+
+def test_ledger_release_stops_at_zero(state):
+    """Test that released units become available again and never take the count below zero."""
+    ledger = QuotaLedger(state, daily_units=VIDEO_INSERT_UNITS)
+    assert ledger.reserve("main", VIDEO_INSERT_UNITS, now=BEFORE_RESET)
+    ledger.release("main", VIDEO_INSERT_UNITS, now=BEFORE_RESET)
+    ledger.release("main", VIDEO_INSERT_UNITS, now=BEFORE_RESET)
+    assert ledger.used("main", now=BEFORE_RESET) == 0
+    assert ledger.reserve("main", VIDEO_INSERT_UNITS, now=BEFORE_RESET)
+
+
+def test_full_publish_schedule_stops_dispatch_and_gives_back_quota(state, tmp_path, mocker, caplog):
+    """Test that with more candidates than free publish slots, the stage stops cleanly without keeping quota."""
+    rows = []
+    for index in range(2):
+        (tmp_path / f"@creator_video_{index}.mp4").write_bytes(f"clip {index}".encode())
+        rows.append({"video_id": str(index), "author_username": "creator", "video_playcount": "1"})
+    mocker.patch("youtube_uploader.get_authenticated_service", return_value="main")
+    upload = mocker.patch("youtube_uploader.upload_to_youtube", return_value="yt")
+    run_id, _ = state.begin_run()
+    state.ensure_publish_schedule(run_id, [4102444800.0])
+    # Another process claims the only slot after this one counted the claimed slots.
+    state.record_upload_attempt("other", True, youtube_id="yt-other", publish_slot=(run_id, 0))
+    mocker.patch.object(state, "claimed_publish_slot_count", return_value=0)
+
+    youtube_uploader.process_and_upload_clips(str(tmp_path), 1, threading.Event(), state=state, candidates=rows,
+                                              run_id=run_id, scheduled_publishing=True, channels=["main"])
+
+    assert upload.call_count == 0
+    assert QuotaLedger(state).used("main") == 0
+    assert "Every publish slot of the run is taken" in caplog.text
+    assert "critical" not in caplog.text.lower()
@@ -0,0 +1,101 @@
+import time
+import threading
+import numpy as np
+from pipeline import CandidateQueue
+from ranking import score_candidates, top_k_indices, rank_candidates, iter_ranked_candidates
+
+NOW = 1_700_000_000
+
+
+def make_row(video_id, author, plays=0, likes=0, age_hours=0):
+    """Build a metadata row whose ID encodes a creation time age_hours before NOW."""
+    created_at = int(NOW - age_hours * 3600)
+    return {
+        "video_id": str((created_at << 32) + video_id),
+        "author_username": author,
+        "video_playcount": str(plays),
+        "video_diggcount": str(likes),
+        "video_sharecount": "",
+        "video_commentcount": "0",
+    }
+
+
+def test_engagement_and_recency_raise_the_score():
+    """Test that more engagement and a newer clip both score higher."""
+    rows = [
+        make_row(1, "a", plays=100, likes=10, age_hours=1),
+        make_row(2, "b", plays=100000, likes=5000, age_hours=1),
+        make_row(3, "c", plays=100000, likes=5000, age_hours=500),
+    ]
+    scores = score_candidates(rows, now=NOW)
+    assert scores[1] > scores[0]
+    assert scores[1] > scores[2]
+
+
+def test_fairness_spreads_slots_across_creators():
+    """Test that a creator's second clip yields to a slightly weaker clip from another creator."""
+    rows = [
+        make_row(1, "prolific", plays=1000),
+        make_row(2, "prolific", plays=900),
+        make_row(3, "other", plays=800),
+    ]
+    picked = [row["author_username"] for row in rank_candidates(rows, 2, now=NOW)]
+    assert picked == ["prolific", "other"]
+
+    no_fairness = rank_candidates(rows, 2, weights={"fairness": 0}, now=NOW)
+    assert [row["author_username"] for row in no_fairness] == ["prolific", "prolific"]
+
+
+def test_top_k_matches_full_sort():
+    """Test that the partial sort returns the same leaders as a full sort."""
+    scores = np.random.default_rng(0).random(1000)
+    assert list(top_k_indices(scores, 10)) == list(np.argsort(-scores)[:10])
+    assert len(top_k_indices(scores, 5000)) == 1000
+
+
+def test_late_arrivals_are_ranked_against_the_remaining_pool():
+    """Test that a better candidate arriving mid-stream is yielded before weaker earlier ones."""
+    batches = [[make_row(1, "a", plays=10), make_row(2, "b", plays=20)], [make_row(3, "c", plays=10**6)]]
+
+    def fetch_new(block, limit=None):
+        return batches.pop(0) if batches else None
+
+    order = [row["author_username"] for row in iter_ranked_candidates(fetch_new, 5)]
+    assert order == ["b", "c", "a"]
+
+
+def test_full_pool_keeps_the_best_candidates():
+    """Test that a source handing over more rows than the pool holds loses only its lowest-scoring ones."""
+    rows = [make_row(i, f"creator{i}", plays=i * 100) for i in range(10)]
+    batches = [rows]
+
+    def fetch_new(block, limit=None):
+        return batches.pop(0) if batches else None
+
+    picked = list(iter_ranked_candidates(fetch_new, 2, weights={"fairness": 0}, max_pool=4))
+    assert sorted(row["author_username"] for row in picked) == ["creator6", "creator7", "creator8", "creator9"]
+
+
+def test_full_pool_holds_back_the_candidate_queue():
+    """Test that the producer blocks on the upload queue while the ranking pool is full."""
+    stop_event = threading.Event()
+    candidates = CandidateQueue(2, stop_event, poll_seconds=0.01)
+    produced = []
+
+    def produce():
+        for i in range(50):
+            produced.append(i)
+            yield make_row(i, "a", plays=i)
+
+    producer = threading.Thread(target=candidates.put_many, args=(produce(),), daemon=True)
+    producer.start()
+    ranked = iter_ranked_candidates(lambda block, limit=None: candidates.drain(block, limit), 1, max_pool=3)
+    for _ in range(10):
+        next(ranked)
+        time.sleep(0.05)
+
+    # Ten yielded, three in the pool, two in the queue and one waiting to be put.
+    assert len(produced) <= 16
+    assert producer.is_alive()
+    stop_event.set()
+    producer.join(timeout=5)
@@ -0,0 +1,80 @@
+import time
+import pytest
+from retention import enforce_disk_budget, index_existing_files, expire_backlog
+from state_store import StateStore
+
+
+@pytest.fixture
+def state(tmp_path):
+    """Create a state store backed by a temporary database."""
+    return StateStore(str(tmp_path / "state.db"))
+
+
+def add_clip(state, tmp_path, video_id, size, author="creator"):
+    path = tmp_path / f"@{author}_video_{video_id}.mp4"
+    path.write_bytes(b"x" * size)
+    state.record_media_file(video_id, str(path), author, size)
+    return path
+
+
+def test_uploaded_clips_are_evicted_before_pending_ones(state, tmp_path):
+    """Test that eviction frees uploaded clips first and stops once the budget is met."""
+    uploaded = add_clip(state, tmp_path, "1", 100)
+    pending = add_clip(state, tmp_path, "2", 100)
+    state.record_upload_attempt("1", True, youtube_id="yt1")
+
+    assert enforce_disk_budget(state, 150) == 100
+    assert not uploaded.exists()
+    assert pending.exists()
+    assert state.media_bytes() == 100
+    assert enforce_disk_budget(state, 150) == 0
+
+
+def test_lowest_ranked_pending_clip_is_evicted_first(state, tmp_path):
+    """Test that among pending clips the one with the weakest engagement goes first."""
+    run_id, _ = state.begin_run()
+    state.merge_run_videos([
+        {"video_id": "7300000000000000001", "author_username": "a", "video_playcount": "1000000"},
+        {"video_id": "7300000000000000002", "author_username": "b", "video_playcount": "10"},
+    ], run_id, lambda rows: None)
+    popular = add_clip(state, tmp_path, "7300000000000000001", 100, "a")
+    weak = add_clip(state, tmp_path, "7300000000000000002", 100, "b")
+
+    assert enforce_disk_budget(state, 100) == 100
+    assert popular.exists()
+    assert not weak.exists()
+
+
+def test_existing_files_are_indexed_once(state, tmp_path):
+    """Test that clips present before the index existed are picked up by a single scan."""
+    (tmp_path / "@creator_video_123.mp4").write_bytes(b"x" * 10)
+    index_existing_files(state, str(tmp_path))
+    (tmp_path / "@creator_video_456.mp4").write_bytes(b"x" * 10)
+    index_existing_files(state, str(tmp_path))
+
+    assert [media["video_id"] for media in state.media_files()] == ["123"]
+
+
+def test_backlog_carries_across_runs_until_it_expires(state, tmp_path, mocker):
+    """Test that clips a finished run did not upload stay in the backlog, and leave it once too old, even if re-listed."""
+    run_id, _ = state.begin_run()
+    state.merge_run_videos([{"video_id": "1", "author_username": "a"}, {"video_id": "2", "author_username": "a"}],
+                           run_id, lambda rows: None)
+    old = add_clip(state, tmp_path, "1", 10, "a")
+    relisted = add_clip(state, tmp_path, "2", 10, "a")
+    state.complete_run(run_id)
+    state.begin_run()
+
+    assert {row["video_id"] for row in state.iter_backlog()} == {"1", "2"}
+
+    # An hour later, the next run lists clip 2 again (it keeps its first download time) and finds clip 3.
+    mocker.patch("time.time", return_value=time.time() + 3600)
+    state.merge_run_videos([{"video_id": "2", "author_username": "a"}, {"video_id": "3", "author_username": "a"}],
+                           state.begin_run()[0], lambda rows: None)
+    fresh = add_clip(state, tmp_path, "3", 10, "a")
+    assert expire_backlog(state, 1800) == 2
+    assert not old.exists()
+    assert not relisted.exists()
+    assert fresh.exists()
+    assert [row["video_id"] for row in state.iter_backlog()] == ["3"]
+    assert state.creator_backlog("a") == {"3"}
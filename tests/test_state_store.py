@@ -0,0 +1,160 @@
+import pytest
+from state_store import StateStore
+
+
+@pytest.fixture
+def state(tmp_path):
+    """Create a state store backed by a temporary database."""
+    return StateStore(str(tmp_path / "state.db"))
+
+
+def test_begin_run_resumes_until_completed(state):
+    """Test that an unfinished run is resumed and a completed one starts a new run."""
+    run_id, resumed = state.begin_run()
+    assert not resumed
+
+    assert state.begin_run() == (run_id, True)
+
+    state.complete_run(run_id)
+    next_run_id, resumed = state.begin_run()
+    assert next_run_id != run_id
+    assert not resumed
+
+
+def test_processed_creators_are_scoped_to_run(state):
+    """Test that creator progress only counts for the run it was recorded in."""
+    run_id, _ = state.begin_run()
+    state.mark_creator_processed("creator_a", run_id)
+    assert state.processed_creators(run_id) == {"creator_a"}
+
+    state.complete_run(run_id)
+    next_run_id, _ = state.begin_run()
+    assert state.processed_creators(next_run_id) == set()
+
+
+def test_record_upload_attempt(state):
+    """Test that only successful attempts mark a video as uploaded."""
+    run_id, _ = state.begin_run()
+    rows = [{"video_id": "111", "author_username": "creator_a"}, {"video_id": "222", "author_username": "creator_a"}]
+    state.merge_run_videos(rows, run_id, lambda new_rows: None)
+
+    state.record_upload_attempt("111", False, error="boom")
+    assert not state.is_uploaded("111")
+
+    state.record_upload_attempt("111", True, youtube_id="yt1")
+    assert state.is_uploaded("111")
+    assert not state.is_uploaded("222")
+    assert state.uploaded_count() == 1
+
+
+def test_import_legacy_files(state, tmp_path):
+    """Test the one-time import of the old flat-file state."""
+    upload_log = tmp_path / "uploaded_videos.log"
+    upload_log.write_text("111\n222\n")
+    progress_log = tmp_path / "download_progress.log"
+    progress_log.write_text("creator_a\n")
+    metadata = tmp_path / "metadata.csv"
+    metadata.write_text("video_id,author_username\n333,creator_a\n")
+    marker = tmp_path / "run_complete.marker"
+
+    state.import_legacy_files(str(upload_log), str(progress_log), str(marker), str(metadata))
+    upload_log.write_text("111\n222\n444\n")
+    state.import_legacy_files(str(upload_log), str(progress_log), str(marker), str(metadata))
+
+    assert state.uploaded_count() == 2
+    run_id, resumed = state.begin_run()
+    assert resumed
+    assert state.processed_creators(run_id) == {"creator_a"}
+
+
+def test_merge_run_videos_dedupes_at_insert(state):
+    """Test that only rows new to the run are passed on for appending."""
+    run_id, _ = state.begin_run()
+    appended = []
+
+    rows = [{"video_id": "111", "author_username": "a"}, {"video_id": "111", "author_username": "a"}]
+    assert state.merge_run_videos(rows, run_id, appended.extend) == 1
+
+    rows = [{"video_id": "111", "author_username": "a"}, {"video_id": "222", "author_username": "b"}]
+    assert state.merge_run_videos(rows, run_id, appended.extend) == 1
+
+    assert [row["video_id"] for row in appended] == ["111", "222"]
+    assert state.run_video_count(run_id) == 2
+
+
+def test_merge_run_videos_rolls_back_when_append_fails(state):
+    """Test that the index is not committed if the rows could not be persisted."""
+    run_id, _ = state.begin_run()
+
+    def failing_append(rows):
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        state.merge_run_videos([{"video_id": "111", "author_username": "a"}], run_id, failing_append)
+    assert state.run_video_count(run_id) == 0
+
+
+def test_publish_schedule_survives_restart(state, tmp_path):
+    """Test that a run's publish schedule is persisted and its claimed slots are remembered."""
+    run_id, _ = state.begin_run()
+    assert state.ensure_publish_schedule(run_id, [100.0, 200.0, 300.0]) == 3
+
+    state.record_upload_attempt("111", True, youtube_id="yt1", publish_slot=(run_id, 0))
+
+    reopened = StateStore(str(tmp_path / "state.db"))
+    assert reopened.ensure_publish_schedule(run_id, [999.0]) == 3
+    assert reopened.claimed_publish_slot_count(run_id) == 1
+    assert reopened.next_free_publish_slot(run_id) == (1, 200.0)
+
+
+def test_creator_high_water_mark_only_moves_forward(state):
+    """Test that a creator's newest seen video ID never goes backwards and the backlog excludes uploads."""
+    run_id, _ = state.begin_run()
+    assert state.creator_high_water_mark("creator_a") is None
+
+    state.mark_creator_processed("creator_a", run_id, 7300000000000000002)
+    state.mark_creator_processed("creator_a", run_id, 7300000000000000001)
+    state.mark_creator_processed("creator_a", run_id)
+    assert state.creator_high_water_mark("creator_a") == 7300000000000000002
+
+    rows = [{"video_id": "111", "author_username": "creator_a"}, {"video_id": "222", "author_username": "creator_a"}]
+    state.merge_run_videos(rows, run_id, lambda new_rows: None)
+    state.record_upload_attempt("111", True, youtube_id="yt1")
+    assert state.creator_backlog("creator_a") == {"222"}
+
+
+def test_pending_metadata_streams_projected_unuploaded_rows(state):
+    """Test that only not-yet-uploaded videos of the run come back, with just the columns the uploader reads."""
+    run_id, _ = state.begin_run()
+    rows = [
+        {"video_id": "1", "author_username": "a", "video_playcount": "12", "music_title": "song"},
+        {"video_id": "2", "author_username": "b", "video_playcount": "n/a"},
+    ]
+    state.merge_run_videos(rows, run_id, lambda new_rows: None)
+    state.record_upload_attempt("1", True, youtube_id="yt-1")
+
+    pending = list(state.iter_pending_metadata(run_id))
+    assert pending == [{
+        "video_id": "2", "author_username": "b", "video_description": "",
+        "video_playcount": None, "video_diggcount": None, "video_sharecount": None, "video_commentcount": None,
+    }]
+    assert state.video_metadata(["1"])["1"]["video_playcount"] == 12
+
+
+def test_relisted_video_is_exported_to_the_csv_once(state, tmp_path):
+    """Test that a video listed again by a later run joins that run but is not appended to metadata.csv again."""
+    import csv
+    from tiktok_downloader import _append_metadata_rows
+    metadata_path = str(tmp_path / "metadata.csv")
+    rows = [{"video_id": "111", "author_username": "a", "video_description": "clip"}]
+    append_rows = lambda new_rows: _append_metadata_rows(new_rows, metadata_path)
+
+    first_run, _ = state.begin_run()
+    assert state.merge_run_videos(rows, first_run, append_rows) == 1
+    state.complete_run(first_run)
+    second_run, _ = state.begin_run()
+    assert state.merge_run_videos(rows, second_run, append_rows) == 0
+
+    with open(metadata_path, encoding="utf-8", newline="") as f:
+        assert [row["video_id"] for row in csv.DictReader(f)] == ["111"]
+    assert state.run_video_count(second_run) == 1
@@ -0,0 +1,58 @@
+import time
+import signal
+import threading
+from supervisor import WorkerSupervisor, _serve_commands
+
+
+def _cooperative_worker(stop_event, status_queue, command_queue, log_queue):
+    """Fake worker that reports progress, answers commands and exits when asked to stop."""
+    threading.Thread(
+        target=_serve_commands, args=(command_queue, status_queue, stop_event, {"echo": lambda value: value}),
+        daemon=True
+    ).start()
+    status_queue.put({"type": "progress", "stages": {"download": {"creators_done": 1, "creators_total": 2}}})
+    stop_event.wait(30)
+    status_queue.put({"type": "finished", "stages": {"download": {"creators_done": 2, "creators_total": 2}}})
+
+
+def _stuck_worker(stop_event, status_queue, command_queue, log_queue):
+    """Fake worker that ignores both the stop event and SIGTERM."""
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    while True:
+        time.sleep(1)
+
+
+def _wait_for(condition, timeout=15):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not met in time"
+        time.sleep(0.05)
+
+
+def test_supervisor_relays_progress_and_commands():
+    """Test that progress and command replies flow back from the worker, and stop ends it cleanly."""
+    supervisor = WorkerSupervisor(target=_cooperative_worker)
+    assert supervisor.start()
+    assert not supervisor.start()
+    try:
+        _wait_for(lambda: supervisor.status()["stages"].get("download"))
+        assert supervisor.status()["stages"]["download"]["creators_done"] == 1
+        assert supervisor.call("echo", value=42) == 42
+    finally:
+        assert supervisor.stop(wait=True)
+
+    status = supervisor.status()
+    assert status["state"] == "stopped"
+    assert status["exit_code"] == 0
+    _wait_for(lambda: supervisor.status()["stages"]["download"]["creators_done"] == 2)
+    assert not supervisor.stop()
+
+
+def test_supervisor_kills_a_worker_that_ignores_stop():
+    """Test that a worker ignoring the stop event and SIGTERM is killed after the timeouts."""
+    supervisor = WorkerSupervisor(stop_timeout=0.5, kill_timeout=0.5, target=_stuck_worker)
+    supervisor.start()
+    supervisor.stop(wait=True)
+
+    assert not supervisor.is_running()
+    assert supervisor.status()["exit_code"] == -signal.SIGKILL
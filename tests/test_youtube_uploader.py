@@ -1,6 +1,6 @@
 import os
 import pytest
-from youtube_uploader import upload_to_youtube, process_and_upload_clips
+from youtube_uploader import upload_to_youtube, process_and_upload_clips, build_publish_schedule, format_publish_at, PUBLISH_LEAD_SECONDS
 from unittest.mock import MagicMock
 
 @pytest.fixture
@@ -71,3 +71,92 @@ def test_quota_exceeded_error(mock_youtube_service):
     # Expect an exception and ensure error is logged
     with pytest.raises(Exception, match="Quota Exceeded"):
         upload_to_youtube(mock_youtube_service, video_path, title, description)
+
+def test_build_publish_schedule():
+    """Test that publish times are spread evenly over the day, starting in the future."""
+    schedule = build_publish_schedule(4, start=0)
+
+    assert len(schedule) == 4
+    assert schedule[0] == PUBLISH_LEAD_SECONDS
+    assert schedule[1] - schedule[0] == 6 * 60 * 60
+    assert build_publish_schedule(0) == []
+    assert format_publish_at(0) == "1970-01-01T00:00:00Z"
+
+
+def _youtube_with_responses(responses):
+    """Build a YouTube client whose HTTP layer replays the given (headers, body) responses."""
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpMockSequence
+    http = HttpMockSequence(responses)
+    return build("youtube", "v3", http=http, static_discovery=True, developerKey="test"), http
+
+
+def test_chunked_upload_retries_transient_errors(tmp_path, mocker):
+    """Test that a 5xx during a chunk is retried from the offset the server confirms."""
+    mocker.patch("youtube_uploader.time.sleep")
+    video = tmp_path / "clip.mp4"
+    video.write_bytes(b"x" * 300 * 1024)
+    youtube, _ = _youtube_with_responses([
+        ({"status": "200", "location": "http://upload.example/session"}, ""),
+        ({"status": "503"}, ""),
+        ({"status": "308", "range": "bytes=0-262143"}, ""),
+        ({"status": "200"}, '{"id": "yt123"}'),
+    ])
+
+    assert upload_to_youtube(youtube, str(video), "Title", "Description", ["tag"], chunk_size=256 * 1024) == "yt123"
+
+
+def test_interrupted_upload_resumes_persisted_session(tmp_path):
+    """Test that an upload continues from a session saved by an earlier process."""
+    from state_store import StateStore
+    state = StateStore(str(tmp_path / "state.db"))
+    video = tmp_path / "clip.mp4"
+    video.write_bytes(b"x" * 300 * 1024)
+    state.save_upload_session("111", "http://upload.example/session", 256 * 1024, 300 * 1024)
+    youtube, _ = _youtube_with_responses([
+        ({"status": "308", "range": "bytes=0-262143"}, ""),
+        ({"status": "200"}, '{"id": "yt123"}'),
+    ])
+
+    result = upload_to_youtube(youtube, str(video), "Title", "Description", ["tag"], state=state, video_id="111",
+                               chunk_size=256 * 1024)
+
+    assert result == "yt123"
+    assert state.get_upload_session("111") is None
+
+
+def test_uploads_from_metadata_csv_without_run_id(tmp_path, mocker):
+    """Test that without a run_id the candidates are read from metadata.csv and uploaded."""
+    import threading
+    from state_store import StateStore
+    state = StateStore(str(tmp_path / "state.db"))
+    (tmp_path / "metadata.csv").write_text(
+        "video_id,author_username,video_description,play_count,digg_count,comment_count,share_count\n"
+        "1,alice,A clip #funny,100,10,1,1\n"
+    )
+    (tmp_path / "@alice_video_1.mp4").write_bytes(b"clip")
+    mocker.patch("youtube_uploader.get_authenticated_service", return_value=MagicMock())
+    upload = mocker.patch("youtube_uploader.upload_to_youtube", return_value="yt1")
+
+    process_and_upload_clips(str(tmp_path), 1, threading.Event(), state=state)
+
+    assert upload.call_count == 1
+    assert state.is_uploaded("1")
+
+
+def test_upload_uses_the_snippet_category(tmp_path, mocker):
+    """Test that the upload lane sends the manifest's categoryId, and "22" when it has none."""
+    import queue
+    import threading
+    from youtube_uploader import _run_upload_lane
+    upload = mocker.patch("youtube_uploader.upload_to_youtube", return_value="yt1")
+    jobs = queue.Queue()
+    for video_id, snippet in (("1", {"categoryId": "24"}), ("2", {})):
+        snippet.update(title="Title", description="Description", tags=[])
+        jobs.put({"video_id": video_id, "video_path": str(tmp_path / f"{video_id}.mp4"), "snippet": snippet,
+                  "publish_at": None, "publish_slot": None})
+    jobs.put(None)
+
+    _run_upload_lane("main", MagicMock(), jobs, lambda *args, **kwargs: False, threading.Event(), MagicMock(), 1024, 0)
+
+    assert [call.kwargs["category_id"] for call in upload.call_args_list] == ["24", "22"]
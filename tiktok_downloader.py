@@ -1,84 +1,358 @@
 import os
+import csv
+import time
+import asyncio
 import shutil
 import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import pyktok as pyk
-import pandas as pd
-
-def _load_processed_creators(progress_log_path):
-    """Reads the progress log and returns a set of processed creator usernames."""
-    if not os.path.exists(progress_log_path):
-        return set()
-    with open(progress_log_path, 'r', encoding='utf-8') as f:
-        return {line.strip() for line in f}
-
-def _log_processed_creator(creator, progress_log_path):
-    """Adds a creator's username to the progress log."""
-    with open(progress_log_path, 'a', encoding='utf-8') as f:
-        f.write(f"{creator}\n")
-
-def _download_single_creator(username, download_dir, videos_per_creator):
-    """Downloads clips for a single creator and returns the path to their metadata."""
-    temp_metadata_path = os.path.join(download_dir, f"temp_{username}_metadata.csv")
-    logging.info(f"Downloading up to {videos_per_creator} videos for user: {username}")
-    
+import metrics
+import progress
+import creator_health
+from creator_health import retry_transient
+from fingerprint import fingerprint_file
+from logger import pool_logging
+from manifest import build_manifests
+from state_store import STATE_DB_PATH, get_state_store, project_metadata
+
+STAGING_DIRNAME = "_staging"
+DEFAULT_DOWNLOAD_CONCURRENCY = 4
+
+CREATOR_DOWNLOAD_SECONDS = metrics.histogram("tiktok_creator_download_seconds", "Wall time to download one creator.")
+CREATOR_DOWNLOADS = metrics.counter("tiktok_creator_downloads_total", "Creator downloads by outcome.")
+CREATOR_VIDEOS = metrics.histogram(
+    "tiktok_videos_per_creator", "Metadata rows returned per creator download.", buckets=(0, 1, 2, 5, 10, 20, 50, 100)
+)
+METADATA_MERGE_SECONDS = metrics.histogram(
+    "metadata_merge_seconds", "Time to merge one creator's metadata.", buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5)
+)
+METADATA_ROWS_MERGED = metrics.counter("metadata_rows_merged_total", "New metadata rows appended to the run.")
+DOWNLOADS_IN_FLIGHT = metrics.gauge("tiktok_downloads_in_flight", "Creators currently being downloaded.")
+
+def _video_id_from_url(video_url):
+    """Extracts the numeric video ID from a https://www.tiktok.com/@user/video/<id> URL."""
+    return video_url.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+
+def _select_videos_to_fetch(username, video_urls, download_dir, state):
+    """
+    Splits a creator's listed videos into URLs that need the mp4 downloaded and
+    URLs that only need metadata because the mp4 is already on disk.
+
+    Videos newer than the creator's high-water mark are fetched, as are older
+    ones still waiting in the backlog; anything already uploaded is skipped.
+    """
+    high_water_mark = state.creator_high_water_mark(username)
+    backlog = state.creator_backlog(username) if high_water_mark else set()
+    to_download, metadata_only = [], []
+    for video_url in video_urls:
+        video_id = _video_id_from_url(video_url)
+        if not video_id.isdigit():
+            continue
+        is_new = high_water_mark is None or int(video_id) > high_water_mark
+        if not (is_new or video_id in backlog) or state.is_uploaded(video_id):
+            continue
+        if os.path.exists(os.path.join(download_dir, f"@{username}_video_{video_id}.mp4")):
+            metadata_only.append(video_url)
+        else:
+            to_download.append(video_url)
+    return to_download, metadata_only
+
+def _download_single_creator(username, download_dir, videos_per_creator, state_db_path=STATE_DB_PATH,
+                             perceptual_hashing=False, health_policy=None):
+    """
+    Downloads a single creator's new clips. Runs in a pool process.
+
+    The creator's feed is listed first and only videos that are new since the
+    last run (see _select_videos_to_fetch) are fetched. Each mp4 is
+    fingerprinted as it lands in download_dir. Transient errors are retried
+    with jittered backoff.
+
+    Returns a dict with the path to the creator's metadata (None on failure;
+    if there is nothing new the file does not exist), the error and its class
+    (see creator_health.py), and the number of retries. The parent records
+    them in the creator's health and the metrics, since metrics counted in
+    this process are never exported.
+    """
+    # pyktok always saves into the current working directory, so every creator
+    # gets its own staging directory and the download runs from inside it.
+    download_dir = os.path.abspath(download_dir)
+    staging_dir = os.path.join(download_dir, STAGING_DIRNAME, username)
+    os.makedirs(staging_dir, exist_ok=True)
+    temp_metadata_path = os.path.join(staging_dir, f"temp_{username}_metadata.csv")
+    logging.info(f"Checking up to {videos_per_creator} videos for user: {username}")
+
+    original_cwd = os.getcwd()
+    retries = 0
+
+    def count_retry():
+        nonlocal retries
+        retries += 1
+
     try:
+        state = get_state_store(state_db_path)
+        os.chdir(staging_dir)
         pyk.specify_browser("edge")
-        pyk.save_tiktok_multi_page(
-            username,
-            ent_type='user',
-            save_video=True,
-            metadata_fn=temp_metadata_path,
-            video_ct=videos_per_creator
+        video_urls = retry_transient(
+            lambda: asyncio.run(pyk.get_video_urls(username, ent_type='user', video_ct=videos_per_creator)),
+            f"Listing {username}'s videos", health_policy, on_retry=count_retry
         )
-        
-        for filename in os.listdir(os.getcwd()):
+        to_download, metadata_only = _select_videos_to_fetch(username, video_urls, download_dir, state)
+        logging.info(f"{username}: {len(video_urls)} listed, {len(to_download)} to download, "
+                     f"{len(metadata_only)} already on disk.")
+
+        # A retried batch may append some metadata rows twice; the merge drops duplicate video IDs.
+        if to_download:
+            retry_transient(
+                lambda: pyk.save_tiktok_multi_urls(to_download, save_video=True, metadata_fn=temp_metadata_path),
+                f"Downloading {username}'s videos", health_policy, on_retry=count_retry
+            )
+        if metadata_only:
+            retry_transient(
+                lambda: pyk.save_tiktok_multi_urls(metadata_only, save_video=False, metadata_fn=temp_metadata_path),
+                f"Fetching {username}'s metadata", health_policy, on_retry=count_retry
+            )
+
+        for filename in os.listdir(staging_dir):
             if filename.startswith(f"@{username}") and filename.endswith(".mp4"):
-                shutil.move(os.path.join(os.getcwd(), filename), os.path.join(download_dir, filename))
-        
-        return temp_metadata_path
+                video_path = os.path.join(download_dir, filename)
+                shutil.move(os.path.join(staging_dir, filename), video_path)
+                video_id = filename[:-len(".mp4")].rsplit("_", 1)[-1]
+                fingerprint = fingerprint_file(state, video_id, video_path, perceptual=perceptual_hashing)
+                state.record_media_file(video_id, video_path, username, fingerprint["file_size"])
+
+        return {"metadata_path": temp_metadata_path, "error": None, "error_kind": None, "retries": retries}
     except Exception as e:
         logging.error(f"Failed to download videos for {username}: {e}", exc_info=True)
-        return None
+        return {"metadata_path": None, "error": str(e), "error_kind": creator_health.classify_error(e),
+                "retries": retries}
+    finally:
+        os.chdir(original_cwd)
+
+def _create_download_pool(concurrency):
+    """Creates the process pool used to download creators in parallel."""
+    # Worker processes are spawned rather than forked: the downloader runs next
+    # to the Discord event loop, and changing directory must not leak into it.
+    # Spawned processes start without log handlers, so their records are sent back here.
+    return ProcessPoolExecutor(max_workers=concurrency, mp_context=multiprocessing.get_context("spawn"),
+                               **pool_logging())
+
+def _append_metadata_rows(rows, metadata_path):
+    """Appends rows to the main metadata CSV, writing the header only if the file is new."""
+    fieldnames = None
+    if os.path.exists(metadata_path) and os.path.getsize(metadata_path) > 0:
+        with open(metadata_path, 'r', encoding='utf-8', newline='') as f:
+            fieldnames = next(csv.reader(f), None)
+    write_header = not fieldnames
+    if write_header:
+        fieldnames = list(rows[0].keys())
 
-def download_and_combine_clips(creators, download_dir, progress_log_path, metadata_path, videos_per_creator):
+    with open(metadata_path, 'a', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+        if write_header:
+            writer.writeheader()
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _newest_video_id(rows):
+    """Returns the largest numeric video_id among metadata rows, or None."""
+    video_ids = [int(row["video_id"]) for row in rows if str(row.get("video_id") or "").isdigit()]
+    return max(video_ids) if video_ids else None
+
+def _merge_creator_metadata(creator, temp_csv_path, metadata_path, state, run_id):
+    """
+    Appends one creator's new metadata rows to the main CSV, marks the creator
+    as done and returns the new rows, projected to the columns the uploader reads.
+    """
+    if not temp_csv_path:
+        logging.warning(f"Could not retrieve metadata for {creator}.")
+        return []
+
+    appended_rows = []
+    def append_rows(new_rows):
+        _append_metadata_rows(new_rows, metadata_path)
+        appended_rows.extend(project_metadata(row) for row in new_rows)
+
+    try:
+        if not os.path.exists(temp_csv_path):
+            logging.info(f"No new videos for {creator} since the last run.")
+            CREATOR_VIDEOS.observe(0)
+            state.mark_creator_processed(creator, run_id)
+            return []
+
+        with open(temp_csv_path, 'r', encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+        if not rows:
+            logging.warning(f"Metadata file for {creator} was empty. Skipping.")
+            return []
+
+        CREATOR_VIDEOS.observe(len(rows))
+        # The state store's video_id index drops rows already in this run, so
+        # only genuinely new rows are appended to the main CSV.
+        merge_started = time.monotonic()
+        new_count = state.merge_run_videos(rows, run_id, append_rows)
+        METADATA_MERGE_SECONDS.observe(time.monotonic() - merge_started)
+        METADATA_ROWS_MERGED.inc(new_count)
+        logging.info(f"Appended {new_count} new of {len(rows)} metadata rows for {creator} to the main CSV.")
+
+        # Titles, descriptions and tags are prepared now, off the upload path.
+        build_manifests(state, appended_rows)
+
+        # Mark this creator as done for this run and move their high-water mark
+        state.mark_creator_processed(creator, run_id, _newest_video_id(rows))
+        return appended_rows
+    finally:
+        if os.path.exists(temp_csv_path):
+            os.remove(temp_csv_path) # Clean up temp file
+        shutil.rmtree(os.path.dirname(temp_csv_path), ignore_errors=True)
+
+def download_and_combine_clips(creators, download_dir, state, run_id, metadata_path, videos_per_creator,
+                               concurrency=DEFAULT_DOWNLOAD_CONCURRENCY, on_new_rows=None, stop_event=None,
+                               perceptual_hashing=False, health_policy=None):
     """
     Downloads videos from a list of creators, skipping those already processed
-    in the current run, and appends their metadata to the main CSV file.
+    in the current run, and appends their new metadata rows to the main CSV file.
+    Only videos newer than each creator's high-water mark (or still waiting to
+    be uploaded) are fetched, so steady-state runs scale with new videos.
+
+    Creators are downloaded by a pool of `concurrency` worker processes. Results
+    are merged one at a time in this process, so the master metadata and the
+    run state are only ever written from a single place.
+
+    If given, `on_new_rows` is called with each creator's new metadata rows as
+    soon as they are merged. At most `concurrency` creators are in flight, so a
+    blocking `on_new_rows` also holds back new downloads. Setting `stop_event`
+    stops submitting creators; downloads already running are still merged.
+    With `perceptual_hashing`, clips also get a keyframe hash for spotting
+    re-encoded reposts (needs ffmpeg).
+
+    `creators` and `videos_per_creator` may also be callables returning the
+    current setting. They are then re-read before each creator is submitted,
+    so creators added while the stage runs are downloaded too, and creators
+    removed before their turn are skipped.
+
+    Creators whose health record says to back off (or whose circuit is open)
+    are skipped until their next attempt is due, and healthy creators are
+    downloaded first, so failing accounts never hold up the rest.
+    `health_policy` overrides creator_health.DEFAULT_HEALTH_POLICY.
     """
     os.makedirs(download_dir, exist_ok=True)
-    processed_creators = _load_processed_creators(progress_log_path)
+    creator_source = creators if callable(creators) else None
+    creators = list(creator_source()) if creator_source else list(creators)
+    processed_creators = state.processed_creators(run_id)
     logging.info(f"Resuming run. Found {len(processed_creators)} already processed creators.")
+    health = state.all_creator_health()
+    creators_skipped = 0
+
+    def is_due(creator):
+        nonlocal creators_skipped
+        record = health.get(creator)
+        if creator_health.is_due(record):
+            return True
+        creators_skipped += 1
+        CREATOR_DOWNLOADS.inc(outcome="skipped")
+        retry_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(record["next_attempt_at"]))
+        logging.info(f"⏸️ Skipping {creator} ({creator_health.health_state(record).replace('_', ' ')}) "
+                     f"until {retry_at}.")
+        return False
+
+    def order_pending_creators():
+        ordered = sorted(pending_creators, key=lambda creator: creator_health.schedule_key(health.get(creator)))
+        pending_creators.clear()
+        pending_creators.extend(ordered)
 
+    pending_creators = deque()
     for creator in creators:
         if creator in processed_creators:
             logging.info(f"Skipping already processed creator: {creator}")
             continue
+        if is_due(creator):
+            pending_creators.append(creator)
+    order_pending_creators()
+    known_creators = set(creators)
 
-        temp_csv_path = _download_single_creator(creator, download_dir, videos_per_creator)
-        
-        if temp_csv_path and os.path.exists(temp_csv_path):
-            try:
-                df = pd.read_csv(temp_csv_path)
-                if not df.empty:
-                    # Append to the main CSV, writing header only if file is new
-                    header = not os.path.exists(metadata_path)
-                    df.to_csv(metadata_path, mode='a', header=header, index=False, encoding='utf-8')
-                    logging.info(f"Appended metadata for {creator} to the main CSV.")
-                    
-                    # Mark this creator as done for this run
-                    _log_processed_creator(creator, progress_log_path)
-            except pd.errors.EmptyDataError:
-                logging.warning(f"Metadata file for {creator} was empty. Skipping.")
-            finally:
-                os.remove(temp_csv_path) # Clean up temp file
-        else:
-            logging.warning(f"Could not retrieve or find metadata for {creator}.")
-
-    if os.path.exists(metadata_path):
-        # Final check: de-duplicate the master CSV just in case
-        final_df = pd.read_csv(metadata_path)
-        final_df.drop_duplicates(subset='video_id', inplace=True)
-        final_df.to_csv(metadata_path, index=False, encoding='utf-8')
-        logging.info(f"Download phase complete. Final metadata contains {len(final_df)} unique videos.")
+    def refresh_pending_creators():
+        current = list(creator_source())
+        current_set = set(current)
+        for creator in current:
+            if creator not in known_creators:
+                known_creators.add(creator)
+                if creator not in processed_creators and is_due(creator):
+                    logging.info(f"Picked up newly added creator: {creator}")
+                    pending_creators.append(creator)
+        for creator in [creator for creator in pending_creators if creator not in current_set]:
+            logging.info(f"Skipping creator removed from the config: {creator}")
+            pending_creators.remove(creator)
+            known_creators.discard(creator)
+        order_pending_creators()
+
+    creators_done = len(creators) - len(pending_creators) - creators_skipped
+    creators_failed = 0
+    progress.update("download", status="running", creators_total=len(creators) - creators_skipped, creators_done=creators_done,
+                    creators_failed=creators_failed, creators_skipped=creators_skipped, in_flight=0,
+                    videos=state.run_video_count(run_id))
+    if pending_creators:
+        if not creator_source:
+            concurrency = min(concurrency, len(pending_creators))
+        concurrency = max(1, concurrency)
+        logging.info(f"Downloading {len(pending_creators)} creators with {concurrency} parallel workers.")
+        with _create_download_pool(concurrency) as pool:
+            in_flight = {}
+            while True:
+                while len(in_flight) < concurrency and not (stop_event and stop_event.is_set()):
+                    if creator_source:
+                        refresh_pending_creators()
+                    if not pending_creators:
+                        break
+                    creator = pending_creators.popleft()
+                    videos = videos_per_creator() if callable(videos_per_creator) else videos_per_creator
+                    future = pool.submit(_download_single_creator, creator, download_dir, videos,
+                                         state.db_path, perceptual_hashing, health_policy)
+                    in_flight[future] = (creator, time.monotonic())
+                DOWNLOADS_IN_FLIGHT.set(len(in_flight))
+                progress.update("download", in_flight=len(in_flight), creators_skipped=creators_skipped,
+                                creators_total=creators_done + len(in_flight) + len(pending_creators))
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    creator, submitted_at = in_flight.pop(future)
+                    CREATOR_DOWNLOAD_SECONDS.observe(time.monotonic() - submitted_at)
+                    creators_done += 1
+                    try:
+                        outcome = future.result()
+                    except Exception as e:
+                        CREATOR_DOWNLOADS.inc(outcome="crashed")
+                        logging.error(f"Download worker for {creator} crashed: {e}", exc_info=True)
+                        creator_health.record_failure(state, creator, e, health_policy)
+                        creators_failed += 1
+                        progress.update("download", creators_done=creators_done, creators_failed=creators_failed)
+                        continue
+                    temp_csv_path = outcome["metadata_path"]
+                    creator_health.record_retries(outcome["retries"])
+                    if temp_csv_path:
+                        creator_health.record_success(state, creator)
+                    else:
+                        creator_health.record_failure(state, creator, outcome["error"], health_policy,
+                                                      outcome["error_kind"])
+                    CREATOR_DOWNLOADS.inc(outcome="ok" if temp_csv_path else "failed")
+                    creators_failed += 0 if temp_csv_path else 1
+                    new_rows = _merge_creator_metadata(creator, temp_csv_path, metadata_path, state, run_id)
+                    progress.update("download", creators_done=creators_done, creators_failed=creators_failed,
+                                    last_creator=creator, videos=state.run_video_count(run_id))
+                    if new_rows and on_new_rows:
+                        on_new_rows(new_rows)
+
+        if stop_event and stop_event.is_set():
+            logging.warning("🛑 Stop signal received. Download phase stopped before all creators were processed.")
+
+    video_count = state.run_video_count(run_id)
+    progress.update("download", status="stopped" if stop_event and stop_event.is_set() else "done",
+                    in_flight=0, videos=video_count)
+    if video_count:
+        logging.info(f"Download phase complete. Final metadata contains {video_count} unique videos.")
     else:
         logging.warning("Download phase complete, but no metadata was collected.")
@@ -1,67 +1,279 @@
 import logging
 import os
 import time
-import json
-from tiktok_downloader import download_and_combine_clips
-from youtube_uploader import process_and_upload_clips
+import threading
+from tiktok_downloader import download_and_combine_clips, DEFAULT_DOWNLOAD_CONCURRENCY
+from youtube_uploader import process_and_upload_clips, UPLOAD_LOG_FILE, DEFAULT_UPLOAD_CHUNK_SIZE
+from quota import QuotaLedger, DEFAULT_DAILY_QUOTA_UNITS, VIDEO_INSERT_UNITS
+from auth import DEFAULT_CHANNEL
+from state_store import get_state_store
+from pipeline import CandidateQueue, DEFAULT_UPLOAD_QUEUE_SIZE
+from ranking import DEFAULT_RANKING_POOL_SIZE
+from manifest import build_manifests
+from media_check import MediaCheckStage, DEFAULT_SHORTS_SPEC, DEFAULT_MEDIA_CHECK_CONCURRENCY
+from config_store import get_config_store, CONFIG_PATH
+from creator_health import DEFAULT_HEALTH_POLICY
+from jobqueue import open_job_queue, DEFAULT_LEASE_SECONDS
+from distributed import (ClaimedCreators, JobCandidates, SharedState, worker_identity, upload_job_kind,
+                         DEFAULT_DOWNLOAD_PERIOD_HOURS, DEFAULT_POLL_SECONDS)
+import metrics
+import progress
+import retention
 
-CONFIG_PATH = "config.json"
 DOWNLOAD_DIR = "./tiktok_downloads"
 METADATA_CSV_PATH = os.path.join(DOWNLOAD_DIR, 'metadata.csv')
+# Legacy flat-file run state, imported once into the state store.
 DOWNLOAD_PROGRESS_LOG = os.path.join(DOWNLOAD_DIR, 'download_progress.log')
 RUN_COMPLETE_MARKER = os.path.join(DOWNLOAD_DIR, 'run_complete.marker')
+# Clips not uploaded within this many days leave the backlog.
+DEFAULT_BACKLOG_MAX_AGE_DAYS = 14
 
-def manage_run_state():
-    """Checks for a completion marker to decide if this is a fresh or resumed run."""
-    if os.path.exists(RUN_COMPLETE_MARKER):
-        logging.info("Completion marker found. Previous run finished successfully. Starting a fresh run.")
-        if os.path.exists(METADATA_CSV_PATH): os.remove(METADATA_CSV_PATH)
-        if os.path.exists(DOWNLOAD_PROGRESS_LOG): os.remove(DOWNLOAD_PROGRESS_LOG)
-        os.remove(RUN_COMPLETE_MARKER)
+WORKER_CYCLES = metrics.counter("worker_cycles_total", "Worker cycles by outcome.")
+WORKER_CYCLE_SECONDS = metrics.histogram(
+    "worker_cycle_seconds", "Wall time of a worker cycle.", buckets=(60, 300, 900, 1800, 3600, 7200, 21600, 86400)
+)
+WORKER_RUNNING = metrics.gauge("worker_running", "1 while a worker cycle is in progress.")
+
+def manage_run_state(state):
+    """Decides from the state store whether this is a fresh or resumed run and returns the run id."""
+    state.import_legacy_files(UPLOAD_LOG_FILE, DOWNLOAD_PROGRESS_LOG, RUN_COMPLETE_MARKER, METADATA_CSV_PATH)
+    state.import_metadata_csv(METADATA_CSV_PATH)
+    run_id, resumed = state.begin_run()
+    if resumed:
+        logging.warning(f"Previous run {run_id} did not complete. Attempting to resume it.")
     else:
-        logging.warning("No completion marker found. Attempting to resume previous run.")
+        # Clips the last run did not get to stay in the backlog (see retention.expire_backlog).
+        logging.info(f"Previous run finished successfully. Starting fresh run {run_id}.")
+    return run_id
+
+def _run_download_stage(candidate_queue, stage_errors, stop_event, state, run_id, creators, videos_per_creator,
+                        download_concurrency, perceptual_hashing=False, shorts_spec=None,
+                        media_check_concurrency=DEFAULT_MEDIA_CHECK_CONCURRENCY, backlog_since=0,
+                        skip_downloads=False, health_policy=None):
+    """
+    Producer side of the pipeline: feeds the backlog downloaded since
+    `backlog_since`, then new metadata rows as they land, to the upload
+    stage. With a `shorts_spec`, clips first pass the media check stage.
+    With `skip_downloads`, only the backlog is fed.
+    """
+    media_check = None
+    forward = candidate_queue.put_many
+    try:
+        if shorts_spec is not None:
+            media_check = MediaCheckStage(state, DOWNLOAD_DIR, candidate_queue.put_many, shorts_spec,
+                                          media_check_concurrency)
+            forward = media_check.submit
+
+        # Clips earlier runs (or an interrupted one) did not upload go first.
+        build_manifests(state, state.iter_backlog(backlog_since))
+        for row in state.iter_backlog(backlog_since):
+            if not forward([row]):
+                break
+
+        if skip_downloads:
+            return
+        download_and_combine_clips(
+            creators=creators,
+            download_dir=DOWNLOAD_DIR,
+            state=state,
+            run_id=run_id,
+            metadata_path=METADATA_CSV_PATH,
+            videos_per_creator=videos_per_creator,
+            concurrency=download_concurrency,
+            on_new_rows=forward,
+            stop_event=stop_event,
+            perceptual_hashing=perceptual_hashing,
+            health_policy=health_policy
+        )
+    except Exception as e:
+        stage_errors.append(e)
+        logging.critical("A critical error occurred in the download stage.", exc_info=True)
+    finally:
+        if media_check is not None:
+            media_check.close(cancel=stop_event.is_set())
+        candidate_queue.close()
+
+def _backlog_covers_uploads(state, backlog_since, max_uploads, channels, daily_quota_units):
+    """
+    Returns True if the backlog already holds at least as many clips as can be
+    uploaded today, i.e. the upload limit or the channels' remaining quota.
+    """
+    ledger = QuotaLedger(state, daily_quota_units)
+    quota_uploads = sum(ledger.remaining(channel) // VIDEO_INSERT_UNITS for channel in channels)
+    uploads_possible = min(max_uploads, quota_uploads)
+    backlog = state.backlog_count(backlog_since)
+    progress.update("worker", backlog=backlog)
+    if backlog < uploads_possible:
+        logging.info(f"Backlog holds {backlog} clips for up to {uploads_possible} uploads today.")
+        return False
+    logging.info(f"📦 Backlog of {backlog} clips covers today's {uploads_possible} uploads. Skipping the download phase.")
+    return True
 
 def run_bot_cycle(stop_event):
     """The main automation logic loop, designed to be run in a separate thread."""
     logging.info("✅ Worker thread started.")
+    cycle_started = time.monotonic()
+    outcome = "error"
+    WORKER_RUNNING.set(1)
+    progress.reset()
+    progress.update("worker", status="running", started_at=time.time())
     
     try:
-        # Load configuration from the JSON file
-        with open(CONFIG_PATH, 'r') as f:
-            config = json.load(f)
+        # Load configuration from the JSON file. Creators and limits are re-read
+        # while the cycle runs, so /creators and /config changes apply right away.
+        config_store = get_config_store(CONFIG_PATH)
+        config = config_store.get()
         
         tiktok_creators = config.get("tiktok_creators", [])
         videos_per_creator = config.get("videos_to_check_per_creator", 10)
         max_uploads = config.get("max_uploads_per_day", 5)
+        download_concurrency = config.get("download_concurrency", DEFAULT_DOWNLOAD_CONCURRENCY)
+        upload_queue_size = config.get("upload_queue_size", DEFAULT_UPLOAD_QUEUE_SIZE)
+        ranking_pool_size = config.get("ranking_pool_size", DEFAULT_RANKING_POOL_SIZE)
+        scheduled_publishing = config.get("scheduled_publishing", False)
+        upload_chunk_size = int(config.get("upload_chunk_size_mb", DEFAULT_UPLOAD_CHUNK_SIZE / 1048576) * 1048576)
+        ranking_weights = config.get("ranking_weights", {})
+        perceptual_hashing = config.get("perceptual_hashing", False)
+        budget_mb = config.get("download_dir_budget_mb")
+        youtube_channels = config.get("youtube_channels") or [DEFAULT_CHANNEL]
+        channel_routing = config.get("channel_routing", "affinity")
+        channel_affinity = config.get("channel_affinity", {})
+        daily_quota_units = config.get("daily_quota_units", DEFAULT_DAILY_QUOTA_UNITS)
+        download_budget = int(budget_mb * 1048576) if budget_mb else None
+        shorts_spec = None
+        if config.get("shorts_check", False):
+            shorts_spec = {
+                "max_duration_seconds": config.get("shorts_max_duration_seconds",
+                                                   DEFAULT_SHORTS_SPEC["max_duration_seconds"]),
+                "aspect_tolerance": config.get("shorts_aspect_tolerance", DEFAULT_SHORTS_SPEC["aspect_tolerance"]),
+                "max_bitrate_kbps": config.get("transcode_max_bitrate_kbps", DEFAULT_SHORTS_SPEC["max_bitrate_kbps"]),
+            }
+        media_check_concurrency = config.get("media_check_concurrency", DEFAULT_MEDIA_CHECK_CONCURRENCY)
+        backlog_max_age = config.get("backlog_max_age_days", DEFAULT_BACKLOG_MAX_AGE_DAYS) * 86400
+        backlog_skip_downloads = config.get("backlog_skip_downloads", True)
+        distributed_settings = config.get("distributed")
+        creator_cooldown = config.get("creator_cooldown_hours", DEFAULT_HEALTH_POLICY["cooldown_seconds"] / 3600) * 3600
+        health_policy = {
+            "failure_threshold": config.get("creator_failure_threshold", DEFAULT_HEALTH_POLICY["failure_threshold"]),
+            "cooldown_seconds": creator_cooldown,
+            "max_cooldown_seconds": max(creator_cooldown, DEFAULT_HEALTH_POLICY["max_cooldown_seconds"]),
+        }
+
+        metrics.start_file_exporter(metrics.METRICS_FILE)
+        if config.get("metrics_port"):
+            try:
+                metrics.start_http_server(int(config["metrics_port"]))
+            except OSError as e:
+                # E.g. another worker on this host already serves that port; the file exporter still runs.
+                logging.warning(f"Could not serve metrics on port {config['metrics_port']}: {e}")
 
         # Check for the stop signal before starting heavy work
         if stop_event.is_set():
             logging.warning("🛑 Worker thread received stop signal before starting.")
+            outcome = "stopped"
             return
 
-        manage_run_state()
-        
-        logging.info(f"Starting process for {len(tiktok_creators)} creators.")
-        download_and_combine_clips(
-            creators=tiktok_creators,
-            download_dir=DOWNLOAD_DIR,
-            progress_log_path=DOWNLOAD_PROGRESS_LOG,
-            metadata_path=METADATA_CSV_PATH,
-            videos_per_creator=videos_per_creator
+        state = get_state_store()
+        run_id = manage_run_state(state)
+        if distributed_settings:
+            job_queue = open_job_queue(distributed_settings)
+            # Uploaded videos and quota bookings are shared with the other workers; the rest stays local.
+            state = SharedState(job_queue, state)
+        progress.update("worker", run_id=run_id)
+        retention.index_existing_files(state, DOWNLOAD_DIR)
+        # Make room before new clips arrive; the upload stage may free more afterwards.
+        retention.enforce_disk_budget(state, download_budget, ranking_weights)
+        retention.expire_backlog(state, backlog_max_age)
+        backlog_since = time.time() - backlog_max_age if backlog_max_age else 0
+        skip_downloads = backlog_skip_downloads and _backlog_covers_uploads(
+            state, backlog_since, max_uploads, youtube_channels, daily_quota_units
         )
         
-        process_and_upload_clips(
-            download_dir=DOWNLOAD_DIR,
-            max_uploads=max_uploads,
-            stop_event=stop_event  # Pass the stop event to the uploader
+        logging.info(f"Starting process for {len(tiktok_creators)} creators.")
+        current_creators = lambda: config_store.get().get("tiktok_creators", [])
+        current_videos_per_creator = lambda: config_store.get().get("videos_to_check_per_creator", videos_per_creator)
+        current_max_uploads = lambda: config_store.get().get("max_uploads_per_day", max_uploads)
+
+        # Downloads and uploads run as a pipeline: each clip becomes an upload
+        # candidate as soon as its metadata is merged, through a bounded queue.
+        # In distributed mode the shared job queue takes the place of both the
+        # creator list and the candidate queue, so several workers split the work.
+        creator_source = current_creators
+        if distributed_settings:
+            host, worker_id = worker_identity(distributed_settings)
+            lease_seconds = distributed_settings.get("lease_seconds", DEFAULT_LEASE_SECONDS)
+            logging.info(f"🌐 Distributed mode: worker {worker_id} on the {distributed_settings.get('backend', 'sqlite')} job queue.")
+            progress.update("jobs", worker_id=worker_id)
+            creator_source = ClaimedCreators(
+                job_queue, worker_id, state, run_id, current_creators, stop_event, lease_seconds,
+                distributed_settings.get("download_period_hours", DEFAULT_DOWNLOAD_PERIOD_HOURS)
+            )
+            candidate_queue = JobCandidates(
+                job_queue, upload_job_kind(distributed_settings, host), worker_id, state, DOWNLOAD_DIR, stop_event,
+                current_max_uploads, lease_seconds, distributed_settings.get("poll_seconds", DEFAULT_POLL_SECONDS)
+            )
+        else:
+            candidate_queue = CandidateQueue(upload_queue_size, stop_event)
+        stage_errors = []
+        download_stage = threading.Thread(
+            target=_run_download_stage,
+            args=(candidate_queue, stage_errors, stop_event, state, run_id, creator_source,
+                  current_videos_per_creator, download_concurrency, perceptual_hashing, shorts_spec,
+                  media_check_concurrency, backlog_since, skip_downloads, health_policy),
+            name="download-stage",
+            daemon=True
         )
-        
+        download_stage.start()
+
+        try:
+            process_and_upload_clips(
+                download_dir=DOWNLOAD_DIR,
+                max_uploads=current_max_uploads,
+                stop_event=stop_event,  # Pass the stop event to the uploader
+                state=state,
+                candidates=candidate_queue,
+                run_id=run_id,
+                scheduled_publishing=scheduled_publishing,
+                chunk_size=upload_chunk_size,
+                ranking_weights=ranking_weights,
+                ranking_pool_size=ranking_pool_size,
+                perceptual_hashing=perceptual_hashing,
+                channels=youtube_channels,
+                routing=channel_routing,
+                channel_affinity=channel_affinity,
+                daily_quota_units=daily_quota_units
+            )
+        finally:
+            # Let the download stage finish without blocking on a full queue.
+            candidate_queue.discard_remaining()
+            download_stage.join()
+            if distributed_settings:
+                candidate_queue.settle()
+                creator_source.close()
+        retention.enforce_disk_budget(state, download_budget, ranking_weights)
+
+        if stop_event.is_set():
+            logging.warning(f"🛑 Worker stopped before run {run_id} finished. It will be resumed next time.")
+            outcome = "stopped"
+            return
+        if stage_errors:
+            logging.error(f"Download stage failed. Run {run_id} will be resumed next time.")
+            return
+
         logging.info("--- Process completed successfully. ---")
-        with open(RUN_COMPLETE_MARKER, 'w') as f:
-            pass
-        logging.info("Run completion marker created.")
+        state.complete_run(run_id)
+        logging.info(f"Run {run_id} marked complete in the state store.")
+        outcome = "completed"
 
     except Exception as e:
         logging.critical("A critical error occurred in the worker thread.", exc_info=True)
     finally:
+        WORKER_RUNNING.set(0)
+        WORKER_CYCLES.inc(outcome=outcome)
+        WORKER_CYCLE_SECONDS.observe(time.monotonic() - cycle_started)
+        progress.update("worker", status=outcome, finished_at=time.time())
+        try:
+            metrics.write_prometheus_file(metrics.METRICS_FILE)
+        except OSError as e:
+            logging.warning(f"Could not write metrics file: {e}")
         logging.info("✅ Worker thread finished.")
\ No newline at end of file
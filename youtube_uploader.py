@@ -1,127 +1,508 @@
 import os
 import csv
+import json
+import queue
 import logging
+import threading
 import time
+import random
+import socket
+import httplib2
+from datetime import datetime, timezone
 from googleapiclient.http import MediaFileUpload
+from googleapiclient.errors import HttpError
 from auth import get_authenticated_service
+from state_store import get_state_store, project_metadata
+from ranking import iter_ranked_candidates, DEFAULT_RANKING_POOL_SIZE
+from fingerprint import find_uploaded_duplicate
+from manifest import build_snippet, ManifestError, CATEGORY_ID
+from quota import QuotaLedger, ChannelRouter, QuotaExceededError, DEFAULT_DAILY_QUOTA_UNITS
+from auth import DEFAULT_CHANNEL
+import metrics
+import progress
 
+# Legacy flat-file upload log, imported once into the state store.
 UPLOAD_LOG_FILE = os.path.join("resources", "uploaded_videos.log")
 
-def load_uploaded_ids(log_file):
-    """Reads the log file and returns a set of already uploaded video IDs."""
-    if not os.path.exists(log_file):
-        return set()
-    with open(log_file, 'r', encoding='utf-8') as f:
-        return {line.strip() for line in f}
-
-def log_uploaded_id(video_id, log_file):
-    """Appends a successfully uploaded video ID to the log file."""
-    with open(log_file, 'a', encoding='utf-8') as f:
-        f.write(f"{video_id}\n")
-
-def extract_tiktok_tags(description):
-    """Extracts hashtags from a video description string."""
-    if not description:
+# Resumable uploads are sent in chunks, which must be a multiple of 256 KiB.
+CHUNK_SIZE_UNIT = 256 * 1024
+DEFAULT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_RETRIES = 8
+MAX_RETRY_DELAY_SECONDS = 64
+RETRIABLE_STATUS_CODES = (500, 502, 503, 504)
+RETRIABLE_EXCEPTIONS = (httplib2.HttpLib2Error, ConnectionError, socket.timeout, TimeoutError)
+
+UPLOADS = metrics.counter("youtube_uploads_total", "Video uploads by outcome.")
+UPLOAD_BYTES = metrics.counter("youtube_upload_bytes_total", "Bytes sent to the YouTube upload endpoint.")
+UPLOAD_SECONDS = metrics.histogram("youtube_upload_seconds", "Wall time of a complete video upload.")
+UPLOAD_THROUGHPUT = metrics.gauge("youtube_upload_bytes_per_second", "Throughput of the most recent upload chunk.")
+API_REQUESTS = metrics.counter("youtube_api_requests_total", "Requests made to the YouTube upload endpoint.")
+DUPLICATES_SKIPPED = metrics.counter("youtube_duplicate_uploads_skipped_total", "Clips skipped as reposts of uploaded videos.")
+API_ERRORS = metrics.counter("youtube_api_errors_total", "YouTube API errors by HTTP status or exception type.")
+
+# Error reasons YouTube uses when a channel's daily quota or upload limit is used up.
+QUOTA_ERROR_REASONS = ("quotaExceeded", "dailyLimitExceeded", "uploadLimitExceeded", "rateLimitExceeded")
+
+# Scheduled videos must be published in the future; the first slot starts this far ahead.
+PUBLISH_LEAD_SECONDS = 15 * 60
+
+def format_publish_at(timestamp):
+    """Formats a Unix timestamp as the RFC 3339 UTC string expected by status.publishAt."""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def build_publish_schedule(max_uploads, start=None):
+    """Spreads max_uploads publish times evenly over the next 24 hours."""
+    if max_uploads <= 0:
         return []
-    tags = [word.strip('#,.-_') for word in description.split() if word.startswith('#')]
-    logging.debug(f"Extracted {len(tags)} tags from description: {tags}")
-    return tags
+    start = (start if start is not None else time.time()) + PUBLISH_LEAD_SECONDS
+    interval = (24 * 60 * 60) / max_uploads
+    return [start + index * interval for index in range(max_uploads)]
+
+def _normalize_chunk_size(chunk_size):
+    """Rounds a chunk size down to a multiple of 256 KiB, keeping at least one unit."""
+    return max(CHUNK_SIZE_UNIT, (chunk_size // CHUNK_SIZE_UNIT) * CHUNK_SIZE_UNIT)
+
+def _send_chunks(request, file_size, state=None, video_id=None):
+    """Drives a resumable upload chunk by chunk, retrying transient failures with exponential backoff."""
+    response = None
+    retries = 0
+    while response is None:
+        progress_before = request.resumable_progress
+        started = time.monotonic()
+        API_REQUESTS.inc()
+        try:
+            status, response = request.next_chunk()
+        except HttpError as e:
+            API_ERRORS.inc(status=str(e.resp.status))
+            if e.resp.status in (404, 410) and request.resumable_uri:
+                # The resumable session expired on YouTube's side; start a new one.
+                logging.warning(f"Resumable session for {video_id} expired. Restarting upload from the beginning.")
+                request.resumable_uri = None
+                request.resumable_progress = 0
+                request._in_error_state = False
+                if state and video_id:
+                    state.clear_upload_session(video_id)
+                continue
+            if e.resp.status not in RETRIABLE_STATUS_CODES:
+                raise
+            error = e
+        except RETRIABLE_EXCEPTIONS as e:
+            API_ERRORS.inc(status=type(e).__name__)
+            error = e
+        else:
+            retries = 0
+            elapsed = max(time.monotonic() - started, 1e-6)
+            sent = request.resumable_progress - progress_before if status else file_size - progress_before
+            UPLOAD_BYTES.inc(sent)
+            UPLOAD_THROUGHPUT.set(sent / elapsed)
+            percent = 100 if response is not None else int(status.progress() * 100)
+            logging.info(f"Uploaded chunk of {sent / 1048576:.2f} MB at {sent / 1048576 / elapsed:.2f} MB/s ({percent}% complete).")
+            if response is None and state and video_id:
+                state.save_upload_session(video_id, request.resumable_uri, request.resumable_progress, file_size)
+            continue
+
+        retries += 1
+        if retries > MAX_CHUNK_RETRIES:
+            raise error
+        delay = min(2 ** retries + random.random(), MAX_RETRY_DELAY_SECONDS)
+        logging.warning(f"Transient error during upload ({error}). Retry {retries}/{MAX_CHUNK_RETRIES} in {delay:.1f}s.")
+        time.sleep(delay)
+    return response
 
-def upload_to_youtube(youtube, video_path, title, description, tags):
-    """Uploads a single video to YouTube."""
+def _is_quota_error(error):
+    """Checks whether an API error means the channel is out of quota."""
+    if not isinstance(error, HttpError) or error.resp.status != 403:
+        return False
+    try:
+        details = json.loads(error.content.decode("utf-8"))["error"]["errors"]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+    return any(detail.get("reason") in QUOTA_ERROR_REASONS for detail in details)
+
+def upload_to_youtube(youtube, video_path, title, description, tags, publish_at=None, state=None, video_id=None,
+                      chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE, category_id=CATEGORY_ID):
+    """
+    Uploads a single video to YouTube and returns the new YouTube video ID, or False on failure.
+    With publish_at, the video is uploaded as private and YouTube publishes it at that time.
+    `category_id` is the YouTube video category, "22" (People & Blogs) by default.
+
+    The file is sent in resumable chunks. When `state` and `video_id` are given,
+    the session URI and confirmed offset are persisted after every chunk, so an
+    upload interrupted in this or an earlier process continues where it stopped.
+
+    Raises QuotaExceededError if YouTube rejects the upload for lack of quota.
+    """
     try:
         logging.info(f"Uploading video: {video_path}")
+        status = {"privacyStatus": "public", "selfDeclaredMadeForKids": False}
+        if publish_at:
+            status["privacyStatus"] = "private"
+            status["publishAt"] = publish_at
         body = {
-            "snippet": {"title": title, "description": description, "tags": tags, "categoryId": "22"},
-            "status": {"privacyStatus": "public", "selfDeclaredMadeForKids": False}
+            "snippet": {"title": title, "description": description, "tags": tags, "categoryId": category_id},
+            "status": status
         }
-        media = MediaFileUpload(video_path, chunksize=-1, resumable=True)
+        file_size = os.path.getsize(video_path)
+        media = MediaFileUpload(video_path, chunksize=_normalize_chunk_size(chunk_size), resumable=True)
         request = youtube.videos().insert(part="snippet,status", body=body, media_body=media)
-        response = request.execute()
+
+        saved_session = state.get_upload_session(video_id) if state and video_id else None
+        if saved_session and saved_session[2] == file_size:
+            session_uri, bytes_sent, _ = saved_session
+            logging.info(f"Resuming interrupted upload of {video_id} after {bytes_sent / 1048576:.2f} MB.")
+            request.resumable_uri = session_uri
+            request.resumable_progress = bytes_sent
+            # Makes the client ask YouTube for the confirmed offset before sending more data.
+            request._in_error_state = True
+
+        upload_started = time.monotonic()
+        response = _send_chunks(request, file_size, state=state, video_id=video_id)
+        UPLOAD_SECONDS.observe(time.monotonic() - upload_started)
+        if state and video_id:
+            state.clear_upload_session(video_id)
+        UPLOADS.inc(outcome="ok")
         logging.info(f"Uploaded successfully: Video ID {response['id']}")
-        return True
+        return response['id']
     except FileNotFoundError:
+        UPLOADS.inc(outcome="missing_file")
         logging.error(f"Video file not found at {video_path}. Skipping upload.")
         return False
     except Exception as e:
+        if _is_quota_error(e):
+            UPLOADS.inc(outcome="quota_exceeded")
+            raise QuotaExceededError(str(e)) from e
+        UPLOADS.inc(outcome="failed")
         logging.error(f"Error uploading video '{title}': {e}", exc_info=True)
         return False
 
-def process_and_upload_clips(download_dir, max_uploads, stop_event):
-    """Processes metadata and uploads new, unique clips to YouTube."""
+def iter_metadata_rows(metadata_path):
+    """Streams the rows of a metadata CSV file as dicts of the columns the uploader reads."""
+    with open(metadata_path, mode='r', encoding='utf-8', newline='') as csv_file:
+        for row in csv.DictReader(csv_file):
+            yield project_metadata(row)
+
+def _candidate_fetcher(candidates, is_pending):
+    """
+    Adapts a CandidateQueue (or another source with the same
+    drain(block, max_rows), such as distributed.JobCandidates) or a plain
+    iterable of rows to the fetch_new(block, limit) callable used for ranking.
+    An iterable is handed over at once; the ranking keeps its best rows.
+    """
+    if hasattr(candidates, "drain"):
+        def fetch_from_queue(block, limit=None):
+            rows = candidates.drain(block, limit)
+            return rows if rows is None else [row for row in rows if is_pending(row)]
+        return fetch_from_queue
+
+    remaining = [row for row in candidates if is_pending(row)]
+    def fetch_once(block, limit=None):
+        nonlocal remaining
+        rows, remaining = remaining, None
+        return rows
+    return fetch_once
+
+def _run_upload_lane(channel, youtube, jobs, on_done, stop_event, state, chunk_size, delay_seconds):
+    """Uploads the jobs routed to one channel, one at a time, until it receives None."""
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        if stop_event.is_set():
+            on_done(channel, job, False, False, sent=False)
+            continue
+        youtube_id = False
+        quota_exceeded = False
+        try:
+            snippet = job["snippet"]
+            logging.info(f"[{channel}] Uploading video {job['video_id']}.")
+            youtube_id = upload_to_youtube(youtube, job["video_path"], snippet["title"], snippet["description"],
+                                           snippet["tags"], category_id=snippet.get("categoryId") or CATEGORY_ID,
+                                           publish_at=job["publish_at"], state=state, video_id=job["video_id"],
+                                           chunk_size=chunk_size)
+        except QuotaExceededError as e:
+            quota_exceeded = True
+            logging.warning(f"[{channel}] Out of quota while uploading {job['video_id']}: {e}")
+        except Exception as e:
+            logging.error(f"[{channel}] Upload lane error for {job['video_id']}: {e}", exc_info=True)
+        try:
+            state.record_upload_attempt(job["video_id"], bool(youtube_id), youtube_id=youtube_id or None,
+                                        error="quota exceeded" if quota_exceeded else None,
+                                        publish_slot=job["publish_slot"] if youtube_id else None)
+        except Exception as e:
+            logging.error(f"[{channel}] Could not record the upload of {job['video_id']}: {e}", exc_info=True)
+        if not youtube_id and not quota_exceeded:
+            logging.warning(f"Failed to upload {job['video_path']}. It will be retried on the next run.")
+        more_to_come = on_done(channel, job, youtube_id, quota_exceeded)
+
+        if youtube_id and more_to_come and delay_seconds > 0:
+            logging.info(f"[{channel}] Waiting for {delay_seconds / 3600:.2f} hours before next upload.")
+            for _ in range(delay_seconds):
+                if stop_event.is_set():
+                    logging.warning("🛑 Stop signal received during wait. Aborting wait.")
+                    break
+                time.sleep(1)
+
+def process_and_upload_clips(download_dir, max_uploads, stop_event, state=None, candidates=None,
+                             run_id=None, scheduled_publishing=False, chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE,
+                             ranking_weights=None, perceptual_hashing=False, channels=None, routing="affinity",
+                             channel_affinity=None, daily_quota_units=DEFAULT_DAILY_QUOTA_UNITS,
+                             ranking_pool_size=DEFAULT_RANKING_POOL_SIZE):
+    """
+    Processes metadata and uploads new, unique clips to YouTube.
+
+    `candidates` is an iterable of metadata rows to consider, such as the
+    pipeline's candidate queue. Without it, the run's pending videos are
+    streamed from the state store (or metadata.csv is read if there is no
+    `run_id`).
+    Pending candidates are uploaded best-first by engagement score (see
+    ranking.py); `ranking_weights` overrides the default score weights, and
+    at most `ranking_pool_size` candidates are held for ranking at once, so a
+    full pool leaves the rest in the bounded candidate queue.
+    Clips whose content fingerprint matches an uploaded video are skipped
+    before any quota is spent on them.
+
+    Uploads are spread over `channels`, each with its own upload lane
+    (thread). A ChannelRouter picks the channel by creator affinity or round
+    robin and books the insert's quota units first, so no channel is sent a
+    request it has no quota left for. `max_uploads` is the total per run. It
+    may also be a callable returning the current limit, which is then re-read
+    before each upload (except with scheduled publishing, whose schedule is
+    fixed for the run).
+
+    With `scheduled_publishing`, the day's batch is uploaded back to back as
+    private videos, each with a publishAt slot from the run's persisted
+    schedule, instead of sleeping between public uploads.
+    """
+    state = state or get_state_store()
+    channels = list(channels or [DEFAULT_CHANNEL])
     # Use the passed-in value for the upload limit
-    MAX_UPLOADS_PER_DAY = max_uploads
+    limit_source = max_uploads if callable(max_uploads) else None
+    MAX_UPLOADS_PER_DAY = limit_source() if limit_source else max_uploads
     
-    # Safely calculate delay, avoiding division by zero
-    if MAX_UPLOADS_PER_DAY > 0:
-        DELAY_SECONDS = (24 * 60 * 60) // MAX_UPLOADS_PER_DAY
+    # Safely calculate delay, avoiding division by zero. Each lane waits so that
+    # all lanes together still spread the day's uploads evenly.
+    if MAX_UPLOADS_PER_DAY > 0 and not scheduled_publishing:
+        DELAY_SECONDS = (24 * 60 * 60) * len(channels) // MAX_UPLOADS_PER_DAY
     else:
         DELAY_SECONDS = 0
     
     logging.debug("Starting YouTube upload process.")
+    lanes = {}
     try:
-        youtube = get_authenticated_service()
-        metadata_path = os.path.join(download_dir, 'metadata.csv')
-        
-        if not os.path.exists(metadata_path):
-            logging.error(f"Metadata file not found: {metadata_path}")
+        ledger = QuotaLedger(state, daily_quota_units)
+        router = ChannelRouter(channels, ledger, routing, channel_affinity)
+        services = {}
+        for channel in channels:
+            try:
+                services[channel] = get_authenticated_service(channel)
+            except Exception:
+                logging.error(f"Channel '{channel}' could not be authenticated and will not be used.")
+                router.remove(channel)
+        if not services:
+            logging.error("No YouTube channel could be authenticated. Skipping the upload stage.")
             return
-        
-        uploaded_ids = load_uploaded_ids(UPLOAD_LOG_FILE)
-        logging.info(f"Loaded {len(uploaded_ids)} previously uploaded video IDs.")
 
-        with open(metadata_path, mode='r', encoding='utf-8') as csv_file:
-            videos_to_upload = list(csv.DictReader(csv_file))
+        if candidates is None:
+            if run_id is not None:
+                # Only the needed columns of the run's not-yet-uploaded videos, streamed from the state store.
+                candidates = state.iter_pending_metadata(run_id)
+            else:
+                metadata_path = os.path.join(download_dir, 'metadata.csv')
+                if not os.path.exists(metadata_path):
+                    logging.error(f"Metadata file not found: {metadata_path}")
+                    return
+                candidates = iter_metadata_rows(metadata_path)
         
+        logging.info(f"State store holds {state.uploaded_count()} previously uploaded video IDs.")
+
         upload_count = 0
+        if scheduled_publishing:
+            if run_id is None:
+                raise ValueError("Scheduled publishing needs a run_id to persist its schedule.")
+            # A resumed run keeps the schedule it computed the first time.
+            MAX_UPLOADS_PER_DAY = state.ensure_publish_schedule(run_id, build_publish_schedule(MAX_UPLOADS_PER_DAY))
+            upload_count = state.claimed_publish_slot_count(run_id)
+            logging.info(f"Scheduled publishing: {upload_count} of {MAX_UPLOADS_PER_DAY} publish slots already used in run {run_id}.")
+
+        # Shared between the dispatcher (this thread) and the upload lanes.
+        progress_counts = {"succeeded": upload_count, "in_flight": 0}
+        held_slots = set()
+        in_flight_hashes = set()
+        quota_retries = []
+        progress_changed = threading.Condition()
+
+        def on_done(channel, job, youtube_id, quota_exceeded, sent=True):
+            if quota_exceeded:
+                ledger.exhaust(channel)
+            elif not sent:
+                # The job never reached videos.insert, so the units booked when it was routed are given back.
+                ledger.release(channel, router.cost, job["booked_at"])
+            with progress_changed:
+                progress_counts["in_flight"] -= 1
+                if job["publish_slot"]:
+                    held_slots.discard(job["publish_slot"][1])
+                in_flight_hashes.discard(job["content_hash"])
+                if youtube_id:
+                    progress_counts["succeeded"] += 1
+                elif quota_exceeded:
+                    # Another channel may still have quota for it.
+                    quota_retries.append(job["row"])
+                progress_changed.notify_all()
+                progress.update("upload", uploaded=progress_counts["succeeded"],
+                                in_flight=progress_counts["in_flight"], last_video=job["video_id"])
+                return progress_counts["succeeded"] + progress_counts["in_flight"] < MAX_UPLOADS_PER_DAY
+
+        for channel, youtube in services.items():
+            jobs = queue.Queue(maxsize=1)
+            lane = threading.Thread(
+                target=_run_upload_lane,
+                args=(channel, youtube, jobs, on_done, stop_event, state, chunk_size, DELAY_SECONDS),
+                name=f"upload-lane-{channel}",
+                daemon=True
+            )
+            lane.start()
+            lanes[channel] = (lane, jobs)
+
+        offered = set()
+
+        def is_pending(row):
+            # Uploaded or missing clips are dropped before ranking so they cannot take a top slot.
+            video_id = row.get('video_id')
+            if not video_id:
+                return True # Reported by the loop below
+            if video_id in offered:
+                return False # A backlog clip whose metadata was refreshed by this run's download
+            offered.add(video_id)
+            video_path = os.path.join(download_dir, f"@{row.get('author_username')}_video_{video_id}.mp4")
+            return not state.is_uploaded(video_id) and os.path.exists(video_path)
+
+        def next_candidate(ranked):
+            with progress_changed:
+                if quota_retries:
+                    return quota_retries.pop(0)
+            return next(ranked, None)
+
+        ranked_candidates = iter_ranked_candidates(
+            _candidate_fetcher(candidates, is_pending), max(1, MAX_UPLOADS_PER_DAY - upload_count), ranking_weights,
+            ranking_pool_size
+        )
+        progress.update("upload", status="running", uploaded=upload_count, limit=MAX_UPLOADS_PER_DAY, in_flight=0,
+                        channels=list(services))
         new_videos_found = 0
-        for row in videos_to_upload:
+        while True:
+            if limit_source and not scheduled_publishing:
+                limit = limit_source()
+                if limit != MAX_UPLOADS_PER_DAY:
+                    logging.info(f"Upload limit changed from {MAX_UPLOADS_PER_DAY} to {limit}.")
+                    MAX_UPLOADS_PER_DAY = limit
+                    progress.update("upload", limit=limit)
+            # Wait until an upload slot is free, i.e. finished plus in-flight uploads are below the limit.
+            with progress_changed:
+                while (progress_counts["in_flight"] and not stop_event.is_set()
+                       and progress_counts["succeeded"] + progress_counts["in_flight"] >= MAX_UPLOADS_PER_DAY):
+                    progress_changed.wait(0.5)
+            if stop_event.is_set():
+                logging.warning("🛑 Stop signal received. Stopping the upload stage.")
+                break
+
+            row = next_candidate(ranked_candidates)
+            if row is None:
+                with progress_changed:
+                    if not progress_counts["in_flight"]:
+                        break
+                    # A lane may still hand back a candidate it had no quota for.
+                    progress_changed.wait(0.5)
+                continue
+
             video_id = row.get('video_id')
             if not video_id:
                 logging.warning(f"Skipping row with missing video_id: {row}")
                 continue
 
-            if video_id in uploaded_ids:
+            if state.is_uploaded(video_id):
                 logging.debug(f"Skipping already uploaded video ID: {video_id}")
                 continue
 
             new_videos_found += 1
-            if upload_count >= MAX_UPLOADS_PER_DAY:
+            if progress_counts["succeeded"] >= MAX_UPLOADS_PER_DAY:
                 logging.info(f"Daily upload limit of {MAX_UPLOADS_PER_DAY} reached. More new videos are available for the next run.")
                 break
 
             username = row['author_username']
-            video_description = row.get("video_description", "")
             video_path = os.path.join(download_dir, f"@{username}_video_{video_id}.mp4")
-            
-            if os.path.exists(video_path):
-                title = video_description.split('#')[0].strip()[:90] or f"Check out this clip from {username}"
-                tiktok_tags = extract_tiktok_tags(video_description)
-                default_tags = ["shorts", "tiktok", "viral", "trending"]
-                combined_tags = list(dict.fromkeys(default_tags + tiktok_tags))
-                hashtag_string = " ".join([f"#{tag}" for tag in combined_tags])
-                full_description = f"{video_description}\n\nCredit to @{username} on TikTok.\n\n{hashtag_string}"
-                
-                logging.info(f"Attempting to upload new video {upload_count + 1} of {min(new_videos_found, MAX_UPLOADS_PER_DAY)} (ID: {video_id})")
-                
-                if upload_to_youtube(youtube, video_path, title, full_description, combined_tags):
-                    log_uploaded_id(video_id, UPLOAD_LOG_FILE)
-                    upload_count += 1
-                    
-                    if upload_count < MAX_UPLOADS_PER_DAY and DELAY_SECONDS > 0:
-                        logging.info(f"Waiting for {DELAY_SECONDS / 3600:.2f} hours before next upload.")
-                        for _ in range(DELAY_SECONDS):
-                            if stop_event.is_set():
-                                logging.warning("🛑 Stop signal received during wait. Aborting wait.")
-                                break
-                            time.sleep(1)
-                else:
-                    logging.warning(f"Failed to upload {video_path}. It will be retried on the next run.")
-            else:
+            if not os.path.exists(video_path):
                 logging.warning(f"Video file not found for ID {video_id}: {video_path}")
+                continue
+
+            duplicate_of = find_uploaded_duplicate(state, video_id, video_path, perceptual=perceptual_hashing)
+            if duplicate_of:
+                logging.info(f"Skipping video {video_id}: same content as already uploaded video {duplicate_of}.")
+                state.record_upload_attempt(video_id, False, error=f"duplicate of {duplicate_of}")
+                DUPLICATES_SKIPPED.inc()
+                continue
+            # Built right after the download; rows that bypassed the downloader get theirs here.
+            snippet = state.get_manifest(video_id)
+            if snippet is None:
+                try:
+                    snippet = build_snippet(row)
+                except ManifestError as e:
+                    logging.warning(f"Skipping video {video_id}: {e}")
+                    state.record_upload_attempt(video_id, False, error=str(e))
+                    continue
+            content_hash = state.get_fingerprint(video_id)["content_hash"]
+            if content_hash in in_flight_hashes:
+                logging.info(f"Skipping video {video_id}: the same clip is being uploaded right now.")
+                continue
+
+            booked_at = time.time()
+            channel = router.route(row, booked_at)
+            if channel is None:
+                logging.warning("⛔ Every channel is out of YouTube quota for today. More videos are left for the next run.")
+                break
+
+            publish_slot = None
+            publish_at = None
+            with progress_changed:
+                if scheduled_publishing:
+                    free_slot = state.next_free_publish_slot(run_id, exclude=held_slots)
+                    if free_slot is None:
+                        ledger.release(channel, router.cost, booked_at)
+                        logging.warning("📅 Every publish slot of the run is taken. More videos are left for the next run.")
+                        break
+                    slot_index, slot_time = free_slot
+                    held_slots.add(slot_index)
+                    publish_slot = (run_id, slot_index)
+                    # A slot that passed while the worker was down is moved to the earliest valid time.
+                    publish_at = format_publish_at(max(slot_time, time.time() + PUBLISH_LEAD_SECONDS))
+                    logging.info(f"Scheduling video {video_id} to publish at {publish_at}.")
+                progress_counts["in_flight"] += 1
+                in_flight_hashes.add(content_hash)
+                attempt = progress_counts["succeeded"] + progress_counts["in_flight"]
+            progress.update("upload", in_flight=progress_counts["in_flight"])
+
+            logging.info(f"Attempting to upload new video {attempt} of up to {MAX_UPLOADS_PER_DAY} "
+                         f"(ID: {video_id}) on channel '{channel}'.")
+            job = {"row": row, "video_id": video_id, "video_path": video_path, "publish_at": publish_at,
+                   "publish_slot": publish_slot, "content_hash": content_hash, "snippet": snippet,
+                   "booked_at": booked_at}
+            lane_jobs = lanes[channel][1]
+            while not stop_event.is_set():
+                try:
+                    lane_jobs.put(job, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            else:
+                on_done(channel, job, False, False, sent=False)
         
         if new_videos_found == 0:
             logging.info("No new videos found to upload.")
 
     except Exception as e:
         logging.critical("A critical error occurred in the upload process.", exc_info=True)
+    finally:
+        for lane, jobs in lanes.values():
+            jobs.put(None)
+        for lane, jobs in lanes.values():
+            lane.join()
+        progress.update("upload", status="stopped" if stop_event.is_set() else "done", in_flight=0)